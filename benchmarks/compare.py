@@ -0,0 +1,63 @@
+"""Compare two result files of the same benchmark, such as runs of two commits.
+
+Usage::
+
+    python -m benchmarks.compare BASELINE.json CURRENT.json [--threshold 10]
+
+Latency percentiles and throughput are listed side by side with their
+relative change. Changes beyond the threshold (in percent) in the wrong
+direction are flagged, and the exit status is 1 when there are any.
+"""
+import argparse
+import json
+import sys
+
+# Metrics where a lower value is better; the other ones are throughputs
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "errors")
+METRICS = ("per_second", "mb_per_second") + LOWER_IS_BETTER
+
+
+def load_results(path):
+    with open(path) as f:
+        document = json.load(f)
+    return document, {result["name"]: result for result in document["results"]}
+
+
+def compare(baseline, current, threshold):
+    """Yield (name, metric, baseline, current, change in percent, regression) rows."""
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in METRICS:
+            before, after = previous.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else (0.0 if after == before else float("inf"))
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            yield name, metric, before, after, change, worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Relative change (percent) flagged as a regression")
+    args = parser.parse_args(argv)
+
+    baseline_document, baseline = load_results(args.baseline)
+    current_document, current = load_results(args.current)
+    if baseline_document.get("benchmark") != current_document.get("benchmark"):
+        parser.error("the files hold results of different benchmarks")
+    print(f"{baseline_document['environment'].get('commit')} -> {current_document['environment'].get('commit')}")
+
+    regressions = 0
+    for name, metric, before, after, change, worse in compare(baseline, current, args.threshold):
+        regressions += worse
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:<45} {metric:<14} {before:>12} {after:>12} {change:>+8.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Generate a synthetic document corpus for the benchmarks.
+
+PDFs with a configurable number of text pages and JPEGs of several
+resolutions are generated from a seed, so every run gets the same bytes. A
+share of the files repeats the content of earlier ones to exercise
+deduplication. Usage::
+
+    python -m benchmarks.corpus DIRECTORY [--pdfs 40] [--pdf-pages 1,5,20] [--jpegs 20]
+                                [--resolutions 640x480,1280x960,2480x3508]
+                                [--duplicate-ratio 0.2] [--seed 0]
+"""
+import argparse
+import io
+import json
+import os
+import random
+from typing import List, NamedTuple, Sequence, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+CATEGORIES = ("DED", "INV", "BIL", "PKL", "DAU", "DOM", "BSC", "OTH")
+WORDS = (
+    "invoice", "consignee", "shipper", "container", "tariff", "declaration", "customs",
+    "freight", "vessel", "port", "quantity", "weight", "value", "origin", "goods", "HS",
+)
+
+
+class CorpusFile(NamedTuple):
+    filename: str
+    content: bytes
+    bsc_number: str
+    category: str
+
+
+def make_pdf(pages: int, rng: random.Random) -> bytes:
+    """A PDF whose pages hold a few lines of random words."""
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        for line in range(30):
+            text = " ".join(rng.choice(WORDS) for _ in range(8)) + f" {rng.randrange(10 ** 6)}"
+            page.insert_text((72, 72 + line * 22), text, fontsize=11)
+    return doc.tobytes()
+
+
+def make_jpeg(width: int, height: int, rng: random.Random) -> bytes:
+    """A JPEG of smooth random shapes, which compresses like a scanned page."""
+    # Noise upscaled from a small image gives gradients rather than incompressible pixels
+    small_width, small_height = max(1, width // 32), max(1, height // 32)
+    noise = bytes(rng.getrandbits(8) for _ in range(small_width * small_height * 3))
+    img = Image.frombytes("RGB", (small_width, small_height), noise).resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def generate_corpus(
+    pdfs: int = 40,
+    pdf_pages: Sequence[int] = (1, 5, 20),
+    jpegs: int = 20,
+    resolutions: Sequence[Tuple[int, int]] = ((640, 480), (1280, 960), (2480, 3508)),
+    duplicate_ratio: float = 0.2,
+    seed: int = 0,
+    bsc_numbers: int = 20,
+) -> List[CorpusFile]:
+    """Generate ``pdfs + jpegs`` files, ``duplicate_ratio`` of which repeat earlier content."""
+    rng = random.Random(seed)
+    kinds = [("pdf", pdf_pages[i % len(pdf_pages)]) for i in range(pdfs)]
+    kinds += [("jpeg", resolutions[i % len(resolutions)]) for i in range(jpegs)]
+    rng.shuffle(kinds)
+    duplicates = min(len(kinds) - 1, round(len(kinds) * duplicate_ratio)) if kinds else 0
+
+    contents = []
+    for kind, spec in kinds[:len(kinds) - duplicates]:
+        if kind == "pdf":
+            contents.append((".pdf", make_pdf(spec, rng)))
+        else:
+            contents.append((".jpg", make_jpeg(*spec, rng)))
+    contents += [rng.choice(contents) for _ in range(duplicates)]
+    rng.shuffle(contents)
+
+    return [
+        CorpusFile(
+            filename=f"doc{index:05d}{extension}",
+            content=content,
+            bsc_number=f"BSC{rng.randrange(bsc_numbers):04d}",
+            category=rng.choice(CATEGORIES),
+        )
+        for index, (extension, content) in enumerate(contents)
+    ]
+
+
+def write_corpus(directory: str, files: List[CorpusFile]) -> None:
+    """Write the files and a manifest of their BSC numbers and categories."""
+    os.makedirs(directory, exist_ok=True)
+    for file in files:
+        with open(os.path.join(directory, file.filename), "wb") as f:
+            f.write(file.content)
+    manifest = [
+        {"filename": file.filename, "bsc_number": file.bsc_number, "category": file.category, "size": len(file.content)}
+        for file in files
+    ]
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_resolutions(value: str) -> List[Tuple[int, int]]:
+    return [tuple(int(side) for side in item.lower().split("x")) for item in value.split(",") if item]
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options shared by the commands that generate a corpus."""
+    parser.add_argument("--pdfs", type=int, default=40)
+    parser.add_argument("--pdf-pages", type=parse_int_list, default=[1, 5, 20], help="Comma-separated page counts")
+    parser.add_argument("--jpegs", type=int, default=20)
+    parser.add_argument("--resolutions", type=parse_resolutions, default=[(640, 480), (1280, 960), (2480, 3508)],
+                        help="Comma-separated WIDTHxHEIGHT")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def corpus_from_arguments(args) -> List[CorpusFile]:
+    return generate_corpus(
+        pdfs=args.pdfs, pdf_pages=args.pdf_pages, jpegs=args.jpegs, resolutions=args.resolutions,
+        duplicate_ratio=args.duplicate_ratio, seed=args.seed
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    add_corpus_arguments(parser)
+    args = parser.parse_args(argv)
+    files = corpus_from_arguments(args)
+    write_corpus(args.directory, files)
+    print(f"Wrote {len(files)} files ({len({file.content for file in files})} distinct) to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
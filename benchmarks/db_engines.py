@@ -0,0 +1,147 @@
+"""Compare database engine profiles under a multi-process upload workload.
+
+Each profile gets a fresh database. Writer processes insert FileContent and
+Document rows with one commit per upload, like ``/upload`` behind
+``uvicorn --workers N``, while reader processes page through ``/search``
+queries. Usage::
+
+    python -m benchmarks.db_engines [--writers 4] [--uploads 250] [--readers 2]
+                                    [--postgres-url postgresql://...] [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+from benchmarks.stats import summarize
+
+# SQLite defaults before tuning: rollback journal and full fsync on every commit
+SQLITE_DEFAULT_PROFILE = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_MMAP_SIZE": "0",
+    "SQLITE_CACHE_SIZE_KB": "2000",
+}
+
+
+def _connect(database_url, profile):
+    """Import the app configured for a profile (run in a fresh process)."""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.update(profile)
+    from src.app import models
+    from src.app.database import SessionLocal, engine
+    return models, SessionLocal, engine
+
+
+def _writer(database_url, profile, uploads, ready, results):
+    models, SessionLocal, _ = _connect(database_url, profile)
+    latencies, errors = [], 0
+    ready.wait()
+    with SessionLocal() as db:
+        for i in range(uploads):
+            sha256 = uuid.uuid4().hex * 2
+            started = time.perf_counter()
+            try:
+                db.add(models.FileContent(sha256=sha256, file_path=sha256, reference_count=1, size=1024, page_count=1))
+                db.add(models.Document(
+                    uuid=str(uuid.uuid4()), bsc_number=f"BSC{i % 50}", category="INV",
+                    page_number=1, filename="bench.pdf", filesize=0.001, sha256=sha256
+                ))
+                db.commit()
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                db.rollback()
+                errors += 1
+    results.put(("write", latencies, errors))
+
+
+def _reader(database_url, profile, ready, stop, results):
+    models, SessionLocal, _ = _connect(database_url, profile)
+    from sqlalchemy import select
+    Document = models.Document
+    latencies, errors, i = [], 0, 0
+    ready.wait()
+    with SessionLocal() as db:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                db.execute(
+                    select(Document.uuid, Document.upload_datetime)
+                    .where(Document.bsc_number == f"BSC{i % 50}")
+                    .order_by(Document.upload_datetime, Document.uuid)
+                    .limit(100)
+                ).all()
+                db.rollback()
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                db.rollback()
+                errors += 1
+            i += 1
+    results.put(("read", latencies, errors))
+
+
+def _create_schema(database_url, profile):
+    models, _, engine = _connect(database_url, profile)
+    models.Base.metadata.create_all(bind=engine)
+
+
+def run_profile(name, database_url, profile, writers, uploads, readers):
+    context = multiprocessing.get_context("spawn")
+    setup = context.Process(target=_create_schema, args=(database_url, profile))
+    setup.start()
+    setup.join()
+
+    results = context.Queue()
+    stop = context.Event()
+    # Every process imports the app before the clock starts
+    ready = context.Barrier(readers + writers + 1)
+    reader_processes = [context.Process(target=_reader, args=(database_url, profile, ready, stop, results)) for _ in range(readers)]
+    writer_processes = [context.Process(target=_writer, args=(database_url, profile, uploads, ready, results)) for _ in range(writers)]
+    for process in reader_processes + writer_processes:
+        process.start()
+    ready.wait()
+    started = time.perf_counter()
+    collected = [results.get() for _ in writer_processes]
+    elapsed = time.perf_counter() - started
+    stop.set()
+    collected += [results.get() for _ in reader_processes]
+    for process in writer_processes + reader_processes:
+        process.join()
+
+    summary = {"profile": name, "elapsed_seconds": round(elapsed, 3)}
+    for kind in ("write", "read"):
+        latencies = [value for result_kind, values, _ in collected if result_kind == kind for value in values]
+        errors = sum(errors for result_kind, _, errors in collected if result_kind == kind)
+        summary[kind] = summarize(latencies, elapsed, errors)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--uploads", type=int, default=250, help="Uploads per writer")
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--postgres-url", help="Also benchmark a (dedicated, empty) PostgreSQL database")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, profile in (("sqlite-default", SQLITE_DEFAULT_PROFILE), ("sqlite-tuned", {})):
+            database_url = f"sqlite:///{os.path.join(directory, name + '.db')}"
+            results.append(run_profile(name, database_url, profile, args.writers, args.uploads, args.readers))
+    if args.postgres_url:
+        results.append(run_profile("postgresql", args.postgres_url, {}, args.writers, args.uploads, args.readers))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""In-process load test of the document API.
+
+The app is driven through its ASGI interface, without a server or network,
+against a temporary upload directory and SQLite database. The synthetic
+corpus is uploaded, then ``/list`` (following the cursors), ``/search`` and
+``/download`` are requested by concurrent clients. Usage::
+
+    python -m benchmarks.load [--concurrency 8] [--requests 500]
+                              [--pdfs 40] [--jpegs 20] [--duplicate-ratio 0.2]
+                              [--output load.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from benchmarks.corpus import CATEGORIES, add_corpus_arguments, corpus_from_arguments
+from benchmarks.stats import summarize, write_results
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+class ASGIClient:
+    """Send HTTP requests straight to an ASGI app.
+
+    A request returns once the last chunk of its response is sent, like it
+    would for a network client, while background tasks keep running until
+    ``drain`` is awaited.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._running = set()
+
+    async def request(
+        self, method: str, path: str, params: Optional[dict] = None,
+        body: bytes = b"", headers: Sequence[Tuple[str, str]] = ()
+    ) -> Response:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(params or {}).encode(),
+            "root_path": "",
+            "headers": [(b"host", b"bench")] + [(name.lower().encode(), value.encode()) for name, value in headers]
+                       + [(b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        request_sent = False
+        status = 0
+        response_headers = {}
+        chunks = []
+        response_sent = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # The body was consumed, wait until the app is done with the request
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers.update((name.decode().lower(), value.decode()) for name, value in message["headers"])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response_sent.set()
+
+        app_task = asyncio.create_task(self.app(scope, receive, send))
+        self._running.add(app_task)
+        app_task.add_done_callback(self._running.discard)
+        response_waiter = asyncio.create_task(response_sent.wait())
+        await asyncio.wait({app_task, response_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        response_waiter.cancel()
+        if app_task.done():
+            app_task.result()
+        return status, response_headers, b"".join(chunks)
+
+    async def drain(self) -> None:
+        """Wait for the background tasks of the requests sent so far."""
+        while self._running:
+            await asyncio.gather(*self._running)
+
+
+def multipart(field: str, filename: str, content: bytes, content_type: str) -> Tuple[bytes, str]:
+    """Encode a single file as a multipart/form-data body."""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+async def run_phase(
+    http: ASGIClient, name: str, requests: int, concurrency: int,
+    make_request: Callable[[int], Awaitable[Response]]
+) -> dict:
+    """Issue ``requests`` requests from ``concurrency`` clients and summarize their latency."""
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        while True:
+            index = next(counter)
+            if index >= requests:
+                return
+            started = time.perf_counter()
+            status, _, _ = await make_request(index)
+            if 200 <= status < 300:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    # Background work (such as rendition warm-up) must not leak into the next phase
+    await http.drain()
+    return {"name": name, "elapsed_seconds": round(elapsed, 3), **summarize(latencies, elapsed, errors)}
+
+
+async def run_load(app, corpus, requests: int, concurrency: int, page_size: int, seed: int) -> List[dict]:
+    client = ASGIClient(app)
+    rng = random.Random(seed)
+    uuids: List[str] = []
+
+    async def upload(index):
+        file = corpus[index]
+        content_type = "application/pdf" if file.filename.endswith(".pdf") else "image/jpeg"
+        body, header = multipart("file", file.filename, file.content, content_type)
+        response = await client.request(
+            "POST", "/api/documents/upload",
+            params={"bsc_number": file.bsc_number, "category": file.category},
+            body=body, headers=[("content-type", header)]
+        )
+        if response[0] == 200:
+            uuids.append(json.loads(response[2])["uuid"])
+        return response
+
+    cursors: List[Optional[str]] = [None]
+
+    async def list_page(index):
+        # Each request continues from a cursor returned by an earlier page
+        cursor = cursors[index % len(cursors)]
+        params = {"limit": page_size}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.request("GET", "/api/documents/list", params=params)
+        next_cursor = response[1].get("x-next-cursor")
+        if next_cursor and len(cursors) < 1000:
+            cursors.append(next_cursor)
+        return response
+
+    bsc_numbers = sorted({file.bsc_number for file in corpus})
+
+    async def search(index):
+        params = {"limit": page_size}
+        if index % 3 != 1:
+            params["bsc_number"] = rng.choice(bsc_numbers)
+        if index % 3 != 0:
+            params["category"] = rng.choice(CATEGORIES)
+        return await client.request("GET", "/api/documents/search", params=params)
+
+    async def download(index):
+        return await client.request("GET", f"/api/documents/download/{rng.choice(uuids)}")
+
+    results = [await run_phase(client, "upload", len(corpus), concurrency, upload)]
+    for name, make_request in (("list", list_page), ("search", search), ("download", download)):
+        results.append(await run_phase(client, name, requests, concurrency, make_request))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per read phase")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--process-pool-size", type=int, help="PROCESS_POOL_SIZE of the app (0 disables it)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    add_corpus_arguments(parser)
+    args = parser.parse_args(argv)
+
+    corpus = corpus_from_arguments(args)
+    with tempfile.TemporaryDirectory() as directory:
+        # The app reads its settings when it is imported
+        os.environ["UPLOAD_DIR"] = os.path.join(directory, "uploads")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        if args.process_pool_size is not None:
+            os.environ["PROCESS_POOL_SIZE"] = str(args.process_pool_size)
+        from src.app.main import app
+
+        async def run():
+            async with app.router.lifespan_context(app):
+                return await run_load(app, corpus, args.requests, args.concurrency, args.page_size, args.seed)
+        results = asyncio.run(run())
+
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    parameters["files"] = len(corpus)
+    parameters["distinct_files"] = len({file.content for file in corpus})
+    write_results("load", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
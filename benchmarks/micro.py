@@ -0,0 +1,164 @@
+"""Micro-benchmarks of hashing, page conversion and the search queries.
+
+Runs offline against a temporary upload directory and SQLite database filled
+with synthetic rows. Usage::
+
+    python -m benchmarks.micro [--repeat 20] [--rows 20000] [--output micro.json]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.corpus import CATEGORIES, make_jpeg, make_pdf
+from benchmarks.stats import summarize, write_results
+
+HASH_SIZES = (64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+
+
+def _configure(directory):
+    """Point the app at a temporary upload directory and database before it is imported.
+
+    The search cache is turned off, as repeated queries would otherwise be
+    served from it rather than run.
+    """
+    os.environ["UPLOAD_DIR"] = os.path.join(directory, "uploads")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ["SEARCH_CACHE_BACKEND"] = "none"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+
+def _time_calls(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def bench_sha256(repeat):
+    from src.app.services.processing import calculate_sha256
+    results = []
+    for size in HASH_SIZES:
+        data = os.urandom(size)
+        latencies = _time_calls(lambda: calculate_sha256(data), repeat)
+        summary = summarize(latencies, sum(latencies))
+        summary["mb_per_second"] = round(size * len(latencies) / sum(latencies) / (1024 * 1024), 1)
+        results.append({"name": f"calculate_sha256[{size // 1024}KiB]", **summary})
+    return results
+
+
+def bench_convert_to_png(directory, repeat):
+    from src.app.services.processing import convert_to_png
+    rng = random.Random(0)
+    samples = [
+        ("pdf-1-page.pdf", make_pdf(1, rng)),
+        ("pdf-5-pages.pdf", make_pdf(5, rng)),
+        ("jpeg-640x480.jpg", make_jpeg(640, 480, rng)),
+        ("jpeg-2480x3508.jpg", make_jpeg(2480, 3508, rng)),
+    ]
+    results = []
+    for filename, content in samples:
+        path = os.path.join(directory, filename)
+        with open(path, "wb") as f:
+            f.write(content)
+        latencies = _time_calls(lambda: convert_to_png(path, filename), repeat)
+        results.append({"name": f"convert_to_png[{os.path.splitext(filename)[0]}]", **summarize(latencies, sum(latencies))})
+    return results
+
+
+async def _populate(rows, bsc_numbers):
+    from src.app.database import AsyncSessionLocal
+    from src.app.models import Document, FileContent
+    rng = random.Random(0)
+    started = datetime(2024, 1, 1)
+    async with AsyncSessionLocal() as db:
+        for batch_start in range(0, rows, 5000):
+            contents, documents = [], []
+            for i in range(batch_start, min(rows, batch_start + 5000)):
+                sha256 = f"{i:064x}"
+                contents.append({"sha256": sha256, "file_path": sha256, "reference_count": 1, "size": 1024, "page_count": 1})
+                documents.append({
+                    "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "bsc_number": f"BSC{rng.randrange(bsc_numbers):04d}",
+                    "category": rng.choice(CATEGORIES),
+                    "page_number": 1,
+                    "filename": "bench.pdf",
+                    "filesize": 0.001,
+                    "upload_datetime": started + timedelta(seconds=i),
+                    "sha256": sha256,
+                })
+            await db.run_sync(lambda session: session.bulk_insert_mappings(FileContent, contents))
+            await db.run_sync(lambda session: session.bulk_insert_mappings(Document, documents))
+            await db.commit()
+
+
+async def _bench_searches(repeat, rows, page_size):
+    from src.app.database import AsyncSessionLocal
+    from src.app.services.document_service import DocumentService
+
+    async with AsyncSessionLocal() as db:
+        service = DocumentService(db)
+        # Cursor of a page deep into the listing
+        deep_cursor = None
+        for _ in range(min(50, rows // page_size)):
+            _, deep_cursor = await service.search_documents(limit=page_size, cursor=deep_cursor)
+
+        queries = {
+            "list[first page]": dict(limit=page_size),
+            "list[deep page]": dict(limit=page_size, cursor=deep_cursor),
+            "search[bsc_number]": dict(bsc_number="BSC0001", limit=page_size),
+            "search[category]": dict(category="INV", limit=page_size),
+            "search[bsc_number+category]": dict(bsc_number="BSC0001", category="INV", limit=page_size),
+        }
+        results = []
+        for name, params in queries.items():
+            latencies = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                await service.search_documents(**params)
+                latencies.append(time.perf_counter() - started)
+            results.append({"name": f"search_documents:{name}", **summarize(latencies, sum(latencies))})
+        return results
+
+
+def bench_search_queries(repeat, rows, page_size):
+    from src.app.database import Base, async_engine, engine, upgrade_schema
+    from src.app import models  # noqa: F401 - registers the tables
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+    async def run():
+        try:
+            await _populate(rows, bsc_numbers=max(1, rows // 200))
+            return await _bench_searches(repeat, rows, page_size)
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per benchmark")
+    parser.add_argument("--rows", type=int, default=20000, help="Documents in the search database")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        _configure(directory)
+        results = bench_sha256(args.repeat)
+        results += bench_convert_to_png(directory, args.repeat)
+        results += bench_search_queries(args.repeat, args.rows, args.page_size)
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results("micro", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
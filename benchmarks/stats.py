@@ -0,0 +1,57 @@
+"""Latency summaries and result files shared by the benchmarks."""
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+def percentile(values, fraction):
+    """The value below which ``fraction`` of the values fall (nearest rank)."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (in milliseconds) of timed operations."""
+    return {
+        "operations": len(latencies),
+        "errors": errors,
+        "per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def environment():
+    """Where the results were produced, so runs of different commits can be told apart."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def write_results(benchmark, parameters, results, output=None):
+    """Print the results as JSON, and write them to ``output`` when given."""
+    document = json.dumps({
+        "benchmark": benchmark,
+        "environment": environment(),
+        "parameters": parameters,
+        "results": results,
+    }, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(document)
+    print(document)
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -9,12 +10,148 @@ class Settings(BaseSettings):
     # Upload directory
     UPLOAD_DIR: str = os.path.join(BASE_DIR, "uploads")
     
+    # Content-addressed store of the originals (defaults to a "blobs" directory inside UPLOAD_DIR)
+    BLOB_DIR: Optional[str] = None
+    # Where the blobs are kept: "local" (BLOB_DIR) or "s3", an S3-compatible bucket
+    # shared by every API node (needs the aiobotocore package). Temporary files
+    # stay in BLOB_DIR. Files from S3_MULTIPART_THRESHOLD bytes are uploaded in parts
+    STORAGE_BACKEND: str = "local"
+    S3_BUCKET: Optional[str] = None
+    S3_PREFIX: str = ""
+    S3_ENDPOINT_URL: Optional[str] = None
+    S3_REGION: Optional[str] = None
+    S3_ACCESS_KEY_ID: Optional[str] = None
+    S3_SECRET_ACCESS_KEY: Optional[str] = None
+    S3_MAX_CONNECTIONS: int = 32
+    S3_MULTIPART_THRESHOLD: int = 16 * 1024 * 1024
+    S3_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024
+    # Unreferenced blobs and temporary files younger than this are kept by the garbage collector
+    GC_GRACE_SECONDS: int = 3600
+    # Compression of the stored originals: "zlib", "zstd" (needs the zstandard
+    # package) or "none". Files smaller than STORAGE_COMPRESS_MIN_BYTES, or that
+    # shrink by less than the STORAGE_COMPRESS_MIN_SAVINGS fraction, are stored as is
+    STORAGE_CODEC: str = "none"
+    STORAGE_CODEC_LEVEL: Optional[int] = None
+    STORAGE_COMPRESS_MIN_BYTES: int = 64 * 1024
+    STORAGE_COMPRESS_MIN_SAVINGS: float = 0.1
+    # Integrity scrubber: threads re-hashing the blobs, and the bytes they may
+    # read per second together (0 removes the limit)
+    SCRUB_WORKERS: int = 2
+    SCRUB_MAX_BYTES_PER_SECOND: int = 32 * 1024 * 1024
+    
     # Allowed file extensions
     ALLOWED_EXTENSIONS: set = {".pdf", ".jpg", ".jpeg"}
+
+    # Size of the chunks read from an upload while it is hashed and spooled to disk
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    # Maximum number of files (including ZIP members) in a batch upload
+    BATCH_MAX_FILES: int = 200
+    # Resumable uploads: maximum file size, and time after the last chunk (or
+    # after completion) when a session is removed by the garbage collector
+    UPLOAD_SESSION_MAX_BYTES: int = 4 * 1024 * 1024 * 1024
+    UPLOAD_SESSION_TTL_SECONDS: int = 24 * 3600
+    # ZIP exports: the documents are read EXPORT_PAGE_SIZE at a time while the
+    # archive streams, and content shared by several documents is read once,
+    # kept for the copies in memory up to EXPORT_DUPLICATE_BUFFER_BYTES in total
+    # and in temporary files beyond
+    EXPORT_PAGE_SIZE: int = 500
+    EXPORT_DUPLICATE_BUFFER_BYTES: int = 64 * 1024 * 1024
+
+    # Number of worker processes serving the app (read by uvicorn and gunicorn
+    # as the default of --workers), which share the CPUs of the host
+    WEB_CONCURRENCY: int = 1
+    # Process pool for CPU-bound rendering in each worker process (None splits
+    # the CPUs between the WEB_CONCURRENCY workers, 0 disables it). Its processes
+    # are started with PROCESS_POOL_START_METHOD (None uses forkserver where
+    # available, spawn otherwise) rather than forked from the threads of the app
+    PROCESS_POOL_SIZE: Optional[int] = None
+    PROCESS_POOL_MAX_TASKS_PER_CHILD: Optional[int] = 100
+    PROCESS_POOL_START_METHOD: Optional[str] = None
+
+    # Page rendition cache (defaults to a "renditions" directory inside UPLOAD_DIR)
+    RENDITION_DIR: Optional[str] = None
+    RENDITION_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    RENDITION_DPI: int = 100
+    RENDITION_MAX_DPI: int = 300
+    RENDITION_FORMATS: set = {"png", "jpeg"}
+    # Number of leading pages rendered in the background after an upload (0 disables it)
+    RENDITION_WARMUP_PAGES: int = 1
+
+    # Parsed PDFs kept open by each worker process for page extraction, evicted
+    # in least-recently-used order past either bound
+    PDF_POOL_MAX_DOCUMENTS: int = 16
+    PDF_POOL_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # Full-text index of the PDF text layer, extracted in the background once per
+    # content; ranked results are picked among the best TEXT_SEARCH_CANDIDATES pages
+    # of the newest TEXT_SEARCH_SCAN_LIMIT matching ones
+    TEXT_INDEX_ENABLED: bool = True
+    TEXT_SEARCH_CANDIDATES: int = 1000
+    TEXT_SEARCH_SCAN_LIMIT: int = 20000
+    TEXT_SEARCH_MAX_LIMIT: int = 100
+    TEXT_SEARCH_SNIPPET_WORDS: int = 16
+
+    # Near-duplicate detection from perceptual hashes of the pages, computed in
+    # the background once per content: contents are near-duplicates when at least
+    # NEAR_DUPLICATE_MIN_SIMILARITY of their pages are within NEAR_DUPLICATE_MAX_DISTANCE
+    # bits of each other (out of 64). Lookups read at most NEAR_DUPLICATE_MAX_CANDIDATES
+    # pages per batch of hashes, those with the most matching bands first
+    NEAR_DUPLICATE_ENABLED: bool = True
+    NEAR_DUPLICATE_MAX_DISTANCE: int = 6
+    NEAR_DUPLICATE_MIN_SIMILARITY: float = 0.8
+    NEAR_DUPLICATE_MAX_CANDIDATES: int = 10000
     
+    # Pagination of the list and search endpoints
+    PAGE_SIZE: int = 100
+    MAX_PAGE_SIZE: int = 1000
+    # Rows fetched per round-trip when streaming NDJSON results
+    STREAM_BATCH_SIZE: int = 1000
+    # Cache of search result pages: "memory" (per worker process, so only used
+    # with a single worker), "sqlite" (shared by the workers of a host through
+    # SEARCH_CACHE_PATH, defaulting to a file inside UPLOAD_DIR) or "none". None
+    # picks memory for a single worker and sqlite for several
+    SEARCH_CACHE_BACKEND: Optional[str] = None
+    SEARCH_CACHE_PATH: Optional[str] = None
+    SEARCH_CACHE_MAX_ENTRIES: int = 1024
+    SEARCH_CACHE_TTL_SECONDS: float = 60
+
     # Database URL
     DATABASE_URL: str = "sqlite:///./documents.db"
+    # Database URL of the async engine serving the requests (defaults to
+    # DATABASE_URL with the aiosqlite or asyncpg driver)
+    ASYNC_DATABASE_URL: Optional[str] = None
+
+    # SQLite tuning, applied to every connection (an empty journal mode or
+    # synchronous setting keeps the SQLite default)
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024
+
+    # Group commit: uploads of a worker process queue their rows and a writer
+    # commits the ones queued within the interval (up to the maximum) together
+    GROUP_COMMIT_ENABLED: bool = False
+    GROUP_COMMIT_INTERVAL_MS: float = 2.0
+    GROUP_COMMIT_MAX_WRITES: int = 64
+
+    # Connection pool for server databases such as PostgreSQL
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
     
+    # Request metrics exposed at /metrics, and the latency (in milliseconds)
+    # above which a request is logged with its stage breakdown (None disables it)
+    METRICS_ENABLED: bool = True
+    SLOW_REQUEST_LOG_MS: Optional[int] = None
+    # With several worker processes, each one writes its metrics to METRICS_DIR
+    # (defaulting to a "metrics" directory inside UPLOAD_DIR) every
+    # METRICS_PUBLISH_SECONDS, and /metrics reports their sum
+    METRICS_DIR: Optional[str] = None
+    METRICS_PUBLISH_SECONDS: float = 5.0
+
     # API settings
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "Document Management API"
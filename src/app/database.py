@@ -1,17 +1,117 @@
-from sqlalchemy import create_engine
+from sqlalchemy import BigInteger, Integer, create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """Apply the SQLite pragmas of the settings to a new connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        if settings.SQLITE_JOURNAL_MODE:
+            cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        if settings.SQLITE_SYNCHRONOUS:
+            cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        # A negative cache size is expressed in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+    finally:
+        cursor.close()
+
+def engine_options(database_url: str) -> dict:
+    """Engine keyword arguments of the profile matching a database URL.
+
+    SQLite gets a busy timeout (its pragmas are applied on connect), other
+    databases such as PostgreSQL get a tuned connection pool.
+    """
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {
+            "connect_args": {
+                "check_same_thread": False,
+                "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000,
+            }
+        }
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def create_db_engine(database_url: str = None) -> Engine:
+    """Create an engine with the profile matching its database URL."""
+    database_url = database_url or settings.DATABASE_URL
+    db_engine = create_engine(database_url, **engine_options(database_url))
+    if db_engine.dialect.name == "sqlite":
+        event.listen(db_engine, "connect", configure_sqlite_connection)
+    return db_engine
+
+# Drivers used by the async engine when the database URL names a blocking one
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+def async_database_url(database_url: str = None) -> str:
+    """The database URL with the async driver of its backend."""
+    if database_url is None and settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = make_url(database_url or settings.DATABASE_URL)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and url.get_driver_name() != ASYNC_DRIVERS[backend]:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url.render_as_string(hide_password=False)
+
+def create_async_db_engine(database_url: str = None) -> AsyncEngine:
+    """Create an async engine with the profile matching its database URL."""
+    database_url = async_database_url(database_url)
+    db_engine = create_async_engine(database_url, **engine_options(database_url))
+    if db_engine.dialect.name == "sqlite":
+        event.listen(db_engine.sync_engine, "connect", configure_sqlite_connection)
+    return db_engine
+
+# The blocking engine creates the schema and serves the maintenance commands,
+# requests go through the async one
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    """Get database session."""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close() 
\ No newline at end of file
+def upgrade_schema(bind):
+    """Add columns and indexes introduced after a table was first created.
+
+    ``create_all`` only creates missing tables, so new nullable columns are
+    added to existing databases with ``ALTER TABLE``. On PostgreSQL, integer
+    columns that became ``BigInteger`` are widened too (SQLite integers are
+    64-bit already).
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if (
+                    bind.dialect.name == "postgresql" and column.name in existing
+                    and isinstance(column.type, BigInteger) and not isinstance(existing[column.name], BigInteger)
+                    and isinstance(existing[column.name], Integer)
+                ):
+                    conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT'))
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+async def get_async_db():
+    """Get async database session."""
+    async with AsyncSessionLocal() as db:
+        yield db 
\ No newline at end of file
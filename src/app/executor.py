@@ -0,0 +1,64 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def process_pool_size() -> int:
+    """Size of the process pool of a worker, splitting the CPUs between the workers by default."""
+    if settings.PROCESS_POOL_SIZE is not None:
+        return settings.PROCESS_POOL_SIZE
+    return max(1, (os.cpu_count() or 1) // max(1, settings.WEB_CONCURRENCY))
+
+
+def process_pool_context() -> multiprocessing.context.BaseContext:
+    """Start method of the pool processes.
+
+    Forking the multithreaded worker process could copy locks held by other
+    threads, so the processes come from a fork server or are spawned.
+    """
+    method = settings.PROCESS_POOL_START_METHOD
+    if method is None:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def start_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Start the process pool used for CPU-bound work."""
+    global _process_pool
+    if _process_pool is None and process_pool_size() != 0:
+        kwargs = {"max_workers": process_pool_size(), "mp_context": process_pool_context()}
+        if settings.PROCESS_POOL_MAX_TASKS_PER_CHILD and sys.version_info >= (3, 11):
+            kwargs["max_tasks_per_child"] = settings.PROCESS_POOL_MAX_TASKS_PER_CHILD
+        _process_pool = ProcessPoolExecutor(**kwargs)
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """Shut down the process pool, waiting for running tasks."""
+    global _process_pool
+    if _process_pool is not None:
+        kwargs = {"cancel_futures": True} if sys.version_info >= (3, 9) else {}
+        _process_pool.shutdown(wait=True, **kwargs)
+        _process_pool = None
+
+
+async def run_cpu_bound(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a CPU-bound function off the event loop.
+
+    The function runs in the process pool when it is started, otherwise in the
+    thread pool so the event loop is never blocked.
+    """
+    if _process_pool is None:
+        return await run_in_threadpool(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_process_pool, partial(func, *args, **kwargs))
@@ -1,16 +1,56 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 
-from .routers import document_router
-from .database import engine, Base
+from .routers import admin_router, document_router, upload_router
+from .database import async_engine, engine, Base, upgrade_schema
+from .config import settings
+from .executor import start_process_pool, shutdown_process_pool
+from .metrics import (
+    MetricsMiddleware, metrics_dir, metrics_state, publish_metrics_periodically, render_metrics, retire_exited_workers
+)
+from .services.blob_store import blob_store
+from .services.document_pool import pdf_pool
+from .services.group_commit import group_commit
+from .services.text_index import create_text_index
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+create_text_index(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop the resources shared by the requests."""
+    start_process_pool()
+    # Other worker processes may serve /metrics
+    publisher = None
+    if settings.METRICS_ENABLED and metrics_dir() is not None:
+        await run_in_threadpool(retire_exited_workers)
+        publisher = asyncio.create_task(publish_metrics_periodically())
+    try:
+        yield
+    finally:
+        if publisher is not None:
+            publisher.cancel()
+            with suppress(asyncio.CancelledError):
+                await publisher
+        if group_commit is not None:
+            await group_commit.stop()
+        shutdown_process_pool()
+        pdf_pool.clear()
+        await blob_store.close()
+        await async_engine.dispose()
 
 app = FastAPI(
     title="Document Management API",
     description="API for managing documents with deduplication support",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -20,12 +60,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Location", "Upload-Offset", "Upload-Length", "Upload-Expires"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
+app.include_router(upload_router.router, prefix="/api/documents/uploads", tags=["uploads"])
 app.include_router(document_router.router, prefix="/api/documents", tags=["documents"])
+app.include_router(admin_router.router, prefix="/api/admin", tags=["admin"])
 
 @app.get("/")
 def read_root():
     """Root endpoint."""
-    return {"message": "Document Management API is running"} 
\ No newline at end of file
+    return {"message": "Document Management API is running"} 
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def metrics():
+        """Request metrics in the Prometheus text format.
+
+        The values of this process are read on the event loop, which updates
+        them, and the files of the other worker processes in the thread pool.
+        """
+        text = await run_in_threadpool(render_metrics, metrics_state())
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,92 @@
+"""Maintenance commands.
+
+Usage::
+
+    python -m src.app.maintenance migrate-storage
+    python -m src.app.maintenance gc [--grace-seconds N] [--dry-run]
+    python -m src.app.maintenance index-text
+    python -m src.app.maintenance hash-pages
+    python -m src.app.maintenance compress-storage [--codec zlib|zstd]
+    python -m src.app.maintenance rebuild-stats
+    python -m src.app.maintenance scrub [--workers N] [--max-bytes-per-second N] [--limit N] [--restart]
+"""
+import argparse
+import json
+
+from . import models  # noqa: F401 (registers the tables)
+from .database import Base, SessionLocal, engine, upgrade_schema
+from .services.blob_store import blob_store
+from .services.storage_maintenance import (
+    collect_garbage, compress_stored_content, index_missing_page_hashes, index_missing_text,
+    migrate_legacy_layout, rebuild_document_stats
+)
+from .services.scrubber import scrub_storage
+from .services.text_index import create_text_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Document Management API maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "migrate-storage", help="Move originals from the per-document layout into the blob store"
+    )
+
+    gc_parser = commands.add_parser(
+        "gc", help="Remove unreferenced content, orphaned blobs and stale temporary files"
+    )
+    gc_parser.add_argument("--grace-seconds", type=int, default=None)
+    gc_parser.add_argument("--dry-run", action="store_true")
+
+    commands.add_parser(
+        "index-text", help="Add the text of content stored before it was indexed to the full-text index"
+    )
+
+    commands.add_parser(
+        "hash-pages", help="Hash the pages of content stored before near-duplicates were detected"
+    )
+
+    compress_parser = commands.add_parser(
+        "compress-storage", help="Compress stored originals with the storage codec, like new uploads"
+    )
+    compress_parser.add_argument("--codec", default=None, help="Codec to use instead of STORAGE_CODEC")
+
+    commands.add_parser(
+        "rebuild-stats", help="Recompute the document statistics from the documents"
+    )
+
+    scrub_parser = commands.add_parser(
+        "scrub", help="Re-hash the stored blobs and record the missing or damaged ones, resuming the last pass"
+    )
+    scrub_parser.add_argument("--workers", type=int, default=None)
+    scrub_parser.add_argument("--max-bytes-per-second", type=int, default=None, help="0 removes the limit")
+    scrub_parser.add_argument("--limit", type=int, default=None, help="Contents to check in this run")
+    scrub_parser.add_argument("--restart", action="store_true", help="Start a new pass from the first content")
+
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    create_text_index(engine)
+
+    # Remote storage backends are reached through an event loop in a helper thread
+    with blob_store.blocking_portal(), SessionLocal() as db:
+        if args.command == "migrate-storage":
+            result = migrate_legacy_layout(db)
+        elif args.command == "gc":
+            result = collect_garbage(db, args.grace_seconds, args.dry_run)
+        elif args.command == "index-text":
+            result = index_missing_text(db)
+        elif args.command == "hash-pages":
+            result = index_missing_page_hashes(db)
+        elif args.command == "compress-storage":
+            result = compress_stored_content(db, args.codec)
+        elif args.command == "rebuild-stats":
+            result = rebuild_document_stats(db)
+        elif args.command == "scrub":
+            result = scrub_storage(db, args.workers, args.max_bytes_per_second, args.limit, args.restart)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
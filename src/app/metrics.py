@@ -0,0 +1,453 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not POSIX
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# File of the metrics directory summing the counters of the worker processes that exited
+RETIRED_METRICS = "retired.json"
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A metric family with optional labels, rendered in the Prometheus text format.
+
+    Updates happen on the event loop, so no locking is needed.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+
+    def samples(self) -> Iterator[str]:
+        for values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+
+    def state(self) -> list:
+        """The values as JSON, merged with the ones of the other worker processes."""
+        return [[list(values), value] for values, value in list(self._values.items())]
+
+    def merge(self, state: list) -> None:
+        for values, value in state:
+            values = tuple(values)
+            self._values[values] = self._values.get(values, 0) + value
+
+    def empty(self) -> "Metric":
+        """A metric of the same family without values."""
+        metric = copy.copy(self)
+        metric._values = {}
+        return metric
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Per label values: the count of each bucket (plus +Inf), the sum and the count
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, totals = series
+        counts[bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def state(self) -> list:
+        return [[list(values), list(counts), list(totals)] for values, (counts, totals) in list(self._series.items())]
+
+    def merge(self, state: list) -> None:
+        for values, counts, totals in state:
+            series = self._series.setdefault(tuple(values), ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            for index, count in enumerate(counts):
+                series[0][index] += count
+            series[1][0] += totals[0]
+            series[1][1] += totals[1]
+
+    def empty(self) -> "Histogram":
+        metric = copy.copy(self)
+        metric._series = {}
+        return metric
+
+    def samples(self) -> Iterator[str]:
+        for values, (counts, totals) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(totals[0])}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {totals[1]}"
+
+
+REQUESTS_IN_FLIGHT = Gauge(
+    "docapi_requests_in_flight", "HTTP requests being processed.")
+REQUEST_DURATION = Histogram(
+    "docapi_request_duration_seconds", "Time until the response was sent, by endpoint.", ("operation",))
+STAGE_DURATION = Histogram(
+    "docapi_stage_duration_seconds", "Time spent in each stage of a request, by endpoint.", ("operation", "stage"))
+UPLOADS = Counter(
+    "docapi_uploaded_files_total", "Uploaded files by whether their content was already stored.", ("result",))
+UPLOAD_BYTES = Counter(
+    "docapi_upload_bytes_total", "Bytes received in uploaded files.")
+DEDUP_HIT_RATIO = Gauge(
+    "docapi_dedup_hit_ratio", "Share of uploaded files whose content was already stored.")
+SEARCH_CACHE_LOOKUPS = Counter(
+    "docapi_search_cache_lookups_total", "Search result cache lookups by outcome.", ("result",))
+PDF_POOL_LOOKUPS = Counter(
+    "docapi_pdf_pool_lookups_total", "Parsed PDF pool lookups by outcome.", ("result",))
+GROUP_COMMIT_SIZE = Histogram(
+    "docapi_group_commit_writes", "Writes committed together by the group-commit writer.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+REGISTRY: List[Metric] = [
+    REQUESTS_IN_FLIGHT, REQUEST_DURATION, STAGE_DURATION, UPLOADS, UPLOAD_BYTES, DEDUP_HIT_RATIO,
+    SEARCH_CACHE_LOOKUPS, PDF_POOL_LOOKUPS, GROUP_COMMIT_SIZE,
+]
+
+
+class RequestTrace:
+    """The stages timed while processing one request."""
+
+    __slots__ = ("started", "stages", "finished")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.finished = False
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add time spent in a stage to the current request."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+
+class stage:
+    """Time a block of a request as one of its stages.
+
+    Outside a traced request (or with metrics disabled) it only reads the clock.
+    """
+
+    __slots__ = ("name", "_started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        record_stage(self.name, time.perf_counter() - self._started)
+
+
+def record_upload(size: int, deduplicated: bool) -> None:
+    """Count an uploaded file and its bytes."""
+    if not settings.METRICS_ENABLED:
+        return
+    UPLOADS.inc("deduplicated" if deduplicated else "stored")
+    UPLOAD_BYTES.inc(amount=size)
+
+
+def record_search_cache_lookup(hit: bool) -> None:
+    """Count a lookup in the search result cache."""
+    if settings.METRICS_ENABLED:
+        SEARCH_CACHE_LOOKUPS.inc("hit" if hit else "miss")
+
+
+def record_pdf_pool_lookup(hit: bool) -> None:
+    """Count a lookup in the pool of parsed PDFs."""
+    if settings.METRICS_ENABLED:
+        PDF_POOL_LOOKUPS.inc("hit" if hit else "miss")
+
+
+def record_group_commit(writes: int) -> None:
+    """Count a transaction of the group-commit writer and the writes it committed."""
+    if settings.METRICS_ENABLED:
+        GROUP_COMMIT_SIZE.observe(writes)
+
+
+class MetricsMiddleware:
+    """Trace every HTTP request: in-flight gauge, latency and per-stage breakdown.
+
+    Time spent waiting for the request body is recorded as the ``receive``
+    stage, since the body of an upload is read before the endpoint runs. The
+    request is finished when the last chunk of the response is sent, so
+    background tasks are not counted, and it is labelled with the name of
+    the endpoint that handled it. Requests slower than ``SLOW_REQUEST_LOG_MS``
+    are logged with their stage breakdown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        REQUESTS_IN_FLIGHT.inc()
+        status = []
+
+        async def timed_receive():
+            started = time.perf_counter()
+            message = await receive()
+            if message["type"] == "http.request":
+                record_stage("receive", time.perf_counter() - started)
+            return message
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                self._finish(scope, trace, status)
+
+        try:
+            await self.app(scope, timed_receive, traced_send)
+        finally:
+            self._finish(scope, trace, status)
+            _current_trace.reset(token)
+
+    @staticmethod
+    def _finish(scope, trace: RequestTrace, status: List[int]) -> None:
+        if trace.finished:
+            return
+        trace.finished = True
+        elapsed = time.perf_counter() - trace.started
+        endpoint = scope.get("endpoint")
+        operation = getattr(endpoint, "__name__", "unmatched")
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_DURATION.observe(elapsed, operation)
+        for name, seconds in trace.stages.items():
+            STAGE_DURATION.observe(seconds, operation, name)
+        if settings.SLOW_REQUEST_LOG_MS is not None and elapsed * 1000 >= settings.SLOW_REQUEST_LOG_MS:
+            breakdown = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in trace.stages.items())
+            logger.warning(
+                "Slow request %s %s (%s): %.1fms, status %s (%s)",
+                scope["method"], scope["path"], operation, elapsed * 1000,
+                status[0] if status else "none", breakdown or "no stages"
+            )
+
+
+def metrics_dir() -> Optional[str]:
+    """Directory where the worker processes publish their metrics, None with a single worker."""
+    if settings.METRICS_DIR:
+        return settings.METRICS_DIR
+    if settings.WEB_CONCURRENCY > 1:
+        return os.path.join(settings.UPLOAD_DIR, "metrics")
+    return None
+
+
+def metrics_state() -> Dict[str, Any]:
+    """Values of every metric of this worker process, as JSON."""
+    return {metric.name: metric.state() for metric in REGISTRY}
+
+
+def publish_metrics(state: Dict[str, Any]) -> None:
+    """Write the metrics of this worker process for the ones serving /metrics."""
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".part", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".part", path)
+
+
+async def publish_metrics_periodically() -> None:
+    """Publish the metrics of this worker process every ``METRICS_PUBLISH_SECONDS`` until cancelled."""
+    try:
+        while True:
+            await asyncio.sleep(settings.METRICS_PUBLISH_SECONDS)
+            await run_in_threadpool(publish_metrics, metrics_state())
+    finally:
+        publish_metrics(metrics_state())
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock(directory: str, exclusive: bool) -> Iterator[None]:
+    """Lock the metrics directory: shared to read it, exclusive to fold the files of exited workers."""
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def _load_state(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _worker_files(directory: str) -> Iterator[Tuple[int, str]]:
+    """The pid and metrics file of each worker process that published its metrics."""
+    for entry in os.scandir(directory):
+        name, extension = os.path.splitext(entry.name)
+        if extension == ".json" and name.isdigit():
+            yield int(name), entry.path
+
+
+def retire_exited_workers() -> None:
+    """Fold the metrics files of the worker processes that exited into one, removing theirs.
+
+    Their counters and histograms keep counting in the sums, their gauges
+    are dropped. Runs when a worker starts, before it publishes, so a file
+    left under its pid by an earlier process is folded too.
+    """
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    with _directory_lock(directory, exclusive=True):
+        exited = [
+            path for pid, path in _worker_files(directory)
+            if pid == os.getpid() or not _process_alive(pid)
+        ]
+        if not exited:
+            return
+        retired = {metric.name: metric.empty() for metric in REGISTRY if metric.kind != "gauge"}
+        retired_path = os.path.join(directory, RETIRED_METRICS)
+        for path in [retired_path] + exited:
+            for metric_name, state in (_load_state(path) or {}).items():
+                if metric_name in retired:
+                    retired[metric_name].merge(state)
+        with open(retired_path + ".part", "w") as f:
+            json.dump({name: metric.state() for name, metric in retired.items()}, f)
+        os.replace(retired_path + ".part", retired_path)
+        for path in exited:
+            os.remove(path)
+
+
+def collect_metrics(state: Dict[str, Any]) -> List[Metric]:
+    """The metrics of every worker process of the host, summed.
+
+    ``state`` holds the values of this worker process (see
+    ``metrics_state``). The registry is not touched, so this can run off
+    the event loop. Counters and histograms of workers that exited are kept
+    so they never go backwards; gauges only count the live workers.
+    """
+    merged = {metric.name: metric.empty() for metric in REGISTRY}
+    for metric_name, values in state.items():
+        merged[metric_name].merge(values)
+    directory = metrics_dir()
+    if directory is None:
+        return [merged[metric.name] for metric in REGISTRY]
+    os.makedirs(directory, exist_ok=True)
+    with _directory_lock(directory, exclusive=False):
+        # The values of this process are taken from memory, the freshest ones
+        files: List[Tuple[Optional[int], str]] = [
+            (pid, path) for pid, path in _worker_files(directory) if pid != os.getpid()
+        ]
+        files.append((None, os.path.join(directory, RETIRED_METRICS)))
+        for pid, path in files:
+            states = _load_state(path)
+            if states is None:
+                continue
+            alive = pid is not None and _process_alive(pid)
+            for metric_name, values in states.items():
+                metric = merged.get(metric_name)
+                if metric is not None and (alive or metric.kind != "gauge"):
+                    metric.merge(values)
+    return [merged[metric.name] for metric in REGISTRY]
+
+
+def render_metrics(state: Dict[str, Any]) -> str:
+    """All metrics in the Prometheus text exposition format, from the values of this process."""
+    metrics = collect_metrics(state)
+    by_name = {metric.name: metric for metric in metrics}
+    uploads = by_name[UPLOADS.name]
+    deduplicated = uploads.value("deduplicated")
+    total = deduplicated + uploads.value("stored")
+    by_name[DEDUP_HIT_RATIO.name].set(deduplicated / total if total else 0.0)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
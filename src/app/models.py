@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey
+from sqlalchemy import BigInteger, Boolean, Column, String, Integer, Float, DateTime, ForeignKey, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -9,13 +9,28 @@ class FileContent(Base):
 
     sha256 = Column(String, primary_key=True, index=True, comment="SHA256 hash of the file content")
     file_path = Column(String, unique=True, nullable=False, comment="Path to the stored file")
+    codec = Column(String, nullable=True, comment="Codec compressing the stored file (None when stored as is)")
     reference_count = Column(Integer, default=1, comment="Number of documents referencing this content")
+    size = Column(BigInteger, nullable=True, comment="Size of the content in bytes")
+    mime_type = Column(String, nullable=True, comment="MIME type of the content")
+    page_count = Column(Integer, nullable=True, comment="Number of pages (or frames) in the content")
+    width = Column(Integer, nullable=True, comment="Width of the first page (PDF points or image pixels)")
+    height = Column(Integer, nullable=True, comment="Height of the first page (PDF points or image pixels)")
+    text_indexed_at = Column(DateTime, nullable=True, comment="When the text layer was added to the full-text index")
+    page_hashes_at = Column(DateTime, nullable=True, comment="When the perceptual hashes of the pages were computed")
 
     documents = relationship("Document", back_populates="file_content")
+    pages = relationship("ContentPage", back_populates="file_content")
 
 class Document(Base):
     """Represents a document with its metadata and reference to file content."""
     __tablename__ = "documents"
+    __table_args__ = (
+        # Keyset pagination on (upload_datetime, uuid), optionally filtered
+        Index("ix_documents_upload_datetime_uuid", "upload_datetime", "uuid"),
+        Index("ix_documents_bsc_number_upload_datetime_uuid", "bsc_number", "upload_datetime", "uuid"),
+        Index("ix_documents_category_upload_datetime_uuid", "category", "upload_datetime", "uuid"),
+    )
 
     uuid = Column(String, primary_key=True, index=True, comment="Unique identifier for the document")
     bsc_number = Column(String, index=True, nullable=False, comment="BSC number associated with the document")
@@ -27,4 +42,108 @@ class Document(Base):
     sha256 = Column(String, ForeignKey("file_contents.sha256"), index=True, nullable=False, comment="Reference to file content")
     
     # Relationship
-    file_content = relationship("FileContent", back_populates="documents") 
\ No newline at end of file
+    file_content = relationship("FileContent", back_populates="documents") 
+
+class ContentPage(Base):
+    """Text layer of one page of stored content, indexed for full-text search."""
+    __tablename__ = "content_pages"
+    __table_args__ = (
+        Index("ix_content_pages_sha256_page", "sha256", "page"),
+    )
+
+    id = Column(Integer, primary_key=True, comment="Row id, also the rowid of the full-text index")
+    sha256 = Column(String, ForeignKey("file_contents.sha256"), nullable=False, comment="Reference to file content")
+    page = Column(Integer, nullable=False, comment="Page number (1-based)")
+    body = Column(Text, nullable=False, comment="Extracted text of the page")
+
+    file_content = relationship("FileContent", back_populates="pages")
+
+class PageHash(Base):
+    """Perceptual hash (pHash) of one page of stored content, split into bands for lookups."""
+    __tablename__ = "page_hashes"
+    __table_args__ = (
+        Index("ix_page_hashes_sha256_page", "sha256", "page"),
+        # Multi-index hashing: near hashes share at least one nearly equal band
+        Index("ix_page_hashes_band0", "band0"),
+        Index("ix_page_hashes_band1", "band1"),
+        Index("ix_page_hashes_band2", "band2"),
+        Index("ix_page_hashes_band3", "band3"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String, ForeignKey("file_contents.sha256"), nullable=False, comment="Reference to file content")
+    page = Column(Integer, nullable=False, comment="Page number (1-based)")
+    phash = Column(BigInteger, nullable=False, comment="64-bit perceptual hash of the page, as a signed integer")
+    band0 = Column(Integer, nullable=False, comment="Bits 48-63 of the hash")
+    band1 = Column(Integer, nullable=False, comment="Bits 32-47 of the hash")
+    band2 = Column(Integer, nullable=False, comment="Bits 16-31 of the hash")
+    band3 = Column(Integer, nullable=False, comment="Bits 0-15 of the hash")
+
+class SimilarContent(Base):
+    """Two contents whose pages look alike, stored once in each direction."""
+    __tablename__ = "similar_contents"
+
+    sha256 = Column(String, ForeignKey("file_contents.sha256"), primary_key=True, comment="Reference to file content")
+    similar_sha256 = Column(String, ForeignKey("file_contents.sha256"), primary_key=True, index=True, comment="Reference to the similar content")
+    similarity = Column(Float, nullable=False, comment="Share of the pages matching a page of the other content")
+
+class UploadSession(Base):
+    """A resumable upload whose chunks are assembled on disk until it is finalized."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, comment="Unique identifier of the upload")
+    bsc_number = Column(String, nullable=False, comment="BSC number of the document to create")
+    category = Column(String, nullable=False, comment="Category of the document to create")
+    filename = Column(String, nullable=False, comment="Original filename")
+    length = Column(BigInteger, nullable=False, comment="Total size of the file in bytes")
+    received = Column(Text, nullable=False, default="[]", comment="JSON list of the [start, end) byte ranges received")
+    status = Column(String, nullable=False, default="open", comment="open, finalizing, completed or failed")
+    overlapped = Column(Boolean, nullable=True, comment="Whether chunks overlapped, so the file is hashed again when finalized")
+    document_uuid = Column(String, nullable=True, comment="Document created when the upload was finalized")
+    created_at = Column(DateTime, nullable=False, default=datetime.now, comment="Timestamp of creation")
+    expires_at = Column(DateTime, nullable=False, index=True, comment="When the upload is abandoned and removed")
+
+class DocumentStats(Base):
+    """Totals of the documents of a group, kept up to date by every write."""
+    __tablename__ = "document_stats"
+
+    dimension = Column(String, primary_key=True, comment="total, category or bsc_number")
+    value = Column(String, primary_key=True, comment="Category or BSC number of the group (empty for the total)")
+    document_count = Column(Integer, nullable=False, default=0, comment="Number of documents")
+    total_bytes = Column(BigInteger, nullable=False, default=0, comment="Size of the documents in bytes")
+    page_count = Column(BigInteger, nullable=False, default=0, comment="Number of pages of the documents")
+    content_count = Column(Integer, nullable=False, default=0, comment="Number of distinct contents of the documents")
+    unique_bytes = Column(BigInteger, nullable=False, default=0, comment="Size of the distinct contents in bytes")
+
+class DocumentStatsContent(Base):
+    """Number of documents of a group referencing a content, to count distinct contents."""
+    __tablename__ = "document_stats_contents"
+
+    dimension = Column(String, primary_key=True, comment="total, category or bsc_number")
+    value = Column(String, primary_key=True, comment="Category or BSC number of the group (empty for the total)")
+    sha256 = Column(String, primary_key=True, comment="Reference to file content")
+    document_count = Column(Integer, nullable=False, comment="Number of documents of the group with this content")
+
+class ScrubCheckpoint(Base):
+    """Progress of the integrity scrubber through the stored contents, so a restart resumes it."""
+    __tablename__ = "scrub_checkpoints"
+
+    name = Column(String, primary_key=True, comment="Name of the scrubbed store")
+    last_sha256 = Column(String, nullable=False, default="", comment="Last content hash checked in the current pass")
+    checked = Column(Integer, nullable=False, default=0, comment="Contents checked in the current pass")
+    checked_bytes = Column(BigInteger, nullable=False, default=0, comment="Bytes read in the current pass")
+    pass_started_at = Column(DateTime, nullable=True, comment="When the current pass started")
+    last_pass_completed_at = Column(DateTime, nullable=True, comment="When the last full pass completed")
+    updated_at = Column(DateTime, nullable=True, comment="When the checkpoint was last saved")
+
+class IntegrityFinding(Base):
+    """A stored content whose blob is missing, unreadable or no longer hashes to its key."""
+    __tablename__ = "integrity_findings"
+
+    sha256 = Column(String, ForeignKey("file_contents.sha256"), primary_key=True, comment="Reference to file content")
+    file_path = Column(String, nullable=False, comment="Storage key of the blob that was checked")
+    problem = Column(String, nullable=False, index=True, comment="missing, mismatch or unreadable")
+    actual_sha256 = Column(String, nullable=True, comment="Hash of the bytes read, for a mismatch")
+    detail = Column(Text, nullable=True, comment="Error raised while reading the blob")
+    detected_at = Column(DateTime, nullable=False, default=datetime.now, comment="When the problem was first found")
+    checked_at = Column(DateTime, nullable=False, default=datetime.now, comment="When the problem was last confirmed")
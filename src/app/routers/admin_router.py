@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+
+from ..config import settings
+from ..database import get_async_db
+from ..services.document_service import DocumentService
+from ..schemas import IntegrityReport
+
+router = APIRouter()
+
+@router.get("/integrity", response_model=IntegrityReport)
+async def integrity_report(
+    problem: Optional[str] = None,
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Progress of the integrity scrubber and the stored blobs found missing, unreadable or altered.
+
+    Findings are listed most recently confirmed first, only the ones of a
+    ``problem`` (missing, mismatch or unreadable) when it is given.
+    """
+    service = DocumentService(db)
+    return await service.get_integrity_report(problem, limit)
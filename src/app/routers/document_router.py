@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
 from typing import List, Optional
 import os
+import re
 
-from ..database import get_db
+from ..config import settings
+from ..database import get_async_db
 from ..services.document_service import DocumentService
-from ..schemas import DocumentResponse, DocumentList
+from ..schemas import (
+    BatchUploadResponse, DocumentResponse, DocumentList, DocumentStatsResponse, SimilarDocument, TextSearchHit
+)
+from ..responses import content_response
+from ..services.zip_export import iter_zip
 
 router = APIRouter()
 
@@ -14,40 +21,188 @@ router = APIRouter()
 async def upload_document(
     bsc_number: str,
     category: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload a document."""
     service = DocumentService(db)
-    return await service.upload_document(bsc_number, category, file)
+    return await service.upload_document(bsc_number, category, file, background_tasks)
 
-@router.get("/list", response_model=List[DocumentList])
-def list_documents(db: Session = Depends(get_db)):
-    """List all documents."""
+@router.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_batch(
+    bsc_number: str,
+    category: str,
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Upload many documents, or the files of ZIP archives, for a BSC number."""
+    service = DocumentService(db)
+    return await service.upload_batch(bsc_number, category, files, background_tasks)
+
+@router.put("/{doc_uuid}", response_model=DocumentResponse)
+async def replace_document(
+    doc_uuid: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Replace the file of a document."""
+    service = DocumentService(db)
+    return await service.replace_document(doc_uuid, file, background_tasks)
+
+@router.delete("/{doc_uuid}")
+async def delete_document(doc_uuid: str, db: AsyncSession = Depends(get_async_db)):
+    """Delete a document."""
     service = DocumentService(db)
-    return service.list_documents()
+    await service.delete_document(doc_uuid)
+    return {"uuid": doc_uuid, "message": "Document deleted successfully"}
+
+@router.get("/list", response_model=List[DocumentList])
+async def list_documents(
+    response: Response,
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List documents, paginated with the cursor returned in the X-Next-Cursor header.
+
+    With ``stream=true`` every document after the cursor is streamed as NDJSON.
+    """
+    return await _documents_page(DocumentService(db), response, None, None, limit, cursor, stream)
 
 @router.get("/search", response_model=List[DocumentList])
-def search_documents(
+async def search_documents(
+    response: Response,
     bsc_number: Optional[str] = None,
     category: Optional[str] = None,
-    db: Session = Depends(get_db)
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Search documents by BSC number and/or category."""
+    return await _documents_page(DocumentService(db), response, bsc_number, category, limit, cursor, stream)
+
+async def _documents_page(service, response, bsc_number, category, limit, cursor, stream):
+    if stream:
+        return StreamingResponse(
+            service.iter_documents_ndjson(bsc_number, category, cursor=cursor),
+            media_type="application/x-ndjson"
+        )
+    documents, next_cursor = await service.search_documents(bsc_number, category, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return documents
+
+@router.get("/search/text", response_model=List[TextSearchHit])
+async def search_text(
+    q: str = Query(..., min_length=1),
+    bsc_number: Optional[str] = None,
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=settings.TEXT_SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Search the text of the documents (HS codes, names, invoice numbers...).
+
+    Returns the best matching pages first with a highlighted snippet.
+    """
     service = DocumentService(db)
-    return service.search_documents(bsc_number, category)
+    return await service.search_text(q, bsc_number, category, limit, offset)
+
+@router.get("/stats", response_model=DocumentStatsResponse)
+async def document_stats(bsc_number: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    """Document counts, sizes, pages and deduplication savings, in total, per category and per BSC number.
+
+    With ``bsc_number`` only that BSC number is listed.
+    """
+    service = DocumentService(db)
+    return await service.get_stats(bsc_number)
 
 @router.get("/download/{doc_uuid}")
-def download_document(doc_uuid: str, db: Session = Depends(get_db)):
-    """Download a document."""
+async def download_document(doc_uuid: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Download a document.
+
+    The content hash is used as a strong ETag so clients can revalidate with
+    If-None-Match and resume transfers with Range/If-Range.
+    """
     service = DocumentService(db)
-    file_path, extension = service.get_document_path(doc_uuid)
+    document, file_content = await service.get_document_content(doc_uuid)
+    size = await service.content_size(file_content)
     
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    return FileResponse(
-        path=file_path,
+    extension = os.path.splitext(document.filename)[1].lower()
+    return content_response(
+        request,
+        size=size,
+        etag=f'"{file_content.sha256}"',
+        media_type=service.get_media_type(document, file_content),
         filename=f"{doc_uuid}{extension}",
-        media_type="application/octet-stream"
-    ) 
\ No newline at end of file
+        read_range=service.content_reader(file_content)
+    )
+
+@router.get("/export")
+async def export_documents(
+    bsc_number: Optional[str] = None,
+    uploaded_from: Optional[date] = None,
+    uploaded_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download the documents of a BSC number and/or upload date range as a ZIP archive.
+
+    The archive is built while it is streamed, with the original filenames.
+    """
+    pages = await DocumentService(db).export_entries(bsc_number, uploaded_from, uploaded_to)
+    name = re.sub(r"[^\w.-]", "_", bsc_number) if bsc_number else "documents"
+    return StreamingResponse(
+        iter_zip(pages, settings.EXPORT_DUPLICATE_BUFFER_BYTES),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{name}.zip"', "Cache-Control": "no-store"}
+    )
+
+@router.get("/{doc_uuid}/pages")
+async def extract_document_pages(
+    doc_uuid: str,
+    request: Request,
+    page_range: str = Query(..., alias="range"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download a PDF of a range of pages of a PDF document, such as ``range=3-5``."""
+    service = DocumentService(db)
+    file_content, first, last, data = await service.extract_pages(doc_uuid, page_range)
+    return content_response(
+        request,
+        size=len(data),
+        etag=f'"{file_content.sha256}-{first}-{last}"',
+        media_type="application/pdf",
+        filename=f"{doc_uuid}-{first}-{last}.pdf",
+        read_range=lambda start, length: iter([data[start:start + length]])
+    )
+
+@router.get("/{doc_uuid}/pages/{page}")
+async def get_document_page(
+    doc_uuid: str,
+    page: int,
+    dpi: int = settings.RENDITION_DPI,
+    format: str = "png",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a preview image of a document page (1-based)."""
+    service = DocumentService(db)
+    file_path, media_type = await service.get_page_rendition(doc_uuid, page, dpi, format)
+    return FileResponse(path=file_path, media_type=media_type)
+
+@router.get("/{doc_uuid}/similar", response_model=List[SimilarDocument])
+async def similar_documents(
+    doc_uuid: str,
+    same_bsc_number: bool = True,
+    min_similarity: float = Query(0.0, ge=0.0, le=1.0),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Documents with the same content or a near-duplicate one (such as another
+    scan of the same paper), most similar first."""
+    service = DocumentService(db)
+    return await service.similar_documents(doc_uuid, same_bsc_number, min_similarity, limit)
@@ -0,0 +1,79 @@
+from email.utils import format_datetime
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_async_db
+from ..services.upload_sessions import UploadSessionService
+from ..schemas import DocumentResponse, UploadSessionStatus
+
+router = APIRouter()
+
+def _progress_headers(status: UploadSessionStatus) -> dict:
+    """tus-style headers reporting the progress of an upload."""
+    return {
+        "Upload-Offset": str(status.offset),
+        "Upload-Length": str(status.length),
+        "Upload-Expires": format_datetime(status.expires_at.astimezone(), usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+@router.post("", response_model=UploadSessionStatus, status_code=201)
+async def create_upload(
+    request: Request,
+    response: Response,
+    bsc_number: str,
+    category: str,
+    filename: str,
+    length: int = Query(..., ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Start a resumable upload of a file of ``length`` bytes."""
+    service = UploadSessionService(db)
+    status = await service.create_session(bsc_number, category, filename, length)
+    response.headers.update(_progress_headers(status))
+    response.headers["Location"] = f"{request.url.path.rstrip('/')}/{status.id}"
+    return status
+
+@router.head("/{upload_id}")
+async def upload_offset(upload_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Progress of an upload: ``Upload-Offset`` is where the client resumes sending."""
+    service = UploadSessionService(db)
+    status = service.status(await service.get_session(upload_id))
+    return Response(status_code=200, headers=_progress_headers(status))
+
+@router.get("/{upload_id}", response_model=UploadSessionStatus)
+async def get_upload(upload_id: str, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """Progress of an upload, with every byte range received for clients sending chunks in parallel."""
+    service = UploadSessionService(db)
+    status = service.status(await service.get_session(upload_id))
+    response.headers.update(_progress_headers(status))
+    return status
+
+@router.patch("/{upload_id}", status_code=204)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Write the request body at the ``Upload-Offset`` of the upload."""
+    service = UploadSessionService(db)
+    status = await service.write_chunk(upload_id, upload_offset, request.stream())
+    return Response(status_code=204, headers=_progress_headers(status))
+
+@router.post("/{upload_id}/finalize", response_model=DocumentResponse)
+async def finalize_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Create the document of a complete upload (safe to retry)."""
+    service = UploadSessionService(db)
+    return await service.finalize(upload_id, background_tasks)
+
+@router.delete("/{upload_id}", status_code=204)
+async def abort_upload(upload_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Cancel an upload and remove its chunks."""
+    service = UploadSessionService(db)
+    await service.abort(upload_id)
+    return Response(status_code=204)
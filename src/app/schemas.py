@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from .config import settings
 
 class DocumentBase(BaseModel):
@@ -24,6 +24,32 @@ class DocumentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BatchUploadItem(BaseModel):
+    filename: str
+    uuid: Optional[str] = None
+    filesize: Optional[str] = None
+    deduplicated: bool = False
+    message: str
+
+class BatchUploadResponse(BaseModel):
+    bsc_number: str
+    category: str
+    uploaded: int
+    failed: int
+    documents: List[BatchUploadItem]
+
+class UploadSessionStatus(BaseModel):
+    id: str
+    bsc_number: str
+    category: str
+    filename: str
+    length: int
+    offset: int
+    received: List[List[int]]
+    status: str
+    expires_at: datetime
+    document_uuid: Optional[str] = None
+
 class DocumentList(BaseModel):
     uuid: str
     bsc_number: str
@@ -33,4 +59,62 @@ class DocumentList(BaseModel):
     upload_datetime: datetime
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class SimilarDocument(BaseModel):
+    uuid: str
+    bsc_number: str
+    category: str
+    filename: str
+    upload_datetime: datetime
+    similarity: float
+
+class StatsGroup(BaseModel):
+    value: str
+    document_count: int
+    total_bytes: int
+    page_count: int
+    content_count: int
+    unique_bytes: int
+    # Bytes not stored thanks to deduplication within the group
+    dedup_savings_bytes: int
+
+class DocumentStatsResponse(BaseModel):
+    total: StatsGroup
+    categories: List[StatsGroup]
+    bsc_numbers: List[StatsGroup]
+
+class TextSearchHit(BaseModel):
+    uuid: str
+    bsc_number: str
+    category: str
+    filename: str
+    page: int
+    snippet: str
+    score: float
+
+class IntegrityFindingItem(BaseModel):
+    sha256: str
+    file_path: str
+    # missing, mismatch or unreadable
+    problem: str
+    actual_sha256: Optional[str] = None
+    detail: Optional[str] = None
+    # Documents whose downloads are affected
+    document_count: int
+    detected_at: datetime
+    checked_at: datetime
+
+class ScrubStatus(BaseModel):
+    # Set while a pass is under way
+    pass_started_at: Optional[datetime] = None
+    last_sha256: str = ""
+    checked: int = 0
+    checked_bytes: int = 0
+    last_pass_completed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class IntegrityReport(BaseModel):
+    scrubber: ScrubStatus
+    finding_count: int
+    findings: List[IntegrityFindingItem]
@@ -0,0 +1,267 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Tuple
+
+import anyio.from_thread
+
+from ..config import settings
+from . import storage_codec
+from .storage_backends import BlobStat, LocalStorage, StorageBackend, create_backend
+
+
+class BlobStore:
+    """Content-addressed store for original files.
+
+    Blobs are keyed by their SHA256 hash and fanned out in two levels of
+    directories named after the hash prefix (``ab/cd/abcd...``) so no
+    directory grows past a few thousand entries. Keys are stored in
+    ``FileContent.file_path``; absolute paths from the former
+    ``UPLOAD_DIR/<uuid>/original`` layout are still resolved as is.
+
+    Blobs compressed by a codec carry its suffix (``abcd....zst``), and the
+    codec is recorded in ``FileContent.codec``.
+
+    The blobs are kept by a backend (see :mod:`.storage_backends`), under
+    ``root`` by default; temporary files always stay under ``root``. The
+    methods block: a remote backend is reached through the event loop, so
+    they are called from worker threads of the app (``run_in_threadpool``)
+    or, in synchronous commands, inside ``blocking_portal``.
+    """
+
+    SPOOL_DIRNAME = "tmp"
+
+    def __init__(self, root: str, backend: Optional[StorageBackend] = None, codec: Optional[str] = None,
+                 level: Optional[int] = None, min_bytes: int = 0, min_savings: float = 0.0):
+        # Temporary files are told from keys by their absolute path
+        root = os.path.abspath(root)
+        self.root = root
+        self.backend = backend or LocalStorage(root)
+        self.remote = not isinstance(self.backend, LocalStorage)
+        self.local = LocalStorage(root) if self.remote else self.backend
+        self._portal = None
+        self.spool_dir = os.path.join(root, self.SPOOL_DIRNAME)
+        if codec:
+            storage_codec.get_codec(codec)
+        self.codec = codec
+        self.level = level
+        self.min_bytes = min_bytes
+        self.min_savings = min_savings
+
+    def key_for(self, sha256: str, codec: Optional[str] = None) -> str:
+        """Storage key of a content hash, stored as is or compressed by a codec."""
+        key = f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+        if codec:
+            key += storage_codec.get_codec(codec).suffix
+        return key
+
+    @staticmethod
+    def hash_of(key: str) -> str:
+        """Content hash of a storage key."""
+        return os.path.basename(key).split(".", 1)[0]
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of a blob on this host, or None when the backend is remote."""
+        return self._storage(key).local_path(key)
+
+    def _storage(self, key: str) -> StorageBackend:
+        # Originals of the former layout are local files whatever the backend
+        return self.local if os.path.isabs(key) or not self.remote else self.backend
+
+    def stat(self, key: str) -> Optional[BlobStat]:
+        """Size and modification time of a blob, or None when it does not exist."""
+        storage = self._storage(key)
+        if storage is self.local:
+            return self.local.stat_file(key)
+        return self._call(storage.stat, key)
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def size(self, key: str) -> int:
+        stat = self.stat(key)
+        if stat is None:
+            raise FileNotFoundError(key)
+        return stat.size
+
+    def spool_file(self) -> Tuple[int, str]:
+        """Create a temporary file on the same filesystem as the blobs.
+
+        Returns an open file descriptor and its path, like ``tempfile.mkstemp``.
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        return tempfile.mkstemp(dir=self.spool_dir, prefix="upload-", suffix=".part")
+
+    def put_file(self, src_path: str, key: str) -> None:
+        """Atomically move a fully written local file into the store."""
+        storage = self._storage(key)
+        if storage is self.local:
+            self.local.put_file(src_path, key)
+        else:
+            self._call(storage.put, src_path, key)
+
+    def compressed_copy(self, src_path: str, size: int, codec: str) -> Optional[str]:
+        """Compress a file into a temporary file next to the blobs.
+
+        Returns None, without keeping the copy, when the file is smaller than
+        ``min_bytes`` or compression saves less than ``min_savings`` of its size.
+        """
+        if size < self.min_bytes:
+            return None
+        fd, tmp_path = self.spool_file()
+        try:
+            with open(src_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                # The configured level only applies to the configured codec
+                level = self.level if codec == self.codec else None
+                compressed_size = storage_codec.compress(src, dst, codec, level)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if compressed_size > size * (1 - self.min_savings):
+            os.remove(tmp_path)
+            return None
+        return tmp_path
+
+    def store(self, src_path: str, sha256: str, size: int) -> Tuple[str, Optional[str]]:
+        """Move a spooled file into the store, compressed by the codec when it pays off.
+
+        Returns the storage key and the codec of the blob (None when it is
+        stored as is).
+        """
+        compressed_path = self.compressed_copy(src_path, size, self.codec) if self.codec else None
+        if compressed_path is None:
+            key = self.key_for(sha256)
+            self.put_file(src_path, key)
+            return key, None
+        key = self.key_for(sha256, self.codec)
+        self.put_file(compressed_path, key)
+        os.remove(src_path)
+        return key, self.codec
+
+    def iter_range(self, key: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        """Yield ``length`` stored bytes of a blob (up to its end when None) starting at ``start``."""
+        storage = self._storage(key)
+        if storage is self.local:
+            return self.local.iter_range(key, start, length)
+        return self._iter(storage.get_stream(key, start, length))
+
+    def iter_original(
+        self, key: str, codec: Optional[str], start: int = 0, length: Optional[int] = None
+    ) -> Iterator[bytes]:
+        """Yield original bytes of a blob, decompressing it on the fly.
+
+        Compressed streams cannot seek, so the bytes before ``start`` are
+        decompressed and dropped.
+        """
+        if not codec:
+            return self.iter_range(key, start, length)
+        data = storage_codec.decompress_chunks(self.iter_range(key), codec)
+        if start or length is not None:
+            data = storage_codec.slice_chunks(data, start, sys.maxsize if length is None else length)
+        return data
+
+    def original_copy(self, key: str, codec: Optional[str]) -> str:
+        """Write the original bytes of a blob to a temporary file next to the blobs, returning its path."""
+        fd, tmp_path = self.spool_file()
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                for data in self.iter_original(key, codec):
+                    dst.write(data)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    @contextmanager
+    def original_path(self, key: str, codec: Optional[str]) -> Iterator[str]:
+        """Path of a local file holding the original bytes of a blob.
+
+        Compressed or remote blobs are copied into a temporary file removed on exit.
+        """
+        path = self.local_path(key)
+        if path is not None and not codec:
+            yield path
+            return
+        tmp_path = self.original_copy(key, codec)
+        try:
+            yield tmp_path
+        finally:
+            os.remove(tmp_path)
+
+    def delete(self, key: str) -> bool:
+        """Delete a blob, or a temporary file given by its path, returning whether it existed."""
+        storage = self._storage(key)
+        if storage is self.local:
+            return self.local.delete_file(key)
+        return self._call(storage.delete, key)
+
+    def iter_keys(self) -> Iterator[Tuple[str, float]]:
+        """Yield the key and modification time of every stored blob."""
+        if not self.remote:
+            return self.local.iter_files()
+        return self._iter(self.backend.list())
+
+    def iter_spooled(self) -> Iterator[Tuple[str, float]]:
+        """Yield the path and modification time of every temporary file."""
+        if not os.path.isdir(self.spool_dir):
+            return
+        for entry in os.scandir(self.spool_dir):
+            if entry.is_file():
+                yield entry.path, entry.stat().st_mtime
+
+    @contextmanager
+    def blocking_portal(self) -> Iterator[None]:
+        """Let synchronous code use a remote backend, through an event loop in a helper thread."""
+        if not self.remote:
+            yield
+            return
+        with anyio.from_thread.start_blocking_portal() as portal:
+            self._portal = portal
+            try:
+                yield
+            finally:
+                portal.call(self.backend.close)
+                self._portal = None
+
+    async def close(self) -> None:
+        """Release the connections of the backend in the running event loop."""
+        await self.backend.close()
+
+    def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._portal is not None:
+            return self._portal.call(func, *args)
+        return anyio.from_thread.run(func, *args)
+
+    def _iter(self, chunks: AsyncIterator[bytes]) -> Iterator[bytes]:
+        """Iterate over an async stream of the backend from synchronous code."""
+        try:
+            while True:
+                chunk = self._call(_next_chunk, chunks)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            try:
+                self._call(chunks.aclose)
+            except RuntimeError:
+                # Abandoned outside a worker thread, the event loop finalizes it
+                pass
+
+
+async def _next_chunk(chunks: AsyncIterator[bytes]) -> Optional[bytes]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+_blob_root = settings.BLOB_DIR or os.path.join(settings.UPLOAD_DIR, "blobs")
+blob_store = BlobStore(
+    _blob_root,
+    backend=create_backend(_blob_root),
+    codec=None if settings.STORAGE_CODEC in ("", "none") else settings.STORAGE_CODEC,
+    level=settings.STORAGE_CODEC_LEVEL,
+    min_bytes=settings.STORAGE_COMPRESS_MIN_BYTES,
+    min_savings=settings.STORAGE_COMPRESS_MIN_SAVINGS,
+)
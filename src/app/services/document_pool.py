@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple, TypeVar, Union
+
+import fitz  # PyMuPDF
+
+from ..config import settings
+from ..metrics import record_pdf_pool_lookup
+from .blob_store import blob_store
+
+T = TypeVar("T")
+
+
+def read_pdf(key: str, codec: Optional[str]) -> Tuple[Union[str, bytes], int]:
+    """Read a stored PDF for the pool, returning its path or its bytes with its weight.
+
+    Compressed or remote blobs are read into memory; the weight is the size
+    of the original bytes, an upper bound of what MuPDF keeps of a file it
+    reads lazily.
+    """
+    path = blob_store.local_path(key)
+    if path is None or codec:
+        data = b"".join(blob_store.iter_original(key, codec))
+        return data, len(data)
+    return path, os.path.getsize(path)
+
+
+class DocumentPool:
+    """Bounded LRU pool of parsed PDF documents keyed by content hash.
+
+    Requests on a hot document reuse its parsed cross-reference table and
+    objects instead of opening the file again. The pool holds at most
+    ``max_documents`` documents weighing ``max_bytes`` together; evicted
+    documents are closed, and a document heavier than the whole pool is
+    closed after use.
+
+    PyMuPDF is not thread-safe, so documents are only parsed, used and
+    closed under the MuPDF lock, one at a time per worker process. Blobs are
+    read without holding it, concurrent misses on the same content waiting
+    for a single read, and the pool lock only guards the LRU bookkeeping.
+    """
+
+    def __init__(self, max_documents: int, max_bytes: int):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self._documents: "OrderedDict[str, Tuple[fitz.Document, int]]" = OrderedDict()
+        self._loading: Dict[str, threading.Event] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._mupdf_lock = threading.Lock()
+
+    def use(
+        self, sha256: str, reader: Callable[[], Tuple[Union[str, bytes], int]], func: Callable[[fitz.Document], T]
+    ) -> T:
+        """Call ``func`` with the document of a content, reading it with ``reader`` on a miss."""
+        lookup = True
+        while True:
+            with self._mupdf_lock:
+                with self._lock:
+                    entry = self._documents.get(sha256)
+                    if entry is not None:
+                        self._documents.move_to_end(sha256)
+                    else:
+                        loading = self._loading.get(sha256)
+                        reading = loading is None
+                        if reading:
+                            loading = self._loading[sha256] = threading.Event()
+                if lookup:
+                    record_pdf_pool_lookup(entry is not None)
+                    lookup = False
+                if entry is not None:
+                    return func(entry[0])
+            if reading:
+                break
+            # Another thread is reading the same content, look it up again once it is pooled
+            loading.wait()
+
+        try:
+            source, weight = reader()
+            with self._mupdf_lock:
+                if isinstance(source, bytes):
+                    document = fitz.open(stream=source, filetype="pdf")
+                else:
+                    document = fitz.open(source, filetype="pdf")
+                if self.max_documents <= 0 or weight > self.max_bytes:
+                    try:
+                        return func(document)
+                    finally:
+                        document.close()
+                with self._lock:
+                    self._documents[sha256] = (document, weight)
+                    self._total_bytes += weight
+                    evicted = []
+                    while len(self._documents) > self.max_documents or self._total_bytes > self.max_bytes:
+                        evicted.append(self._evict())
+                for stale in evicted:
+                    stale.close()
+                return func(document)
+        finally:
+            with self._lock:
+                del self._loading[sha256]
+            loading.set()
+
+    def clear(self) -> None:
+        """Close every pooled document."""
+        with self._mupdf_lock:
+            with self._lock:
+                evicted = [self._evict() for _ in range(len(self._documents))]
+            for document in evicted:
+                document.close()
+
+    def _evict(self) -> fitz.Document:
+        """Drop the least recently used document, to be closed under the MuPDF lock."""
+        _, (document, weight) = self._documents.popitem(last=False)
+        self._total_bytes -= weight
+        return document
+
+
+pdf_pool = DocumentPool(settings.PDF_POOL_MAX_DOCUMENTS, settings.PDF_POOL_MAX_BYTES)
@@ -1,178 +1,1048 @@
 import os
+import asyncio
+import base64
 import hashlib
+import json
+import mimetypes
+import re
+import time
 import uuid
-from datetime import datetime
-import fitz  # PyMuPDF
-from PIL import Image
-import io
-from fastapi import UploadFile, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Tuple
-
-from ..models import Document, FileContent
-from ..schemas import DocumentResponse, DocumentList
+import zipfile
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from functools import partial
+import anyio.from_thread
+from fastapi import BackgroundTasks, UploadFile, HTTPException
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import Select, and_, func, literal, or_, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+from ..database import AsyncSessionLocal
+from ..models import Document, DocumentStats, FileContent, IntegrityFinding, ScrubCheckpoint, SimilarContent
+from ..schemas import (
+    BatchUploadItem, BatchUploadResponse, DocumentResponse, DocumentList, DocumentStatsResponse,
+    IntegrityFindingItem, IntegrityReport, ScrubStatus, SimilarDocument, StatsGroup, TextSearchHit
+)
 from ..config import settings
+from ..executor import run_cpu_bound
+from ..metrics import record_search_cache_lookup, record_stage, record_upload, stage
+from ..responses import RangeReader
+from . import processing
+from .blob_store import blob_store
+from .document_pool import pdf_pool, read_pdf
+from .group_commit import group_commit
+from .rendition_cache import rendition_cache
+from .search_cache import affected_filters, search_cache
+from .single_flight import single_flight
+from . import document_stats, near_duplicates, scrubber, text_index
+from .zip_export import ExportEntry, unique_name
+
+class SpooledUpload(NamedTuple):
+    """An upload written to a temporary file next to the blobs."""
+    filename: str
+    tmp_path: str
+    sha256: str
+    size: int
+
+class ContentWrites(NamedTuple):
+    """Rows referencing the contents of uploads: new FileContents, and references added to stored ones."""
+    new_contents: List[FileContent]
+    references: Dict[str, int]
+
+    async def apply(self, db: AsyncSession) -> None:
+        """Write the rows in a session, without committing."""
+        for sha256_hash, count in self.references.items():
+            await db.execute(
+                update(FileContent)
+                .where(FileContent.sha256 == sha256_hash)
+                .values(reference_count=FileContent.reference_count + count)
+            )
+        db.add_all(self.new_contents)
 
 class DocumentService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def calculate_sha256(self, file_content: bytes) -> str:
-        """Calculate SHA256 hash of file content."""
-        return hashlib.sha256(file_content).hexdigest()
-
-    def convert_to_png(self, file_content: bytes, filename: str) -> List[bytes]:
-        """Convert document to PNG pages."""
-        pages = []
-        if filename.lower().endswith(('.jpg', '.jpeg')):
-            img = Image.open(io.BytesIO(file_content))
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            pages.append(img_byte_arr.getvalue())
-        else:  # PDF
-            doc = fitz.open(stream=file_content, filetype="pdf")
-            for page in doc:
-                pix = page.get_pixmap()
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='PNG')
-                pages.append(img_byte_arr.getvalue())
-        return pages
+    async def probe_file(self, file_path: str, filename: str) -> dict:
+        """Read page count, MIME type and dimensions in the process pool."""
+        return await run_cpu_bound(processing.probe_file, file_path, filename)
+
+    async def ensure_content_metadata(self, file_content: FileContent, filename: str) -> None:
+        """Fill in the metadata of content stored before it was recorded."""
+        if file_content.page_count is not None:
+            return
+        async with self.original_file(file_content.file_path, file_content.codec) as file_path:
+            metadata = await self.probe_file(file_path, filename)
+            if file_content.size is None:
+                file_content.size = os.path.getsize(file_path)
+        for key, value in metadata.items():
+            setattr(file_content, key, value)
 
     def format_filesize(self, size_mb: float) -> str:
         """Format file size with Mo suffix."""
         return f"{size_mb:.2f} Mo"
 
-    async def upload_document(
-        self, bsc_number: str, category: str, file: UploadFile
-    ) -> DocumentResponse:
-        """Upload a document with deduplication support."""
-        if not any(file.filename.lower().endswith(ext) for ext in settings.ALLOWED_EXTENSIONS):
+    async def spool_upload(self, file: UploadFile) -> SpooledUpload:
+        """Stream an upload into a temporary file next to the blobs, hashing it chunk by chunk."""
+        hasher = hashlib.sha256()
+        size = 0
+        read_seconds = hash_seconds = write_seconds = 0.0
+        fd, tmp_path = blob_store.spool_file()
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    started = time.perf_counter()
+                    chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                    read_seconds += time.perf_counter() - started
+                    if not chunk:
+                        break
+                    # hashlib releases the GIL on large buffers, so hashing and
+                    # writing in a worker thread keeps the event loop free
+                    hashed, written = await run_in_threadpool(self._absorb_chunk, hasher, tmp, chunk)
+                    hash_seconds += hashed
+                    write_seconds += written
+                    size += len(chunk)
+                started = time.perf_counter()
+                tmp.flush()
+                os.fsync(tmp.fileno())
+                write_seconds += time.perf_counter() - started
+        except BaseException:
+            self.discard_file(tmp_path)
+            raise
+        record_stage("read", read_seconds)
+        record_stage("hash", hash_seconds)
+        record_stage("spool_write", write_seconds)
+        return SpooledUpload(file.filename, tmp_path, hasher.hexdigest(), size)
+
+    def spool_fileobj(self, filename: str, fileobj: BinaryIO) -> SpooledUpload:
+        """Blocking variant of ``spool_upload`` for file objects such as ZIP members."""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = blob_store.spool_file()
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in iter(lambda: fileobj.read(settings.UPLOAD_CHUNK_SIZE), b""):
+                    self._absorb_chunk(hasher, tmp, chunk)
+                    size += len(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+        except BaseException:
+            self.discard_file(tmp_path)
+            raise
+        return SpooledUpload(filename, tmp_path, hasher.hexdigest(), size)
+
+    def spool_zip(self, fileobj: BinaryIO) -> List[Tuple[str, Union[SpooledUpload, str]]]:
+        """Spool every file of a ZIP archive.
+
+        Returns the name of each member with its spooled upload, or with the
+        reason it was rejected.
+        """
+        entries = []
+        try:
+            with zipfile.ZipFile(fileobj) as archive:
+                members = [info for info in archive.infolist() if not info.is_dir()]
+                if len(members) > settings.BATCH_MAX_FILES:
+                    raise HTTPException(status_code=400, detail="Too many files in batch")
+                for info in members:
+                    filename = os.path.basename(info.filename)
+                    if not self.is_allowed_filename(filename):
+                        entries.append((filename, "Invalid file type"))
+                        continue
+                    with archive.open(info) as member:
+                        entries.append((filename, self.spool_fileobj(filename, member)))
+        except BaseException as exc:
+            self.discard_spooled(entry for _, entry in entries)
+            if isinstance(exc, zipfile.BadZipFile):
+                raise HTTPException(status_code=400, detail="Invalid ZIP archive")
+            raise
+        return entries
+
+    @staticmethod
+    def _absorb_chunk(hasher, tmp, chunk: bytes) -> Tuple[float, float]:
+        """Hash and write a chunk, returning the time spent on each."""
+        started = time.perf_counter()
+        hasher.update(chunk)
+        hashed = time.perf_counter()
+        tmp.write(chunk)
+        return hashed - started, time.perf_counter() - hashed
+
+    def discard_spooled(self, uploads: Iterable[Union[SpooledUpload, str]]) -> None:
+        """Remove the temporary files of spooled uploads that were not consumed."""
+        for upload in uploads:
+            if isinstance(upload, SpooledUpload):
+                self.discard_file(upload.tmp_path)
+
+    def discard_file(self, file_path: str) -> None:
+        """Remove a file, ignoring it if it is already gone."""
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def stored_size(self, file_content: FileContent) -> Optional[int]:
+        """Size of the original bytes of the stored content, or None when its blob is missing.
+
+        Looks the blob up in the storage backend, so it runs in the thread pool.
+        """
+        stat = blob_store.stat(file_content.file_path)
+        if stat is None:
+            return None
+        return file_content.size if file_content.codec else stat.size
+
+    async def content_size(self, file_content: FileContent) -> int:
+        """Size of the original bytes of the stored content, raising 404 when its blob is missing."""
+        size = await run_in_threadpool(self.stored_size, file_content)
+        if size is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return size
+
+    def content_reader(self, file_content: FileContent) -> RangeReader:
+        """Reader of byte ranges of the original content, decompressing it on the fly."""
+        return partial(blob_store.iter_original, file_content.file_path, file_content.codec)
+
+    @asynccontextmanager
+    async def original_file(self, key: str, codec: Optional[str]) -> AsyncIterator[str]:
+        """Path of a local file holding the original bytes of a blob, for the processing functions.
+
+        Compressed or remote blobs are copied off the event loop into a
+        temporary file removed on exit.
+        """
+        path = blob_store.local_path(key)
+        if path is not None and not codec:
+            yield path
+            return
+        tmp_path = await run_in_threadpool(blob_store.original_copy, key, codec)
+        try:
+            yield tmp_path
+        finally:
+            self.discard_file(tmp_path)
+
+    def is_allowed_filename(self, filename: str) -> bool:
+        """Whether the extension of a file is allowed."""
+        return bool(filename) and any(filename.lower().endswith(ext) for ext in settings.ALLOWED_EXTENSIONS)
+
+    def validate_filename(self, filename: str) -> None:
+        """Reject files whose extension is not allowed."""
+        if not self.is_allowed_filename(filename):
             raise HTTPException(status_code=400, detail="Invalid file type")
 
-        file_content = await file.read()
-        sha256_hash = self.calculate_sha256(file_content)
-        
+    async def prepare_contents(
+        self, uploads: List[SpooledUpload],
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> Tuple[Dict[str, FileContent], Set[str], Dict[str, str], ContentWrites]:
+        """Store the contents of spooled uploads whose hash is new, and list the rows referencing them.
+
+        Must run while holding ``single_flight`` for every hash until the
+        rows are committed, so concurrent uploads of the same content share
+        one blob write and one FileContent insert. Uploads with the same hash
+        share one FileContent, and every spooled file is consumed. Returns the
+        FileContent of each hash, the hashes stored by this call, the error
+        of each unreadable one and the rows to write.
+        """
+        references = Counter(upload.sha256 for upload in uploads)
+        first_uploads: Dict[str, SpooledUpload] = {}
+        for upload in uploads:
+            if upload.sha256 in first_uploads:
+                self.discard_file(upload.tmp_path)
+            else:
+                first_uploads[upload.sha256] = upload
+
         # Check for existing content
-        existing_content = self.db.query(FileContent).filter(FileContent.sha256 == sha256_hash).first()
-        
-        if existing_content:
-            existing_content.reference_count += 1
-            self.db.commit()
-            
-            document = Document(
-                uuid=str(uuid.uuid4()),
-                bsc_number=bsc_number,
-                category=category,
-                page_number=len(self.convert_to_png(file_content, file.filename)),
-                filename=file.filename,
-                filesize=len(file_content) / (1024 * 1024),
-                upload_datetime=datetime.now(),
-                sha256=sha256_hash
+        with stage("db_lookup"):
+            existing = await self.db.scalars(select(FileContent).where(FileContent.sha256.in_(list(references))))
+            contents = {file_content.sha256: file_content for file_content in existing}
+            for sha256_hash in contents:
+                # The content is already stored, the spooled copy is not needed
+                self.discard_file(first_uploads[sha256_hash].tmp_path)
+        writes = ContentWrites([], {sha256_hash: references[sha256_hash] for sha256_hash in contents})
+        for sha256_hash, file_content in contents.items():
+            await self.ensure_content_metadata(file_content, first_uploads[sha256_hash].filename)
+
+        # Probe the new contents in parallel, then promote them into the blob store
+        new_uploads = [upload for sha256_hash, upload in first_uploads.items() if sha256_hash not in contents]
+        with stage("probe"):
+            probes = await asyncio.gather(
+                *(self.probe_file(upload.tmp_path, upload.filename) for upload in new_uploads),
+                return_exceptions=True
             )
-            
-            self.db.add(document)
-            self.db.commit()
-            self.db.refresh(document)
-            
-            return DocumentResponse(
-                uuid=document.uuid,
-                bsc_number=document.bsc_number,
-                category=document.category,
-                filesize=self.format_filesize(document.filesize),
-                message="Document uploaded successfully (deduplicated)"
+        for metadata in probes:
+            # Only documents that cannot be parsed are the client's fault, the
+            # callers discard every spooled file on any other failure
+            if isinstance(metadata, BaseException) and not isinstance(metadata, processing.UnreadableDocument):
+                raise metadata
+        stored = set()
+        errors = {}
+        for upload, metadata in zip(new_uploads, probes):
+            if isinstance(metadata, processing.UnreadableDocument):
+                self.discard_file(upload.tmp_path)
+                errors[upload.sha256] = "Unreadable document"
+                continue
+
+            with stage("store"):
+                key, codec = await run_in_threadpool(blob_store.store, upload.tmp_path, upload.sha256, upload.size)
+            file_content = FileContent(
+                sha256=upload.sha256,
+                file_path=key,
+                codec=codec,
+                reference_count=references[upload.sha256],
+                size=upload.size,
+                **metadata
             )
-        
-        # Create new document and content
-        doc_uuid = str(uuid.uuid4())
-        doc_dir = os.path.join(settings.UPLOAD_DIR, doc_uuid)
-        os.makedirs(doc_dir, exist_ok=True)
-        
-        original_file_path = os.path.join(doc_dir, "original")
-        with open(original_file_path, "wb") as f:
-            f.write(file_content)
-        
-        file_content_record = FileContent(
-            sha256=sha256_hash,
-            file_path=original_file_path,
-            reference_count=1
-        )
-        self.db.add(file_content_record)
-        self.db.commit()
-        
-        document = Document(
-            uuid=doc_uuid,
+            writes.new_contents.append(file_content)
+            contents[upload.sha256] = file_content
+            stored.add(upload.sha256)
+
+            if background_tasks is not None and settings.RENDITION_WARMUP_PAGES > 0:
+                background_tasks.add_task(
+                    self.warm_renditions, upload.sha256, key, codec, upload.filename,
+                    min(file_content.page_count, settings.RENDITION_WARMUP_PAGES)
+                )
+            if background_tasks is not None and settings.TEXT_INDEX_ENABLED:
+                background_tasks.add_task(self.index_text, upload.sha256, key, codec, upload.filename)
+            if background_tasks is not None and settings.NEAR_DUPLICATE_ENABLED:
+                background_tasks.add_task(self.index_page_hashes, upload.sha256, key, codec, upload.filename)
+        return contents, stored, errors, writes
+
+    async def acquire_contents(
+        self, uploads: List[SpooledUpload],
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> Tuple[Dict[str, FileContent], Set[str], Dict[str, str]]:
+        """Reference the contents of spooled uploads in the session, like ``prepare_contents``."""
+        contents, stored, errors, writes = await self.prepare_contents(uploads, background_tasks)
+        await writes.apply(self.db)
+        return contents, stored, errors
+
+    async def prepare_content(
+        self, upload: SpooledUpload, background_tasks: Optional[BackgroundTasks] = None
+    ) -> Tuple[FileContent, bool, ContentWrites]:
+        """Store the content of a single spooled upload if it is new.
+
+        Returns the FileContent, whether the content was deduplicated and the
+        rows to write.
+        """
+        contents, stored, errors, writes = await self.prepare_contents([upload], background_tasks)
+        if errors:
+            raise HTTPException(status_code=400, detail=errors[upload.sha256])
+        return contents[upload.sha256], upload.sha256 not in stored, writes
+
+    async def acquire_content(
+        self, upload: SpooledUpload, background_tasks: Optional[BackgroundTasks] = None
+    ) -> Tuple[FileContent, bool]:
+        """Reference the content of a single spooled upload.
+
+        Returns the FileContent and whether the content was deduplicated.
+        """
+        file_content, deduplicated, writes = await self.prepare_content(upload, background_tasks)
+        await writes.apply(self.db)
+        return file_content, deduplicated
+
+    def build_document(
+        self, bsc_number: str, category: str, upload: SpooledUpload, file_content: FileContent,
+        doc_uuid: Optional[str] = None
+    ) -> Document:
+        """Create the Document of an upload."""
+        return Document(
+            uuid=doc_uuid or str(uuid.uuid4()),
             bsc_number=bsc_number,
             category=category,
-            page_number=len(self.convert_to_png(file_content, file.filename)),
-            filename=file.filename,
-            filesize=len(file_content) / (1024 * 1024),
+            page_number=file_content.page_count,
+            filename=upload.filename,
+            filesize=upload.size / (1024 * 1024),
             upload_datetime=datetime.now(),
-            sha256=sha256_hash
+            sha256=upload.sha256
         )
-        
+
+    def new_document(
+        self, bsc_number: str, category: str, upload: SpooledUpload, file_content: FileContent,
+        doc_uuid: Optional[str] = None
+    ) -> Document:
+        """Create the Document of an upload and add it to the session."""
+        document = self.build_document(bsc_number, category, upload, file_content, doc_uuid)
         self.db.add(document)
-        self.db.commit()
-        self.db.refresh(document)
-        
+        return document
+
+    async def release_content(self, sha256: str) -> None:
+        """Drop one reference to stored content.
+
+        Content left without references is removed by the garbage collector.
+        """
+        await self.db.execute(
+            update(FileContent)
+            .where(FileContent.sha256 == sha256)
+            .values(reference_count=FileContent.reference_count - 1)
+        )
+
+    async def upload_document(
+        self, bsc_number: str, category: str, file: UploadFile,
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> DocumentResponse:
+        """Upload a document with deduplication support."""
+        self.validate_filename(file.filename)
+
+        upload = await self.spool_upload(file)
+        return await self.create_document(bsc_number, category, upload, background_tasks)
+
+    async def create_document(
+        self, bsc_number: str, category: str, upload: SpooledUpload,
+        background_tasks: Optional[BackgroundTasks] = None, doc_uuid: Optional[str] = None
+    ) -> DocumentResponse:
+        """Create a document from a spooled upload, deduplicating its content.
+
+        The spooled file is consumed whether or not the document is created.
+        """
+        try:
+            async with single_flight.hold(upload.sha256):
+                file_content, deduplicated, writes = await self.prepare_content(upload, background_tasks)
+                document = self.build_document(bsc_number, category, upload, file_content, doc_uuid)
+                change = document_stats.document_change(document, 1)
+
+                async def write(db: AsyncSession) -> None:
+                    await writes.apply(db)
+                    db.add(document)
+                    await document_stats.apply_changes(db, [change])
+
+                with stage("commit"):
+                    if group_commit is None:
+                        await write(self.db)
+                        await self.db.commit()
+                    else:
+                        # The request's own transaction (its lookups, and metadata
+                        # filled in on content stored before it was recorded) ends
+                        # first, returning its connection for the writer to use
+                        await self.db.commit()
+                        await group_commit.submit(write)
+        except BaseException:
+            await self.db.rollback()
+            self.discard_file(upload.tmp_path)
+            raise
+        record_upload(upload.size, deduplicated)
+        await self.invalidate_search_cache(bsc_number, category)
+
         return DocumentResponse(
             uuid=document.uuid,
             bsc_number=document.bsc_number,
             category=document.category,
             filesize=self.format_filesize(document.filesize),
-            message="Document uploaded successfully"
+            message="Document uploaded successfully (deduplicated)" if deduplicated
+            else "Document uploaded successfully"
         )
 
-    def list_documents(self) -> List[DocumentList]:
-        """List all documents."""
-        documents = self.db.query(Document).all()
-        return [
-            DocumentList(
-                uuid=doc.uuid,
-                bsc_number=doc.bsc_number,
-                category=doc.category,
-                page_number=doc.page_number,
-                filesize=self.format_filesize(doc.filesize),
-                upload_datetime=doc.upload_datetime
-            )
-            for doc in documents
-        ]
+    async def upload_batch(
+        self, bsc_number: str, category: str, files: List[UploadFile],
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> BatchUploadResponse:
+        """Upload many documents (or the files of ZIP archives) in one transaction.
+
+        Files are spooled and probed in parallel, deduplicated within the batch
+        and against stored content, and every Document is committed at once.
+        """
+        if len(files) > settings.BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail="Too many files in batch")
+
+        async def spool(file: UploadFile) -> List[Tuple[str, Union[SpooledUpload, str]]]:
+            if file.filename and file.filename.lower().endswith(".zip"):
+                return await run_in_threadpool(self.spool_zip, file.file)
+            if not self.is_allowed_filename(file.filename):
+                return [(file.filename, "Invalid file type")]
+            return [(file.filename, await self.spool_upload(file))]
+
+        spooled = await asyncio.gather(*(spool(file) for file in files), return_exceptions=True)
+        entries = []
+        failure = None
+        for result in spooled:
+            if not isinstance(result, BaseException):
+                entries.extend(result)
+            elif failure is None or isinstance(failure, HTTPException) and not isinstance(result, HTTPException):
+                # A server-side failure wins over a rejected file so it is not reported as a client error
+                failure = result
+        uploads = [entry for _, entry in entries if isinstance(entry, SpooledUpload)]
+        if failure is None and len(entries) > settings.BATCH_MAX_FILES:
+            failure = HTTPException(status_code=400, detail="Too many files in batch")
+        if failure is not None:
+            self.discard_spooled(uploads)
+            raise failure
+
+        items = []
+        uploaded = []
+        changes = []
+        try:
+            async with single_flight.hold(*(upload.sha256 for upload in uploads)):
+                contents, stored, errors = await self.acquire_contents(uploads, background_tasks)
+                for filename, entry in entries:
+                    if not isinstance(entry, SpooledUpload):
+                        items.append(BatchUploadItem(filename=filename, message=entry))
+                    elif entry.sha256 in errors:
+                        items.append(BatchUploadItem(filename=filename, message=errors[entry.sha256]))
+                    else:
+                        document = self.new_document(bsc_number, category, entry, contents[entry.sha256])
+                        changes.append(document_stats.document_change(document, 1))
+                        # Only the first file of new content is stored, the others reuse it
+                        deduplicated = entry.sha256 not in stored
+                        stored.discard(entry.sha256)
+                        uploaded.append((entry.size, deduplicated))
+                        items.append(BatchUploadItem(
+                            filename=filename,
+                            uuid=document.uuid,
+                            filesize=self.format_filesize(document.filesize),
+                            deduplicated=deduplicated,
+                            message="Document uploaded successfully (deduplicated)" if deduplicated
+                            else "Document uploaded successfully"
+                        ))
+                await document_stats.apply_changes(self.db, changes)
+                with stage("commit"):
+                    await self.db.commit()
+        except BaseException:
+            await self.db.rollback()
+            self.discard_spooled(uploads)
+            raise
+        for size, deduplicated in uploaded:
+            record_upload(size, deduplicated)
+        if uploaded:
+            await self.invalidate_search_cache(bsc_number, category)
+
+        return BatchUploadResponse(
+            bsc_number=bsc_number,
+            category=category,
+            uploaded=len(uploaded),
+            failed=len(items) - len(uploaded),
+            documents=items
+        )
+
+    async def replace_document(
+        self, doc_uuid: str, file: UploadFile,
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> DocumentResponse:
+        """Replace the content of a document, releasing the previous content."""
+        self.validate_filename(file.filename)
+
+        upload = await self.spool_upload(file)
+        try:
+            async with single_flight.hold(upload.sha256):
+                with stage("db_lookup"):
+                    document = await self.db.get(Document, doc_uuid)
+                if not document:
+                    raise HTTPException(status_code=404, detail="Document not found")
+
+                previous_sha256 = document.sha256
+                previous = document_stats.document_change(document, -1)
+                file_content, deduplicated = await self.acquire_content(upload, background_tasks)
+
+                document.sha256 = upload.sha256
+                document.filename = upload.filename
+                document.filesize = upload.size / (1024 * 1024)
+                document.page_number = file_content.page_count
+                await self.db.flush()
+                await self.release_content(previous_sha256)
+                await document_stats.apply_changes(
+                    self.db, [previous, document_stats.document_change(document, 1)]
+                )
+                with stage("commit"):
+                    await self.db.commit()
+        except BaseException:
+            await self.db.rollback()
+            self.discard_file(upload.tmp_path)
+            raise
+        record_upload(upload.size, deduplicated)
+        await self.invalidate_search_cache(document.bsc_number, document.category)
+
+        return DocumentResponse(
+            uuid=document.uuid,
+            bsc_number=document.bsc_number,
+            category=document.category,
+            filesize=self.format_filesize(document.filesize),
+            message="Document replaced successfully"
+        )
 
-    def search_documents(
-        self, bsc_number: str = None, category: str = None
-    ) -> List[DocumentList]:
-        """Search documents by BSC number and/or category."""
-        query = self.db.query(Document)
-        
+    async def delete_document(self, doc_uuid: str) -> None:
+        """Delete a document and release its content."""
+        document = await self.db.get(Document, doc_uuid)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        sha256_hash = document.sha256
+        await self.db.delete(document)
+        await self.db.flush()
+        await self.release_content(sha256_hash)
+        await document_stats.apply_changes(self.db, [document_stats.document_change(document, -1)])
+        await self.db.commit()
+        await self.invalidate_search_cache(document.bsc_number, document.category)
+
+    async def _search_cache_call(self, method, *args):
+        if search_cache.blocking:
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    async def invalidate_search_cache(self, bsc_number: str, category: str) -> None:
+        """Drop the cached search results that may include documents of a BSC number and category.
+
+        Called once the change is committed, so a concurrent search cannot
+        cache the previous results again.
+        """
+        if search_cache is not None:
+            await self._search_cache_call(search_cache.invalidate, affected_filters(bsc_number, category))
+
+    # Columns needed to build a DocumentList, selected without loading ORM entities
+    LIST_COLUMNS = (
+        Document.uuid,
+        Document.bsc_number,
+        Document.category,
+        Document.page_number,
+        Document.filesize,
+        Document.upload_datetime,
+    )
+
+    def encode_cursor(self, upload_datetime: datetime, doc_uuid: str) -> str:
+        """Encode the keyset position of a document as an opaque cursor."""
+        raw = json.dumps([upload_datetime.isoformat(), doc_uuid]).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, cursor: str) -> Tuple[datetime, str]:
+        """Decode a cursor produced by ``encode_cursor``."""
+        try:
+            upload_datetime, doc_uuid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(upload_datetime), str(doc_uuid)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    def document_rows_query(
+        self, bsc_number: str = None, category: str = None, cursor: str = None
+    ) -> Select:
+        """Select the listed columns in (upload_datetime, uuid) order after the cursor."""
+        query = select(*self.LIST_COLUMNS)
         if bsc_number:
-            query = query.filter(Document.bsc_number == bsc_number)
+            query = query.where(Document.bsc_number == bsc_number)
         if category:
-            query = query.filter(Document.category == category)
-        
-        documents = query.all()
-        return [
-            DocumentList(
-                uuid=doc.uuid,
-                bsc_number=doc.bsc_number,
-                category=doc.category,
-                page_number=doc.page_number,
-                filesize=self.format_filesize(doc.filesize),
-                upload_datetime=doc.upload_datetime
+            query = query.where(Document.category == category)
+        if cursor:
+            after_datetime, after_uuid = self.decode_cursor(cursor)
+            query = query.where(or_(
+                Document.upload_datetime > after_datetime,
+                and_(Document.upload_datetime == after_datetime, Document.uuid > after_uuid)
+            ))
+        return query.order_by(Document.upload_datetime, Document.uuid)
+
+    def row_to_document_list(self, row) -> DocumentList:
+        """Build the response object of a selected row."""
+        return DocumentList(
+            uuid=row.uuid,
+            bsc_number=row.bsc_number,
+            category=row.category,
+            page_number=row.page_number,
+            filesize=self.format_filesize(row.filesize),
+            upload_datetime=row.upload_datetime
+        )
+
+    async def list_documents(
+        self, limit: int = None, cursor: str = None
+    ) -> Tuple[List[DocumentList], Optional[str]]:
+        """List documents one page at a time.
+
+        Returns the page and the cursor of the next one (None on the last page).
+        """
+        return await self.search_documents(limit=limit, cursor=cursor)
+
+    async def search_documents(
+        self, bsc_number: str = None, category: str = None,
+        limit: int = None, cursor: str = None
+    ) -> Tuple[List[DocumentList], Optional[str]]:
+        """Search documents by BSC number and/or category, one page at a time.
+
+        Pages are served from the search cache until a document matching the
+        filter is added, replaced or deleted.
+        """
+        limit = limit or settings.PAGE_SIZE
+        filter_key = (bsc_number or None, category or None)
+        page_key = (limit, cursor or None)
+        if search_cache is not None:
+            with stage("cache"):
+                cached = await self._search_cache_call(search_cache.get, filter_key, page_key)
+                record_search_cache_lookup(cached is not None)
+                if cached is not None:
+                    return cached
+                # Taken before querying so a concurrent write makes this page stale
+                generation = await self._search_cache_call(search_cache.generation, filter_key)
+
+        query = self.document_rows_query(bsc_number, category, cursor).limit(limit + 1)
+        with stage("query"):
+            rows = (await self.db.execute(query)).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1].upload_datetime, rows[-1].uuid)
+        page = [self.row_to_document_list(row) for row in rows], next_cursor
+        if search_cache is not None:
+            await self._search_cache_call(search_cache.put, filter_key, page_key, page, generation)
+        return page
+
+    async def iter_documents_ndjson(
+        self, bsc_number: str = None, category: str = None,
+        limit: int = None, cursor: str = None
+    ) -> AsyncIterator[bytes]:
+        """Yield matching documents as NDJSON lines while the database cursor produces them.
+
+        A dedicated session is used because the response outlives the request's one.
+        """
+        query = self.document_rows_query(bsc_number, category, cursor)
+        if limit:
+            query = query.limit(limit)
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=settings.STREAM_BATCH_SIZE))
+            async for row in result:
+                yield self.row_to_document_list(row).model_dump_json().encode() + b"\n"
+
+    async def get_stats(self, bsc_number: Optional[str] = None) -> DocumentStatsResponse:
+        """Document counts, sizes, pages and deduplication savings, in total and per group.
+
+        Reads one row per category and BSC number (only the given one when
+        ``bsc_number`` is set), whatever the number of documents.
+        """
+        query = select(DocumentStats).order_by(DocumentStats.dimension, DocumentStats.value)
+        if bsc_number:
+            query = query.where(or_(
+                DocumentStats.dimension != "bsc_number", DocumentStats.value == bsc_number
+            ))
+        with stage("query"):
+            rows = (await self.db.scalars(query)).all()
+
+        groups: Dict[str, List[StatsGroup]] = {document_stats.TOTAL: [], "category": [], "bsc_number": []}
+        for row in rows:
+            groups[row.dimension].append(StatsGroup(
+                value=row.value,
+                document_count=row.document_count,
+                total_bytes=row.total_bytes,
+                page_count=row.page_count,
+                content_count=row.content_count,
+                unique_bytes=row.unique_bytes,
+                dedup_savings_bytes=row.total_bytes - row.unique_bytes
+            ))
+        total = groups[document_stats.TOTAL] or [StatsGroup(
+            value="", document_count=0, total_bytes=0, page_count=0,
+            content_count=0, unique_bytes=0, dedup_savings_bytes=0
+        )]
+        return DocumentStatsResponse(
+            total=total[0], categories=groups["category"], bsc_numbers=groups["bsc_number"]
+        )
+
+    async def get_integrity_report(self, problem: Optional[str] = None, limit: int = None) -> IntegrityReport:
+        """Progress of the integrity scrubber and the blobs it found damaged, most recent first."""
+        if problem is not None and problem not in scrubber.PROBLEMS:
+            raise HTTPException(
+                status_code=400, detail=f"Problem must be one of: {', '.join(scrubber.PROBLEMS)}"
+            )
+        filters = [] if problem is None else [IntegrityFinding.problem == problem]
+        with stage("query"):
+            checkpoint = await self.db.get(ScrubCheckpoint, scrubber.STORE)
+            finding_count = await self.db.scalar(select(func.count()).select_from(IntegrityFinding).where(*filters))
+            rows = (await self.db.execute(
+                select(IntegrityFinding, func.coalesce(FileContent.reference_count, 0))
+                .outerjoin(FileContent, FileContent.sha256 == IntegrityFinding.sha256)
+                .where(*filters)
+                .order_by(IntegrityFinding.checked_at.desc(), IntegrityFinding.sha256)
+                .limit(limit or settings.PAGE_SIZE)
+            )).all()
+
+        status = ScrubStatus()
+        if checkpoint is not None:
+            status = ScrubStatus(
+                pass_started_at=checkpoint.pass_started_at,
+                last_sha256=checkpoint.last_sha256,
+                checked=checkpoint.checked,
+                checked_bytes=checkpoint.checked_bytes,
+                last_pass_completed_at=checkpoint.last_pass_completed_at,
+                updated_at=checkpoint.updated_at
+            )
+        findings = [
+            IntegrityFindingItem(
+                sha256=finding.sha256,
+                file_path=finding.file_path,
+                problem=finding.problem,
+                actual_sha256=finding.actual_sha256,
+                detail=finding.detail,
+                document_count=document_count,
+                detected_at=finding.detected_at,
+                checked_at=finding.checked_at
             )
-            for doc in documents
+            for finding, document_count in rows
         ]
+        return IntegrityReport(scrubber=status, finding_count=finding_count, findings=findings)
 
-    def get_document_path(self, doc_uuid: str) -> Tuple[str, str]:
-        """Get document file path and extension."""
-        document = self.db.query(Document).filter(Document.uuid == doc_uuid).first()
-        if not document:
-            raise HTTPException(status_code=404, detail="Document not found")
-        
-        file_content = self.db.query(FileContent).filter(FileContent.sha256 == document.sha256).first()
+    async def get_document_content(self, doc_uuid: str) -> Tuple[Document, FileContent]:
+        """Get a document and the content it references."""
+        with stage("query"):
+            document = await self.db.get(Document, doc_uuid)
+            if not document:
+                raise HTTPException(status_code=404, detail="Document not found")
+
+            file_content = await self.db.get(FileContent, document.sha256)
         if not file_content:
             raise HTTPException(status_code=404, detail="File content not found")
-        
-        if not os.path.exists(file_content.file_path):
-            raise HTTPException(status_code=404, detail=f"File not found at path: {file_content.file_path}")
-        
-        return file_content.file_path, os.path.splitext(document.filename)[1].lower() 
\ No newline at end of file
+
+        return document, file_content
+
+    async def export_entries(
+        self, bsc_number: str = None, uploaded_from: date = None, uploaded_to: date = None
+    ) -> Iterator[List[ExportEntry]]:
+        """Pages of entries of the ZIP export of the documents of a BSC number and/or upload date range.
+
+        Dates are inclusive. The first page is read here, raising 404 when no
+        document matches; the next ones are read, with a session of their own,
+        from the thread streaming the archive when it reaches them. The
+        documents sharing each content are counted here too, so the content
+        is read once however far apart its entries are.
+        """
+        if not (bsc_number or uploaded_from or uploaded_to):
+            raise HTTPException(status_code=400, detail="A BSC number or an upload date range is required")
+
+        filters = []
+        if bsc_number:
+            filters.append(Document.bsc_number == bsc_number)
+        if uploaded_from:
+            filters.append(Document.upload_datetime >= datetime.combine(uploaded_from, datetime.min.time()))
+        if uploaded_to:
+            filters.append(
+                Document.upload_datetime < datetime.combine(uploaded_to + timedelta(days=1), datetime.min.time())
+            )
+        query = (
+            select(Document.uuid, Document.filename, Document.upload_datetime, FileContent)
+            .join(FileContent, FileContent.sha256 == Document.sha256)
+            .where(*filters)
+            .order_by(Document.upload_datetime, Document.uuid)
+            .limit(settings.EXPORT_PAGE_SIZE)
+        )
+        with stage("query"):
+            rows = (await self.db.execute(query)).all()
+            if not rows:
+                raise HTTPException(status_code=404, detail="No documents found")
+            # Content shared by several documents is read once per archive
+            copies: Dict[str, int] = dict((await self.db.execute(
+                select(Document.sha256, func.count()).where(*filters)
+                .group_by(Document.sha256).having(func.count() > 1)
+            )).all())
+
+        async def next_page(upload_datetime: datetime, doc_uuid: str) -> list:
+            async with AsyncSessionLocal() as db:
+                return (await db.execute(query.where(or_(
+                    Document.upload_datetime > upload_datetime,
+                    and_(Document.upload_datetime == upload_datetime, Document.uuid > doc_uuid)
+                )))).all()
+
+        def iter_pages(rows: list) -> Iterator[List[ExportEntry]]:
+            names: Dict[str, int] = {}
+            while rows:
+                entries = []
+                for row in rows:
+                    extension = os.path.splitext(row.filename)[1].lower()
+                    entries.append(ExportEntry(
+                        name=unique_name(row.filename, f"{row.uuid}{extension}", names),
+                        sha256=row.FileContent.sha256,
+                        upload_datetime=row.upload_datetime,
+                        size=partial(self.stored_size, row.FileContent),
+                        read_range=self.content_reader(row.FileContent),
+                        copies=copies.get(row.FileContent.sha256, 1)
+                    ))
+                yield entries
+                if len(rows) < settings.EXPORT_PAGE_SIZE:
+                    return
+                rows = anyio.from_thread.run(next_page, rows[-1].upload_datetime, rows[-1].uuid)
+
+        return iter_pages(rows)
+
+    def get_media_type(self, document: Document, file_content: FileContent) -> str:
+        """Get the content type of a document from its extension."""
+        media_type, _ = mimetypes.guess_type(document.filename)
+        return media_type or file_content.mime_type or "application/octet-stream"
+
+    async def render_page(
+        self, sha256: str, key: str, codec: Optional[str], filename: str, page: int, dpi: int, image_format: str
+    ) -> str:
+        """Get the cached rendition of a page (1-based), rendering it on a miss."""
+        cached_path = await run_in_threadpool(rendition_cache.get, sha256, page, dpi, image_format)
+        if cached_path:
+            return cached_path
+        with stage("render"):
+            async with self.original_file(key, codec) as file_path:
+                data = await run_cpu_bound(
+                    processing.render_page, file_path, filename, page - 1, dpi, image_format
+                )
+        return await run_in_threadpool(rendition_cache.put, sha256, page, dpi, image_format, data)
+
+    async def warm_renditions(self, sha256: str, key: str, codec: Optional[str], filename: str, pages: int) -> None:
+        """Render the first pages of new content so previews are served from the cache."""
+        for page in range(1, pages + 1):
+            await self.render_page(
+                sha256, key, codec, filename, page, settings.RENDITION_DPI, "png"
+            )
+
+    async def get_page_rendition(
+        self, doc_uuid: str, page: int, dpi: int, image_format: str
+    ) -> Tuple[str, str]:
+        """Get the path and media type of a rendered document page."""
+        if image_format not in settings.RENDITION_FORMATS:
+            raise HTTPException(status_code=400, detail="Invalid image format")
+        if not 1 <= dpi <= settings.RENDITION_MAX_DPI:
+            raise HTTPException(status_code=400, detail="Invalid resolution")
+
+        document, file_content = await self.get_document_content(doc_uuid)
+        await self.ensure_content_metadata(file_content, document.filename)
+        if not 1 <= page <= file_content.page_count:
+            raise HTTPException(status_code=404, detail="Page not found")
+
+        path = await self.render_page(
+            file_content.sha256, file_content.file_path, file_content.codec,
+            document.filename, page, dpi, image_format
+        )
+        return path, f"image/{image_format}"
+
+    def parse_page_range(self, page_range: str, page_count: int) -> Tuple[int, int]:
+        """Parse a "first-last" (or single page) range of 1-based pages."""
+        match = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", page_range)
+        if not match:
+            raise HTTPException(status_code=400, detail="Invalid page range")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if not 1 <= first <= last:
+            raise HTTPException(status_code=400, detail="Invalid page range")
+        if last > page_count:
+            raise HTTPException(status_code=404, detail="Page not found")
+        return first, last
+
+    async def extract_pages(self, doc_uuid: str, page_range: str) -> Tuple[FileContent, int, int, bytes]:
+        """Build a PDF of a range of pages of a PDF document.
+
+        The document is parsed once and kept in the pool of parsed PDFs, so
+        further ranges of a hot document skip parsing.
+        """
+        document, file_content = await self.get_document_content(doc_uuid)
+        if processing.is_image(document.filename):
+            raise HTTPException(status_code=400, detail="Page ranges are only available for PDF documents")
+        await self.ensure_content_metadata(file_content, document.filename)
+        first, last = self.parse_page_range(page_range, file_content.page_count)
+
+        await self.content_size(file_content)
+        with stage("extract"):
+            data = await run_in_threadpool(
+                pdf_pool.use,
+                file_content.sha256,
+                partial(read_pdf, file_content.file_path, file_content.codec),
+                partial(processing.extract_pages, first=first, last=last)
+            )
+        return file_content, first, last, data
+
+    async def index_text(self, sha256: str, key: str, codec: Optional[str], filename: str) -> None:
+        """Extract the text layer of new content into the full-text index.
+
+        Runs in the background after the upload responded, with its own
+        session, and once per content since deduplicated uploads share it.
+        """
+        async with self.original_file(key, codec) as file_path:
+            pages = await run_cpu_bound(processing.extract_text, file_path, filename)
+        # The garbage collector removes content and its pages under the same lock
+        async with single_flight.hold(sha256):
+            async with AsyncSessionLocal() as db:
+                if await db.get(FileContent, sha256) is None:
+                    return
+                for statement, parameters in text_index.replace_pages_statements(sha256, pages):
+                    await db.execute(statement, parameters)
+                await db.commit()
+
+    async def index_page_hashes(self, sha256: str, key: str, codec: Optional[str], filename: str) -> None:
+        """Hash the pages of new content and record the contents it nearly duplicates.
+
+        Runs in the background after the upload responded, with its own session.
+        The candidates are read without locks, then the rows are written
+        holding the locks of the content and of every content it is paired with.
+        """
+        async with self.original_file(key, codec) as file_path:
+            hashes = await run_cpu_bound(processing.page_hashes, file_path, filename)
+        async with AsyncSessionLocal() as db:
+            candidates = []
+            for statement in near_duplicates.candidate_statements(sha256, hashes):
+                candidates.extend((await db.execute(statement)).all())
+            page_counts = dict((await db.execute(
+                near_duplicates.page_count_statement({candidate_sha256 for candidate_sha256, _ in candidates})
+            )).all())
+            similar = near_duplicates.similarities(hashes, candidates, page_counts)
+            keys = {sha256, *similar}
+            while True:
+                async with single_flight.hold(*keys):
+                    # Read what the other holders of these locks committed
+                    await db.rollback()
+                    partners = set(await db.scalars(near_duplicates.partners_statement(sha256)))
+                    if partners <= keys:
+                        existing = set(await db.scalars(
+                            select(FileContent.sha256).where(FileContent.sha256.in_(list(keys)))
+                        ))
+                        if sha256 not in existing:
+                            return
+                        similar = {other: value for other, value in similar.items() if other in existing}
+                        for statement, parameters in near_duplicates.replace_statements(sha256, hashes, similar):
+                            await db.execute(statement, parameters)
+                        await db.commit()
+                        return
+                # Pairs with contents not locked yet are replaced too, lock them as well
+                keys |= partners
+
+    async def similar_documents(
+        self, doc_uuid: str, same_bsc_number: bool = True, min_similarity: float = 0.0, limit: int = 20
+    ) -> List[SimilarDocument]:
+        """Documents with the same content or a near-duplicate one, most similar first."""
+        document = await self.db.get(Document, doc_uuid)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        contents = union_all(
+            select(literal(document.sha256).label("sha256"), literal(1.0).label("similarity")),
+            select(SimilarContent.similar_sha256, SimilarContent.similarity)
+            .where(SimilarContent.sha256 == document.sha256, SimilarContent.similarity >= min_similarity)
+        ).subquery()
+        query = (
+            select(
+                Document.uuid, Document.bsc_number, Document.category, Document.filename,
+                Document.upload_datetime, contents.c.similarity
+            )
+            .join(contents, Document.sha256 == contents.c.sha256)
+            .where(Document.uuid != doc_uuid)
+            .order_by(contents.c.similarity.desc(), Document.upload_datetime, Document.uuid)
+            .limit(limit)
+        )
+        if same_bsc_number:
+            query = query.where(Document.bsc_number == document.bsc_number)
+        with stage("query"):
+            rows = (await self.db.execute(query)).all()
+        return [
+            SimilarDocument(
+                uuid=row.uuid,
+                bsc_number=row.bsc_number,
+                category=row.category,
+                filename=row.filename,
+                upload_datetime=row.upload_datetime,
+                similarity=row.similarity
+            )
+            for row in rows
+        ]
+
+    async def search_text(
+        self, query: str, bsc_number: str = None, category: str = None,
+        limit: int = 20, offset: int = 0
+    ) -> List[TextSearchHit]:
+        """Search the text of the documents, best matching pages first, with highlighted snippets."""
+        dialect_name = self.db.bind.dialect.name
+        statement = text_index.search_statement(dialect_name, bsc_number, category)
+        parameters = text_index.search_parameters(dialect_name, query, bsc_number, category, limit, offset)
+        with stage("query"):
+            rows = (await self.db.execute(statement, parameters)).all()
+        return [
+            TextSearchHit(
+                uuid=row.uuid,
+                bsc_number=row.bsc_number,
+                category=row.category,
+                filename=row.filename,
+                page=row.page,
+                snippet=row.snippet,
+                score=row.score
+            )
+            for row in rows
+        ]
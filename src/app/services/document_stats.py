@@ -0,0 +1,163 @@
+"""Statistics of the documents, maintained by the writes.
+
+Each group (the total, each category and each BSC number) has a row of
+``document_stats`` updated in the transaction that adds, replaces or
+deletes its documents, so reading the statistics costs one row per group.
+Distinct contents are counted through ``document_stats_contents``, which
+holds the number of documents of a group per content: a content adds its
+size to the unique bytes of a group with its first document there and
+removes it with its last one. ``rebuild_statements`` recomputes both
+tables from the documents.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import BigInteger, cast, delete, func, insert, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Document, DocumentStats, DocumentStatsContent
+
+TOTAL = "total"
+BYTES_PER_MB = 1024 * 1024
+
+Group = Tuple[str, str]
+
+
+class StatsChange(NamedTuple):
+    """A document added (``sign`` 1) to or removed (-1) from the statistics."""
+    bsc_number: str
+    category: str
+    sha256: str
+    size: int
+    pages: int
+    sign: int
+
+
+def document_change(document: Document, sign: int) -> StatsChange:
+    """The change of adding (1) or removing (-1) a document."""
+    return StatsChange(
+        document.bsc_number, document.category, document.sha256,
+        round(document.filesize * BYTES_PER_MB), document.page_number or 0, sign
+    )
+
+
+def groups(bsc_number: str, category: str) -> List[Group]:
+    """The groups counting a document of a BSC number and category."""
+    return [(TOTAL, ""), ("category", category), ("bsc_number", bsc_number)]
+
+
+def _upsert(dialect_name: str, table):
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(dialect_name)
+    if dialect is None:
+        raise ValueError(f"Document statistics are not supported on {dialect_name}")
+    return dialect.insert(table)
+
+
+async def apply_changes(db: AsyncSession, changes: Iterable[StatsChange]) -> None:
+    """Add document changes to the statistics, in the session's transaction.
+
+    Changes are summed per group first, so a batch costs a few statements
+    per group and content rather than per document.
+    """
+    # document_count, total_bytes, page_count, content_count, unique_bytes
+    totals: Dict[Group, List[int]] = defaultdict(lambda: [0, 0, 0, 0, 0])
+    # Change of the document count of a content in a group, and its size
+    references: Dict[Tuple[str, str, str], List[int]] = {}
+    for change in changes:
+        for group in groups(change.bsc_number, change.category):
+            total = totals[group]
+            total[0] += change.sign
+            total[1] += change.sign * change.size
+            total[2] += change.sign * change.pages
+            references.setdefault(group + (change.sha256,), [0, change.size])[0] += change.sign
+
+    dialect_name = db.bind.dialect.name
+    for (dimension, value, sha256), (delta, size) in references.items():
+        if not delta:
+            continue
+        statement = _upsert(dialect_name, DocumentStatsContent).values(
+            dimension=dimension, value=value, sha256=sha256, document_count=delta
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["dimension", "value", "sha256"],
+            set_={"document_count": DocumentStatsContent.document_count + delta}
+        ).returning(DocumentStatsContent.document_count)
+        count = (await db.execute(statement)).scalar_one()
+        total = totals[(dimension, value)]
+        if count - delta <= 0 < count:
+            total[3] += 1
+            total[4] += size
+        elif count <= 0 < count - delta:
+            total[3] -= 1
+            total[4] -= size
+        if count <= 0:
+            await db.execute(delete(DocumentStatsContent).where(
+                DocumentStatsContent.dimension == dimension,
+                DocumentStatsContent.value == value,
+                DocumentStatsContent.sha256 == sha256
+            ))
+
+    for (dimension, value), deltas in totals.items():
+        if not any(deltas):
+            continue
+        columns = dict(zip(
+            ("document_count", "total_bytes", "page_count", "content_count", "unique_bytes"), deltas
+        ))
+        statement = _upsert(dialect_name, DocumentStats).values(dimension=dimension, value=value, **columns)
+        statement = statement.on_conflict_do_update(
+            index_elements=["dimension", "value"],
+            set_={name: getattr(DocumentStats, name) + delta for name, delta in columns.items()}
+        ).returning(DocumentStats.document_count)
+        if (await db.execute(statement)).scalar_one() <= 0:
+            await db.execute(delete(DocumentStats).where(
+                DocumentStats.dimension == dimension, DocumentStats.value == value
+            ))
+
+
+def rebuild_statements() -> list:
+    """Statements recomputing the statistics from the documents."""
+    document_bytes = cast(func.round(Document.filesize * BYTES_PER_MB), BigInteger)
+    statements = [delete(DocumentStatsContent), delete(DocumentStats)]
+    for dimension, column in ((TOTAL, None), ("category", Document.category), ("bsc_number", Document.bsc_number)):
+        value = (literal("") if column is None else column).label("value")
+        group_by = [] if column is None else [column]
+
+        per_content = (
+            select(value, Document.sha256, func.count().label("document_count"), func.max(document_bytes).label("size"))
+            .group_by(*group_by, Document.sha256)
+            .subquery()
+        )
+        statements.append(insert(DocumentStatsContent).from_select(
+            ["dimension", "value", "sha256", "document_count"],
+            select(literal(dimension), per_content.c.value, per_content.c.sha256, per_content.c.document_count)
+        ))
+
+        documents = (
+            select(
+                value,
+                func.count().label("document_count"),
+                func.sum(document_bytes).label("total_bytes"),
+                func.sum(func.coalesce(Document.page_number, 0)).label("page_count")
+            )
+            .group_by(*group_by)
+            .having(func.count() > 0)
+            .subquery()
+        )
+        contents = (
+            select(
+                per_content.c.value,
+                func.count().label("content_count"),
+                func.sum(per_content.c.size).label("unique_bytes")
+            )
+            .group_by(per_content.c.value)
+            .subquery()
+        )
+        statements.append(insert(DocumentStats).from_select(
+            ["dimension", "value", "document_count", "total_bytes", "page_count", "content_count", "unique_bytes"],
+            select(
+                literal(dimension), documents.c.value, documents.c.document_count, documents.c.total_bytes,
+                documents.c.page_count, contents.c.content_count, contents.c.unique_bytes
+            ).join_from(documents, contents, documents.c.value == contents.c.value)
+        ))
+    return statements
@@ -0,0 +1,109 @@
+"""Group commit of the metadata written by concurrent uploads.
+
+Each upload normally commits its own transaction, and on SQLite every
+commit is a sync of the write-ahead log that waits behind the others. With
+``GROUP_COMMIT_ENABLED`` the uploads of a worker process instead submit
+their writes to a queue; a writer applies the writes queued within
+``GROUP_COMMIT_INTERVAL_MS`` (at most ``GROUP_COMMIT_MAX_WRITES``) in one
+transaction and commits them together. Each request waits until its own
+write is committed, so a response is never sent before its rows are
+durable.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..metrics import record_group_commit
+
+# Applies the statements of one request to the writer's session, without committing
+Write = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class GroupCommitWriter:
+    """Per-process writer committing the writes of concurrent requests together.
+
+    A write that fails makes the whole group roll back, and its writes are
+    then committed one at a time, so only the failing one reports an error.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, interval_seconds: float, max_writes: int):
+        self.session_factory = session_factory
+        self.interval_seconds = interval_seconds
+        self.max_writes = max_writes
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, write: Write) -> Any:
+        """Queue a write and wait until it is committed, returning its result."""
+        if self._task is None or self._task.done() or self._task.get_loop() is not asyncio.get_running_loop():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((write, future))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The write may still be committed, which the caller must not
+            # miss while holding locks on what it writes
+            await asyncio.wait([future])
+            raise
+
+    async def stop(self) -> None:
+        """Commit the queued writes and stop the writer."""
+        if self._task is None or self._task.done():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            group = [item]
+            deadline = loop.time() + self.interval_seconds
+            stopping = False
+            while len(group) < self.max_writes:
+                timeout = deadline - loop.time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(
+                        self._queue.get(), timeout
+                    )
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            await self._commit(group)
+            if stopping:
+                return
+
+    async def _commit(self, group: List[Tuple[Write, asyncio.Future]]) -> None:
+        try:
+            async with self.session_factory() as db:
+                results = [await write(db) for write, _ in group]
+                await db.commit()
+        except Exception as exc:
+            if len(group) > 1:
+                for item in group:
+                    await self._commit([item])
+                return
+            _, future = group[0]
+            if not future.done():
+                future.set_exception(exc)
+            return
+        record_group_commit(len(group))
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+
+
+group_commit = GroupCommitWriter(
+    AsyncSessionLocal, settings.GROUP_COMMIT_INTERVAL_MS / 1000, settings.GROUP_COMMIT_MAX_WRITES
+) if settings.GROUP_COMMIT_ENABLED else None
@@ -0,0 +1,170 @@
+"""Near-duplicate index over the perceptual hashes of the pages.
+
+Each page hash is split into four 16-bit bands stored in indexed columns
+(multi-index hashing). Two hashes within ``d`` bits of each other have at
+least one band within ``d // 4`` bits, so the candidates of a hash are the
+pages having a band among the few values within that radius of its own,
+and only those are compared bit by bit.
+"""
+from collections import defaultdict
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import CompoundSelect, Select, case, delete, func, insert, or_, select, union, update
+
+from ..config import settings
+from ..models import FileContent, PageHash, SimilarContent
+
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+HASH_MASK = (1 << 64) - 1
+# Page hashes looked up per statement, keeping the bound parameters in check
+LOOKUP_BATCH = 25
+
+
+def to_signed(value: int) -> int:
+    """Store a 64-bit hash in a signed BIGINT column."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def split_bands(value: int) -> List[int]:
+    """The bands of a hash, most significant first."""
+    return [(value >> (BAND_BITS * (BANDS - 1 - band))) & BAND_MASK for band in range(BANDS)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & HASH_MASK).count("1")
+
+
+def band_probes(value: int, radius: int) -> List[int]:
+    """Band values within ``radius`` bits of a band value."""
+    probes = [value]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            probes.append(flipped)
+    return probes
+
+
+def candidate_statements(sha256: str, hashes: List[int]) -> List[Select]:
+    """Statements reading (sha256, phash) of the pages of other contents near the hashes.
+
+    Blank pages (hash 0) are left out. Pages with the most bands near those
+    of the hashes come first, so the nearest ones are kept when there are
+    more than ``NEAR_DUPLICATE_MAX_CANDIDATES``.
+    """
+    radius = settings.NEAR_DUPLICATE_MAX_DISTANCE // BANDS
+    hashes = sorted({value for value in hashes if value})
+    statements = []
+    for start in range(0, len(hashes), LOOKUP_BATCH):
+        probes: List[Set[int]] = [set() for _ in range(BANDS)]
+        for value in hashes[start:start + LOOKUP_BATCH]:
+            for band, band_value in enumerate(split_bands(value)):
+                probes[band].update(band_probes(band_value, radius))
+        columns = (PageHash.band0, PageHash.band1, PageHash.band2, PageHash.band3)
+        matches = [column.in_(sorted(values)) for column, values in zip(columns, probes)]
+        statements.append(
+            select(PageHash.sha256, PageHash.phash)
+            .where(PageHash.sha256 != sha256, or_(*matches))
+            .order_by(sum(case((match, 1), else_=0) for match in matches).desc())
+            .limit(settings.NEAR_DUPLICATE_MAX_CANDIDATES)
+        )
+    return statements
+
+
+def partners_statement(sha256: str) -> CompoundSelect:
+    """Contents recorded as similar to a content.
+
+    Both rows of a pair of contents are written and deleted holding the
+    ``single_flight`` locks of the two contents.
+    """
+    return union(
+        select(SimilarContent.similar_sha256).where(SimilarContent.sha256 == sha256),
+        select(SimilarContent.sha256).where(SimilarContent.similar_sha256 == sha256),
+    )
+
+
+def page_count_statement(hashes: Iterable[str]) -> Select:
+    """Number of hashed pages of each content."""
+    return (
+        select(PageHash.sha256, func.count())
+        .where(PageHash.sha256.in_(list(hashes)))
+        .group_by(PageHash.sha256)
+    )
+
+
+def similarities(
+    hashes: List[int], candidates: Iterable[Tuple[str, int]], page_counts: Dict[str, int]
+) -> Dict[str, float]:
+    """Similarity of the contents of candidate pages, keeping the near-duplicates.
+
+    The similarity is the number of pages matching a page of the other
+    content over the page count of the longer of the two.
+    """
+    own = [value for value in hashes if value]
+    pages_by_content: Dict[str, List[int]] = defaultdict(list)
+    for sha256, value in candidates:
+        pages_by_content[sha256].append(value & HASH_MASK)
+
+    result = {}
+    for sha256, pages in pages_by_content.items():
+        matched = sum(
+            1 for value in own
+            if any(hamming(value, page) <= settings.NEAR_DUPLICATE_MAX_DISTANCE for page in pages)
+        )
+        similarity = matched / max(len(own), page_counts.get(sha256, len(pages)))
+        if similarity >= settings.NEAR_DUPLICATE_MIN_SIMILARITY:
+            result[sha256] = round(similarity, 3)
+    return result
+
+
+def replace_statements(sha256: str, hashes: List[int], similar: Dict[str, float]) -> list:
+    """Statements (with their parameters) replacing the page hashes and similar contents of a content.
+
+    Must run holding the ``single_flight`` locks of the content, of the
+    similar ones and of its current partners (see ``partners_statement``).
+    """
+    statements = [
+        (delete(PageHash).where(PageHash.sha256 == sha256), None),
+        (delete(SimilarContent).where(
+            or_(SimilarContent.sha256 == sha256, SimilarContent.similar_sha256 == sha256)
+        ), None),
+    ]
+    rows = []
+    for number, value in enumerate(hashes, start=1):
+        if value:
+            bands = split_bands(value)
+            rows.append({
+                "sha256": sha256, "page": number, "phash": to_signed(value),
+                **{f"band{band}": bands[band] for band in range(BANDS)}
+            })
+    if rows:
+        statements.append((insert(PageHash), rows))
+    if similar:
+        statements.append((insert(SimilarContent), [
+            row
+            for other, similarity in similar.items()
+            for row in (
+                {"sha256": sha256, "similar_sha256": other, "similarity": similarity},
+                {"sha256": other, "similar_sha256": sha256, "similarity": similarity},
+            )
+        ]))
+    statements.append((
+        update(FileContent).where(FileContent.sha256 == sha256).values(page_hashes_at=datetime.now()),
+        None
+    ))
+    return statements
+
+
+def delete_statements(sha256: str) -> list:
+    """Statements removing the page hashes and similar contents of a deleted content."""
+    return [
+        delete(PageHash).where(PageHash.sha256 == sha256),
+        delete(SimilarContent).where(
+            or_(SimilarContent.sha256 == sha256, SimilarContent.similar_sha256 == sha256)
+        ),
+    ]
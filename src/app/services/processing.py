@@ -0,0 +1,190 @@
+"""CPU-bound document processing.
+
+These are plain module-level functions so they can be pickled and run in the
+process pool managed by :mod:`app.executor`.
+"""
+import hashlib
+import io
+import math
+import mmap
+import os
+from typing import Callable, List, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps, ImageStat
+
+
+class UnreadableDocument(ValueError):
+    """The file could not be parsed as a PDF or a JPEG image."""
+
+
+def is_image(filename: str) -> bool:
+    """Whether the file is handled as an image rather than a PDF."""
+    return filename.lower().endswith(('.jpg', '.jpeg'))
+
+
+def calculate_sha256(file_content: bytes) -> str:
+    """Calculate SHA256 hash of file content."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def sha256_mapped(
+    file_path: str, chunk_size: int = 1024 * 1024, on_chunk: Optional[Callable[[int], None]] = None
+) -> str:
+    """Calculate SHA256 hash of a file, memory-mapping it and hashing one chunk at a time.
+
+    Mapped pages are hashed without being copied into Python buffers.
+    ``on_chunk`` is called with the size of each chunk before it is read.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return hasher.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for start in range(0, size, chunk_size):
+                    chunk = view[start:start + chunk_size]
+                    if on_chunk is not None:
+                        on_chunk(len(chunk))
+                    hasher.update(chunk)
+                    chunk.release()
+    return hasher.hexdigest()
+
+
+def convert_to_png(file_path: str, filename: str) -> List[bytes]:
+    """Convert document to PNG pages."""
+    pages = []
+    if is_image(filename):
+        img = Image.open(file_path)
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format='PNG')
+        pages.append(img_byte_arr.getvalue())
+    else:  # PDF
+        doc = fitz.open(file_path, filetype="pdf")
+        for page in doc:
+            pix = page.get_pixmap()
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            img_byte_arr = io.BytesIO()
+            img.save(img_byte_arr, format='PNG')
+            pages.append(img_byte_arr.getvalue())
+    return pages
+
+
+def render_page(file_path: str, filename: str, page_index: int, dpi: int, image_format: str) -> bytes:
+    """Render a single page (0-based) to PNG or JPEG bytes at the given resolution."""
+    with fitz.open(file_path, filetype="jpeg" if is_image(filename) else "pdf") as doc:
+        pix = doc.load_page(page_index).get_pixmap(dpi=dpi, alpha=False)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format=image_format.upper())
+    return img_byte_arr.getvalue()
+
+
+def extract_pages(doc: fitz.Document, first: int, last: int) -> bytes:
+    """A new PDF of the pages ``first`` to ``last`` (1-based, inclusive) of an open PDF.
+
+    No random file identifier is written, so the same pages always give the
+    same bytes.
+    """
+    with fitz.open() as extract:
+        extract.insert_pdf(doc, from_page=first - 1, to_page=last - 1)
+        return extract.tobytes(garbage=1, deflate=True, no_new_id=True)
+
+
+def extract_text(file_path: str, filename: str) -> List[str]:
+    """Text layer of each page of a PDF (images have none)."""
+    if is_image(filename):
+        return []
+    with fitz.open(file_path, filetype="pdf") as doc:
+        return [page.get_text("text").replace("\x00", "") for page in doc]
+
+
+# DCT-II basis of the lowest frequencies of a PHASH_SIZE x PHASH_SIZE thumbnail
+PHASH_SIZE = 32
+PHASH_FREQUENCIES = 8
+_PHASH_COSINES = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+    for u in range(PHASH_FREQUENCIES)
+]
+
+
+def phash(img: Image.Image) -> int:
+    """64-bit perceptual hash of an image, or 0 for a blank one.
+
+    Each bit tells whether one of the 8x8 lowest frequencies of the discrete
+    cosine transform of a 32x32 grayscale thumbnail is above their median, so
+    half of the bits are set even on sparse pages such as forms.
+    """
+    img = img.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    if ImageStat.Stat(img).stddev[0] < 2:
+        return 0
+    pixels = list(ImageOps.autocontrast(img).getdata())
+    # The transform is separable: rows first, then columns
+    rows = [
+        [sum(cosines[x] * pixels[y * PHASH_SIZE + x] for x in range(PHASH_SIZE)) for cosines in _PHASH_COSINES]
+        for y in range(PHASH_SIZE)
+    ]
+    coefficients = [
+        sum(_PHASH_COSINES[u][y] * rows[y][v] for y in range(PHASH_SIZE))
+        for u in range(PHASH_FREQUENCIES) for v in range(PHASH_FREQUENCIES)
+    ]
+    # The DC term only reflects the overall brightness
+    median = sorted(coefficients[1:])[len(coefficients) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = value << 1 | (coefficient > median)
+    return value
+
+
+def page_hashes(file_path: str, filename: str, size: int = 64) -> List[int]:
+    """Perceptual hash of each page, rendered as a thumbnail about ``size`` pixels wide."""
+    if is_image(filename):
+        with Image.open(file_path) as img:
+            # JPEGs are decoded at a reduced scale straight away
+            img.draft("L", (size, size))
+            return [phash(img)]
+    hashes = []
+    with fitz.open(file_path, filetype="pdf") as doc:
+        for page in doc:
+            zoom = size / max(page.rect.width, 1)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+            hashes.append(phash(Image.frombytes("L", [pix.width, pix.height], pix.samples)))
+    return hashes
+
+
+def probe_file(file_path: str, filename: str) -> dict:
+    """Read page count, MIME type and dimensions from the file metadata.
+
+    Only the PDF page tree or the image header is parsed, no page is rendered.
+    Raises :class:`UnreadableDocument` when the file cannot be parsed; errors
+    reading the file itself are raised as they are.
+    """
+    if is_image(filename):
+        with open(file_path, "rb") as f:
+            try:
+                with Image.open(f) as img:
+                    width, height = img.size
+                    page_count = getattr(img, "n_frames", 1)
+            except (OSError, SyntaxError, ValueError, EOFError, Image.DecompressionBombError) as exc:
+                raise UnreadableDocument(str(exc)) from exc
+        mime_type = "image/jpeg"
+    else:  # PDF
+        try:
+            with fitz.open(file_path, filetype="pdf") as doc:
+                page_count = doc.page_count
+                width = height = None
+                if page_count:
+                    rect = doc.load_page(0).rect
+                    width, height = round(rect.width), round(rect.height)
+        except fitz.FileDataError as exc:
+            raise UnreadableDocument(str(exc)) from exc
+        mime_type = "application/pdf"
+    return {
+        "page_count": page_count,
+        "mime_type": mime_type,
+        "width": width,
+        "height": height,
+    }
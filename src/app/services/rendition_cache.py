@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from ..config import settings
+
+
+class RenditionCache:
+    """On-disk cache of rendered pages keyed by (sha256, page, dpi, format).
+
+    Entries are evicted in least-recently-used order once the cache grows past
+    ``max_bytes``. Each worker process keeps its own index of the directory and
+    rescans it before evicting, so renditions written by other workers are
+    accounted for.
+    """
+
+    RESCAN_INTERVAL = 60
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def path_for(self, sha256: str, page: int, dpi: int, image_format: str) -> str:
+        """Path of a rendition, sharded by content hash."""
+        return os.path.join(self.root, sha256[:2], sha256, f"{page}-{dpi}.{image_format}")
+
+    def get(self, sha256: str, page: int, dpi: int, image_format: str) -> Optional[str]:
+        """Return the path of a cached rendition and mark it as recently used.
+
+        Touches the file to record the access, so it runs in the thread pool
+        like ``put``.
+        """
+        path = self.path_for(sha256, page, dpi, image_format)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(path)
+            return None
+        with self._lock:
+            if path not in self._entries:
+                self._total_bytes += size
+            self._entries[path] = size
+            self._entries.move_to_end(path)
+        return path
+
+    def put(self, sha256: str, page: int, dpi: int, image_format: str, data: bytes) -> str:
+        """Store a rendition atomically and evict old entries if needed."""
+        path = self.path_for(sha256, page, dpi, image_format)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".rendition-", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._forget(path)
+            self._entries[path] = len(data)
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def discard(self, sha256: str) -> None:
+        """Remove every rendition of a content hash."""
+        directory = os.path.dirname(self.path_for(sha256, 0, 0, "png"))
+        with self._lock:
+            for path in [path for path in self._entries if path.startswith(directory + os.sep)]:
+                self._forget(path)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def _forget(self, path: str) -> None:
+        size = self._entries.pop(path, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _scan(self) -> None:
+        """Rebuild the index from disk, oldest access first."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((path, size) for _, path, size in entries)
+        self._total_bytes = sum(size for _, _, size in entries)
+        self._scanned_at = time.monotonic()
+
+    def _evict(self, keep: str) -> None:
+        if self._scanned_at is None or time.monotonic() - self._scanned_at > self.RESCAN_INTERVAL:
+            self._scan()
+        while self._total_bytes > self.max_bytes and self._entries:
+            path, size = next(iter(self._entries.items()))
+            if path == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(path)
+                continue
+            self._forget(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+rendition_cache = RenditionCache(
+    settings.RENDITION_DIR or os.path.join(settings.UPLOAD_DIR, "renditions"),
+    settings.RENDITION_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,186 @@
+"""Integrity scrubber of the stored blobs.
+
+Nothing else reads a blob unless its document is downloaded, so bit rot or
+a partial write would go unnoticed until then. The scrubber walks the
+``FileContent`` rows in hash order and re-hashes each blob, recording the
+ones that are missing, unreadable or no longer hash to their key in
+``integrity_findings``; a finding is removed once its blob checks out again.
+
+Blobs are hashed by a pool of threads (``hashlib`` releases the GIL while it
+hashes, and stored originals are memory-mapped rather than copied), which
+share a budget of bytes read per second so live traffic keeps most of the
+disk bandwidth. Progress is saved in ``scrub_checkpoints`` after each batch,
+so an interrupted pass resumes where it stopped.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import FileContent, IntegrityFinding, ScrubCheckpoint
+from . import processing
+from .blob_store import blob_store
+from .single_flight import single_flight
+
+# Name of the checkpoint of the content store
+STORE = "blobs"
+PROBLEMS = ("missing", "mismatch", "unreadable")
+BATCH_SIZE = 500
+
+
+class ByteRateLimiter:
+    """Token bucket bounding the bytes read per second by several threads together.
+
+    A reader takes the bytes it is about to read and sleeps off any debt, so
+    readers are paced in turn. A rate of 0 or less removes the limit.
+    """
+
+    def __init__(self, bytes_per_second: int):
+        self.rate = bytes_per_second
+        self._available = float(max(bytes_per_second, 0))
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size: int) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # At most one second of unused budget is saved up
+            self._available = min(self.rate, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= size
+            wait = -self._available / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class BlobCheck(NamedTuple):
+    """Outcome of re-hashing a blob (``problem`` is None when it checks out)."""
+    problem: Optional[str]
+    actual_sha256: Optional[str]
+    detail: Optional[str]
+    size: int
+
+
+def check_blob(sha256: str, key: str, codec: Optional[str], limiter: ByteRateLimiter) -> BlobCheck:
+    """Re-hash the original bytes of a blob and compare them to its content hash."""
+    read = 0
+
+    def throttle(size: int) -> None:
+        nonlocal read
+        limiter.consume(size)
+        read += size
+
+    path = blob_store.local_path(key)
+    try:
+        if path is None or codec:
+            hasher = hashlib.sha256()
+            for data in blob_store.iter_original(key, codec):
+                throttle(len(data))
+                hasher.update(data)
+            actual = hasher.hexdigest()
+        else:
+            actual = processing.sha256_mapped(path, on_chunk=throttle)
+    except FileNotFoundError:
+        return BlobCheck("missing", None, None, read)
+    except Exception as exc:
+        # Compressed blobs that no longer decompress, I/O errors...
+        return BlobCheck("unreadable", None, f"{type(exc).__name__}: {exc}", read)
+    if actual != sha256:
+        return BlobCheck("mismatch", actual, None, read)
+    return BlobCheck(None, actual, None, read)
+
+
+def scrub_storage(
+    db: Session, workers: int = None, max_bytes_per_second: int = None,
+    limit: int = None, restart: bool = False
+) -> Dict[str, int]:
+    """Check the blobs of the contents after the checkpoint, up to the end of the pass.
+
+    ``limit`` bounds the number of contents checked by this run, so a pass
+    can be spread over several runs; ``restart`` starts a new pass from the
+    first content.
+    """
+    workers = workers or settings.SCRUB_WORKERS
+    if max_bytes_per_second is None:
+        max_bytes_per_second = settings.SCRUB_MAX_BYTES_PER_SECOND
+    limiter = ByteRateLimiter(max_bytes_per_second)
+    stats = {"checked": 0, "bytes": 0, "ok": 0, **{problem: 0 for problem in PROBLEMS}, "completed_passes": 0}
+
+    checkpoint = db.get(ScrubCheckpoint, STORE)
+    if checkpoint is None:
+        checkpoint = ScrubCheckpoint(name=STORE)
+        db.add(checkpoint)
+    if restart or checkpoint.pass_started_at is None:
+        checkpoint.last_sha256 = ""
+        checkpoint.checked = 0
+        checkpoint.checked_bytes = 0
+        checkpoint.pass_started_at = datetime.now()
+    db.commit()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while limit is None or stats["checked"] < limit:
+            batch_size = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - stats["checked"])
+            rows = db.execute(
+                select(FileContent.sha256, FileContent.file_path, FileContent.codec)
+                .where(FileContent.sha256 > checkpoint.last_sha256)
+                .order_by(FileContent.sha256)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                checkpoint.last_pass_completed_at = datetime.now()
+                checkpoint.pass_started_at = None
+                checkpoint.updated_at = datetime.now()
+                db.commit()
+                stats["completed_passes"] += 1
+                break
+
+            checks = list(pool.map(lambda row: check_blob(row.sha256, row.file_path, row.codec, limiter), rows))
+            checked_bytes = sum(check.size for check in checks)
+            healthy = [row.sha256 for row, check in zip(rows, checks) if check.problem is None]
+            if healthy:
+                db.execute(delete(IntegrityFinding).where(IntegrityFinding.sha256.in_(healthy)))
+            stats["ok"] += len(healthy)
+            for (sha256, key, _), check in zip(rows, checks):
+                if check.problem is not None and _record_finding(db, sha256, key, check):
+                    stats[check.problem] += 1
+
+            checkpoint.last_sha256 = rows[-1].sha256
+            checkpoint.checked += len(rows)
+            checkpoint.checked_bytes += checked_bytes
+            checkpoint.updated_at = datetime.now()
+            db.commit()
+            stats["checked"] += len(rows)
+            stats["bytes"] += checked_bytes
+    return stats
+
+
+def _record_finding(db: Session, sha256: str, key: str, check: BlobCheck) -> bool:
+    """Record the problem of a blob, unless its content changed since it was read."""
+    # A new transaction reads the content as it is now: it may have been
+    # collected or recompressed since the batch was read
+    db.commit()
+    with single_flight.hold_blocking(sha256):
+        current_key = db.execute(select(FileContent.file_path).where(FileContent.sha256 == sha256)).scalar()
+        if current_key != key:
+            db.commit()
+            return False
+        now = datetime.now()
+        finding = db.get(IntegrityFinding, sha256)
+        if finding is None:
+            finding = IntegrityFinding(sha256=sha256, detected_at=now)
+            db.add(finding)
+        finding.file_path = key
+        finding.problem = check.problem
+        finding.actual_sha256 = check.actual_sha256
+        finding.detail = check.detail
+        finding.checked_at = now
+        db.commit()
+    return True
@@ -0,0 +1,252 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..config import settings
+from ..schemas import DocumentList
+
+# The (bsc_number, category) filter of a search, None standing for "any"
+FilterKey = Tuple[Optional[str], Optional[str]]
+# The (limit, cursor) page of a search
+PageKey = Tuple[int, Optional[str]]
+SearchPage = Tuple[List[DocumentList], Optional[str]]
+
+
+def affected_filters(bsc_number: str, category: str) -> List[FilterKey]:
+    """The filters whose results include documents of a BSC number and category."""
+    return [(None, None), (bsc_number, None), (None, category), (bsc_number, category)]
+
+
+class SearchCache(ABC):
+    """Bounded LRU cache of search result pages with a time to live.
+
+    Entries are grouped by filter so a write invalidates exactly the filters
+    matching the document's BSC number and category. A reader takes the
+    filter's generation before querying and stores the page with it; an
+    invalidation bumps the generation, so a page read before a concurrent
+    write committed is never served afterwards.
+    """
+
+    # Whether the calls do blocking I/O and must run off the event loop
+    blocking = False
+
+    @abstractmethod
+    def generation(self, filter_key: FilterKey) -> int:
+        """Generation of a filter, bumped by every invalidation."""
+
+    @abstractmethod
+    def get(self, filter_key: FilterKey, page_key: PageKey) -> Optional[SearchPage]:
+        """A cached page still valid for its filter, or None."""
+
+    @abstractmethod
+    def put(self, filter_key: FilterKey, page_key: PageKey, page: SearchPage, generation: int) -> None:
+        """Store a page read at a generation, unless the filter was invalidated since."""
+
+    @abstractmethod
+    def invalidate(self, filter_keys: Iterable[FilterKey]) -> None:
+        """Drop the pages of filters and bump their generations."""
+
+
+class MemorySearchCache(SearchCache):
+    """Search cache held by one worker process.
+
+    Invalidations only reach the cache of the worker making the write, so it
+    is only used when a single worker serves the app.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[FilterKey, PageKey], Tuple[float, int, SearchPage]]" = OrderedDict()
+        self._pages: Dict[FilterKey, Set[PageKey]] = {}
+        # Generation of recently invalidated filters; older ones fall back to the floor
+        self._generations: "OrderedDict[FilterKey, int]" = OrderedDict()
+        self._floor = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def generation(self, filter_key: FilterKey) -> int:
+        with self._lock:
+            return self._generations.get(filter_key, self._floor)
+
+    def get(self, filter_key: FilterKey, page_key: PageKey) -> Optional[SearchPage]:
+        key = (filter_key, page_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, generation, page = entry
+            if expires_at < time.monotonic() or generation < self._generations.get(filter_key, self._floor):
+                self._forget(key)
+                return None
+            self._entries.move_to_end(key)
+            return page
+
+    def put(self, filter_key: FilterKey, page_key: PageKey, page: SearchPage, generation: int) -> None:
+        key = (filter_key, page_key)
+        with self._lock:
+            if generation < self._generations.get(filter_key, self._floor):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, generation, page)
+            self._entries.move_to_end(key)
+            self._pages.setdefault(filter_key, set()).add(page_key)
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def invalidate(self, filter_keys: Iterable[FilterKey]) -> None:
+        with self._lock:
+            self._clock += 1
+            for filter_key in filter_keys:
+                for page_key in self._pages.pop(filter_key, ()):
+                    self._entries.pop((filter_key, page_key), None)
+                self._generations[filter_key] = self._clock
+                self._generations.move_to_end(filter_key)
+            # Forgetting a generation raises the floor to it, which can only
+            # invalidate more entries, never serve stale ones
+            while len(self._generations) > self.max_entries:
+                _, generation = self._generations.popitem(last=False)
+                self._floor = max(self._floor, generation)
+
+    def _forget(self, key: Tuple[FilterKey, PageKey]) -> None:
+        self._entries.pop(key, None)
+        filter_key, page_key = key
+        pages = self._pages.get(filter_key)
+        if pages is not None:
+            pages.discard(page_key)
+            if not pages:
+                del self._pages[filter_key]
+
+
+class SQLiteSearchCache(SearchCache):
+    """Search cache shared by the worker processes of a host through a SQLite file.
+
+    Pages are stored as JSON. The file only holds a cache, so it is written
+    without syncing to disk.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread of the thread pool
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "filter TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "filter TEXT NOT NULL, page TEXT NOT NULL, generation INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL, payload TEXT NOT NULL, "
+                "PRIMARY KEY (filter, page))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at)")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _key(key) -> str:
+        return json.dumps(key)
+
+    def generation(self, filter_key: FilterKey) -> int:
+        row = self._connection().execute(
+            "SELECT generation FROM generations WHERE filter = ?", (self._key(filter_key),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, filter_key: FilterKey, page_key: PageKey) -> Optional[SearchPage]:
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT e.payload FROM entries e LEFT JOIN generations g ON g.filter = e.filter "
+            "WHERE e.filter = ? AND e.page = ? AND e.expires_at > ? "
+            "AND e.generation >= COALESCE(g.generation, 0)",
+            (self._key(filter_key), self._key(page_key), now)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE entries SET accessed_at = ? WHERE filter = ? AND page = ?",
+            (now, self._key(filter_key), self._key(page_key))
+        )
+        documents, next_cursor = json.loads(row[0])
+        return [DocumentList.model_validate(document) for document in documents], next_cursor
+
+    def put(self, filter_key: FilterKey, page_key: PageKey, page: SearchPage, generation: int) -> None:
+        documents, next_cursor = page
+        payload = json.dumps([[document.model_dump(mode="json") for document in documents], next_cursor])
+        now = time.time()
+        connection = self._connection()
+        # Skipped when the filter was invalidated since the generation was read
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (filter, page, generation, expires_at, accessed_at, payload) "
+            "SELECT ?, ?, ?, ?, ?, ? WHERE ? >= COALESCE((SELECT generation FROM generations WHERE filter = ?), 0)",
+            (self._key(filter_key), self._key(page_key), generation, now + self.ttl_seconds, now, payload,
+             generation, self._key(filter_key))
+        )
+        self._writes += 1
+        if self._writes % 64 == 0:
+            self._evict(connection, now)
+
+    def invalidate(self, filter_keys: Iterable[FilterKey]) -> None:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for filter_key in filter_keys:
+                key = self._key(filter_key)
+                connection.execute(
+                    "INSERT INTO generations (filter, generation) VALUES (?, 1) "
+                    "ON CONFLICT (filter) DO UPDATE SET generation = generation + 1",
+                    (key,)
+                )
+                connection.execute("DELETE FROM entries WHERE filter = ?", (key,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        connection.execute(
+            "DELETE FROM entries WHERE rowid IN ("
+            "SELECT rowid FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+
+def create_search_cache() -> Optional[SearchCache]:
+    """The search cache selected by the settings, or None when it is disabled."""
+    backend = settings.SEARCH_CACHE_BACKEND
+    if backend is None or backend == "memory" and settings.WEB_CONCURRENCY > 1:
+        # Several workers share a cache, so that a write invalidates the pages of all of them
+        backend = "memory" if settings.WEB_CONCURRENCY <= 1 else "sqlite"
+    if backend == "memory":
+        return MemorySearchCache(settings.SEARCH_CACHE_MAX_ENTRIES, settings.SEARCH_CACHE_TTL_SECONDS)
+    if backend == "sqlite":
+        return SQLiteSearchCache(
+            settings.SEARCH_CACHE_PATH or os.path.join(settings.UPLOAD_DIR, "search_cache.db"),
+            settings.SEARCH_CACHE_MAX_ENTRIES,
+            settings.SEARCH_CACHE_TTL_SECONDS,
+        )
+    if backend in ("", "none"):
+        return None
+    raise ValueError(f"Unknown search cache backend: {backend}")
+
+
+search_cache = create_search_cache()
@@ -0,0 +1,204 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from ..config import settings
+from ..database import create_async_db_engine, create_db_engine
+from ..metrics import stage
+from .blob_store import blob_store
+
+# Advisory locks of a stripe are pg_advisory_lock(namespace, stripe)
+ADVISORY_LOCK_NAMESPACE = 0x73666C74
+ADVISORY_LOCK = text("SELECT pg_advisory_lock(:namespace, :stripe)")
+ADVISORY_UNLOCK_ALL = text("SELECT pg_advisory_unlock_all()")
+
+
+class SingleFlight:
+    """Mutual exclusion per content hash across tasks and worker processes.
+
+    Work on one hash (looking up its FileContent, writing its blob, inserting
+    or deleting its row) runs in a single flight: concurrent uploads of the
+    same content wait for the first one and then find its committed row.
+    Hashes are spread over 256 stripes named after their first byte. Inside
+    a process an ``asyncio.Lock`` per stripe queues the tasks; across
+    processes an ``flock`` on the stripe's lock file does. The lock file is
+    polled without blocking, so waiting tasks do not tie up the threads the
+    holder needs to finish. Without ``fcntl`` only the in-process lock is used.
+
+    When the database is PostgreSQL, which every API node shares, processes
+    are excluded by an advisory lock per stripe instead of the lock file, so
+    nodes sharing a bucket (``STORAGE_BACKEND=s3``) never delete a blob that
+    another one is referencing. The advisory locks are taken on connections
+    of their own pool, so waiting for a lock never holds a connection the
+    holder needs.
+    """
+
+    # Delays between attempts to take a lock file held by another process
+    RETRY_DELAYS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05)
+
+    def __init__(self, lock_dir: str, advisory: bool = False):
+        self.lock_dir = lock_dir
+        self.advisory = advisory
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+        # Engines of the advisory locks, created on first use
+        self._engine = None
+        self._async_engine = None
+
+    @staticmethod
+    def _stripe(key: str) -> str:
+        return key[:2].lower()
+
+    def _stripe_path(self, stripe: str) -> str:
+        return os.path.join(self.lock_dir, f"{stripe}.lock")
+
+    def _open_stripe(self, path: str) -> int:
+        os.makedirs(self.lock_dir, exist_ok=True)
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @staticmethod
+    def _advisory_parameters(stripe: str) -> dict:
+        return {"namespace": ADVISORY_LOCK_NAMESPACE, "stripe": int(stripe, 16)}
+
+    def _acquire_file_locks(self, keys: List[str]) -> List[int]:
+        if fcntl is None:
+            return []
+        fds = []
+        try:
+            # Stripes are locked in sorted order so two batches cannot deadlock
+            for stripe in sorted({self._stripe(key) for key in keys}):
+                fd = self._open_stripe(self._stripe_path(stripe))
+                fds.append(fd)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._release_file_locks(fds)
+            raise
+        return fds
+
+    async def _acquire_file_lock(self, path: str) -> Optional[int]:
+        """Take the lock file of a stripe, polling while another process holds it."""
+        if fcntl is None:
+            return None
+        fd = self._open_stripe(path)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    await asyncio.sleep(self.RETRY_DELAYS[min(attempt, len(self.RETRY_DELAYS) - 1)])
+                    attempt += 1
+        except BaseException:
+            os.close(fd)
+            raise
+
+    @staticmethod
+    def _release_file_locks(fds: List[int]) -> None:
+        for fd in fds:
+            # Closing the descriptor releases its lock
+            os.close(fd)
+
+    async def _acquire_advisory_locks(self, stripes: List[str]):
+        """Take the advisory locks of stripes, in order, on a connection returned to release them."""
+        if self._async_engine is None:
+            self._async_engine = create_async_db_engine()
+        connection = await self._async_engine.connect()
+        try:
+            for stripe in stripes:
+                await connection.execute(ADVISORY_LOCK, self._advisory_parameters(stripe))
+        except BaseException:
+            await self._release_advisory_locks(connection)
+            raise
+        return connection
+
+    @staticmethod
+    async def _release_advisory_locks(connection) -> None:
+        try:
+            await connection.execute(ADVISORY_UNLOCK_ALL)
+        except BaseException:
+            # Ending the database session releases its locks
+            await connection.invalidate()
+            raise
+        finally:
+            await connection.close()
+
+    @asynccontextmanager
+    async def hold(self, *keys: str) -> AsyncIterator[None]:
+        """Hold the locks of one or more content hashes."""
+        # Stripes are locked in sorted order so two batches cannot deadlock
+        stripes = sorted({self._stripe(key) for key in keys})
+        locks = []
+        for stripe in stripes:
+            self._users[stripe] = self._users.get(stripe, 0) + 1
+            locks.append(self._locks.setdefault(stripe, asyncio.Lock()))
+        acquired = []
+        fds = []
+        connection = None
+        try:
+            with stage("lock_wait"):
+                for stripe, lock in zip(stripes, locks):
+                    await lock.acquire()
+                    acquired.append(lock)
+                    if not self.advisory:
+                        fd = await self._acquire_file_lock(self._stripe_path(stripe))
+                        if fd is not None:
+                            fds.append(fd)
+                if self.advisory:
+                    connection = await self._acquire_advisory_locks(stripes)
+            yield
+        finally:
+            try:
+                if connection is not None:
+                    await self._release_advisory_locks(connection)
+            finally:
+                self._release_file_locks(fds)
+                for lock in acquired:
+                    lock.release()
+                for stripe in stripes:
+                    self._users[stripe] -= 1
+                    if not self._users[stripe]:
+                        del self._users[stripe]
+                        del self._locks[stripe]
+
+    @contextmanager
+    def hold_blocking(self, *keys: str) -> Iterator[None]:
+        """Hold the cross-process locks from synchronous code such as maintenance jobs."""
+        if not self.advisory:
+            fds = self._acquire_file_locks(sorted(set(keys)))
+            try:
+                yield
+            finally:
+                self._release_file_locks(fds)
+            return
+
+        if self._engine is None:
+            self._engine = create_db_engine()
+        connection = self._engine.connect()
+        try:
+            for stripe in sorted({self._stripe(key) for key in keys}):
+                connection.execute(ADVISORY_LOCK, self._advisory_parameters(stripe))
+            yield
+        finally:
+            try:
+                connection.execute(ADVISORY_UNLOCK_ALL)
+            except BaseException:
+                connection.invalidate()
+                raise
+            finally:
+                connection.close()
+
+
+single_flight = SingleFlight(
+    os.path.join(blob_store.root, "locks"),
+    advisory=make_url(settings.DATABASE_URL).get_backend_name() == "postgresql"
+)
@@ -0,0 +1,334 @@
+"""Backends keeping the blobs of the content store.
+
+A backend stores blobs under the keys of :class:`~.blob_store.BlobStore`
+(``ab/cd/abcd...``) and exposes an async interface: ``put`` a local file,
+``get_stream`` a byte range, ``stat``, ``exists``, ``delete`` and ``list``.
+``local`` keeps them in a directory of this host; ``s3`` keeps them in an
+S3-compatible bucket shared by every API node, through ``aiobotocore`` (an
+optional dependency) with a pool of connections per event loop. Files
+larger than the multipart threshold are uploaded in parts.
+
+Temporary files, resumable uploads, lock files and caches stay on the
+local disk whatever the backend.
+"""
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Dict, Iterator, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from ..config import settings
+from ..responses import iter_file_range
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+    from botocore.exceptions import ClientError
+except ImportError:
+    get_session = None
+
+CHUNK_SIZE = 1024 * 1024
+# Error codes of a missing object (HEAD requests only get the status code)
+NOT_FOUND_CODES = {"404", "NoSuchKey", "NotFound"}
+
+
+class BlobStat(NamedTuple):
+    size: int
+    mtime: float
+
+
+class StorageBackend(ABC):
+    """Interface of the backends. Missing blobs raise FileNotFoundError when read."""
+
+    @abstractmethod
+    async def put(self, src_path: str, key: str) -> None:
+        """Move a fully written local file to a key, replacing any blob there."""
+
+    @abstractmethod
+    def get_stream(self, key: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield ``length`` bytes of a blob (up to its end when None) starting at ``start``."""
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[BlobStat]:
+        """Size and modification time of a blob, or None when it does not exist."""
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Delete a blob, returning whether it existed."""
+
+    @abstractmethod
+    def list(self) -> AsyncIterator[Tuple[str, float]]:
+        """Yield the key and modification time of every blob."""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of a blob on this host, when the backend keeps it in a local file."""
+        return None
+
+    async def close(self) -> None:
+        """Release the connections of the backend."""
+
+
+class LocalStorage(StorageBackend):
+    """Blobs in files under a local directory.
+
+    The blocking methods are plain file operations, which the blob store
+    calls directly from synchronous code; the async interface runs them in
+    the thread pool. Absolute keys (the former per-document layout) are
+    paths as is.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def local_path(self, key: str) -> str:
+        if os.path.isabs(key):
+            return key
+        return os.path.join(self.root, *key.split("/"))
+
+    def put_file(self, src_path: str, key: str) -> None:
+        """Atomically move a fully written file into the directory."""
+        path = self.local_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        os.replace(src_path, path)
+        self._fsync_directory(directory)
+
+    def stat_file(self, key: str) -> Optional[BlobStat]:
+        try:
+            stat = os.stat(self.local_path(key))
+        except FileNotFoundError:
+            return None
+        return BlobStat(stat.st_size, stat.st_mtime)
+
+    def delete_file(self, key: str) -> bool:
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def iter_range(self, key: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        path = self.local_path(key)
+        if length is None:
+            length = os.path.getsize(path) - start
+        return iter_file_range(path, start, length)
+
+    def iter_files(self) -> Iterator[Tuple[str, float]]:
+        if not os.path.isdir(self.root):
+            return
+        for first in os.scandir(self.root):
+            # Only the two-character hash prefix directories hold blobs
+            if not first.is_dir() or len(first.name) != 2:
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir():
+                    continue
+                for entry in os.scandir(second.path):
+                    if entry.is_file() and not entry.name.endswith(".part"):
+                        yield f"{first.name}/{second.name}/{entry.name}", entry.stat().st_mtime
+
+    async def put(self, src_path: str, key: str) -> None:
+        await run_in_threadpool(self.put_file, src_path, key)
+
+    async def get_stream(self, key: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        chunks = await run_in_threadpool(self.iter_range, key, start, length)
+        async for chunk in iterate_in_threadpool(chunks):
+            yield chunk
+
+    async def stat(self, key: str) -> Optional[BlobStat]:
+        return await run_in_threadpool(self.stat_file, key)
+
+    async def delete(self, key: str) -> bool:
+        return await run_in_threadpool(self.delete_file, key)
+
+    async def list(self) -> AsyncIterator[Tuple[str, float]]:
+        async for entry in iterate_in_threadpool(self.iter_files()):
+            yield entry
+
+    @staticmethod
+    def _fsync_directory(directory: str) -> None:
+        """Persist a rename in a directory (a no-op where directories cannot be opened)."""
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+class S3Storage(StorageBackend):
+    """Blobs in an S3-compatible bucket (AWS S3, MinIO, Ceph...), under a key prefix.
+
+    A client, and its connection pool of ``max_connections``, is opened per
+    event loop on first use and shared by the requests of that loop, until
+    ``close`` is awaited in that loop. The clients of loops closed without
+    it are dropped when a client is opened for another loop.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, access_key_id: Optional[str] = None,
+                 secret_access_key: Optional[str] = None, max_connections: int = 32,
+                 multipart_threshold: int = 16 * 1024 * 1024, multipart_chunk_size: int = 8 * 1024 * 1024):
+        if get_session is None:
+            raise ValueError("The s3 storage backend needs the aiobotocore package")
+        if not bucket:
+            raise ValueError("The s3 storage backend needs S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client_options = {
+            "endpoint_url": endpoint_url,
+            "region_name": region,
+            "aws_access_key_id": access_key_id,
+            "aws_secret_access_key": secret_access_key,
+            "config": AioConfig(max_pool_connections=max_connections),
+        }
+        # S3 parts are at least 5 MiB, except the last one
+        self.multipart_threshold = max(multipart_threshold, 5 * 1024 * 1024)
+        self.multipart_chunk_size = max(multipart_chunk_size, 5 * 1024 * 1024)
+        # Task opening the client of each event loop, and the exit stack closing it
+        self._clients: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+        self._exit_stacks: Dict[asyncio.AbstractEventLoop, AsyncExitStack] = {}
+
+    def object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    async def _client(self):
+        loop = asyncio.get_running_loop()
+        task = self._clients.get(loop)
+        if task is None or task.done() and (task.cancelled() or task.exception() is not None):
+            for closed in [other for other in self._clients if other.is_closed()]:
+                del self._clients[closed]
+                self._exit_stacks.pop(closed, None)
+            task = self._clients[loop] = loop.create_task(self._open_client(loop))
+        return await asyncio.shield(task)
+
+    async def _open_client(self, loop: asyncio.AbstractEventLoop):
+        exit_stack = AsyncExitStack()
+        client = await exit_stack.enter_async_context(
+            get_session().create_client("s3", **self.client_options)
+        )
+        self._exit_stacks[loop] = exit_stack
+        return client
+
+    async def close(self) -> None:
+        """Close the client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        task = self._clients.pop(loop, None)
+        if task is None:
+            return
+        try:
+            await task
+        except Exception:
+            pass
+        exit_stack = self._exit_stacks.pop(loop, None)
+        if exit_stack is not None:
+            await exit_stack.aclose()
+
+    @staticmethod
+    def _not_found(exc: "ClientError") -> bool:
+        return str(exc.response.get("Error", {}).get("Code")) in NOT_FOUND_CODES
+
+    async def put(self, src_path: str, key: str) -> None:
+        # The file is read in the default executor rather than the request
+        # thread pool, whose threads may all be waiting for uploads like this one
+        client = await self._client()
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(src_path)
+        with open(src_path, "rb") as f:
+            if size < self.multipart_threshold:
+                body = await loop.run_in_executor(None, f.read)
+                await client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=body)
+            else:
+                await self._put_multipart(client, f, key)
+        os.remove(src_path)
+
+    async def _put_multipart(self, client, f, key: str) -> None:
+        upload = await client.create_multipart_upload(Bucket=self.bucket, Key=self.object_key(key))
+        upload_id = upload["UploadId"]
+        parts = []
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                body = await loop.run_in_executor(None, f.read, self.multipart_chunk_size)
+                if not body:
+                    break
+                number = len(parts) + 1
+                part = await client.upload_part(
+                    Bucket=self.bucket, Key=self.object_key(key), UploadId=upload_id, PartNumber=number, Body=body
+                )
+                parts.append({"PartNumber": number, "ETag": part["ETag"]})
+            await client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.object_key(key), UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            await client.abort_multipart_upload(Bucket=self.bucket, Key=self.object_key(key), UploadId=upload_id)
+            raise
+
+    async def get_stream(self, key: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        if length is not None and length <= 0:
+            return
+        client = await self._client()
+        options = {}
+        if start or length is not None:
+            end = "" if length is None else start + length - 1
+            options["Range"] = f"bytes={start}-{end}"
+        try:
+            response = await client.get_object(Bucket=self.bucket, Key=self.object_key(key), **options)
+        except ClientError as exc:
+            if self._not_found(exc):
+                raise FileNotFoundError(key) from exc
+            raise
+        async with response["Body"] as body:
+            while True:
+                chunk = await body.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def stat(self, key: str) -> Optional[BlobStat]:
+        client = await self._client()
+        try:
+            response = await client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as exc:
+            if self._not_found(exc):
+                return None
+            raise
+        return BlobStat(response["ContentLength"], response["LastModified"].timestamp())
+
+    async def delete(self, key: str) -> bool:
+        # Deleting a missing object succeeds, so it is looked up first
+        if await self.stat(key) is None:
+            return False
+        client = await self._client()
+        await client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        return True
+
+    async def list(self) -> AsyncIterator[Tuple[str, float]]:
+        client = await self._client()
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix):], item["LastModified"].timestamp()
+
+
+def create_backend(root: str) -> StorageBackend:
+    """The backend of ``STORAGE_BACKEND``, with ``root`` as the directory of the local one."""
+    if settings.STORAGE_BACKEND == "local":
+        return LocalStorage(root)
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage(
+            settings.S3_BUCKET, settings.S3_PREFIX, settings.S3_ENDPOINT_URL, settings.S3_REGION,
+            settings.S3_ACCESS_KEY_ID, settings.S3_SECRET_ACCESS_KEY, settings.S3_MAX_CONNECTIONS,
+            settings.S3_MULTIPART_THRESHOLD, settings.S3_MULTIPART_CHUNK_SIZE
+        )
+    raise ValueError(f"Unknown storage backend: {settings.STORAGE_BACKEND}")
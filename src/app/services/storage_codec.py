@@ -0,0 +1,96 @@
+"""Codecs compressing the blobs of the content store.
+
+The SHA256 hash of a content is always the hash of its original bytes, so
+compression is invisible to deduplication, ETags and the caches keyed by
+hash. zlib is always available; zstd needs the optional ``zstandard``
+package.
+"""
+import zlib
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Codec(NamedTuple):
+    name: str
+    # Appended to the storage key of the blobs it compresses
+    suffix: str
+    default_level: int
+    # Streaming compressor of a level and decompressor, both with compress or
+    # decompress(data) -> bytes and flush() -> bytes
+    compressobj: Callable[[int], object]
+    decompressobj: Callable[[], object]
+
+
+CODECS = {
+    "zlib": Codec("zlib", ".zz", 6, zlib.compressobj, zlib.decompressobj),
+}
+if zstandard is not None:
+    CODECS["zstd"] = Codec(
+        "zstd", ".zst", 3,
+        lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+        lambda: zstandard.ZstdDecompressor().decompressobj(),
+    )
+
+
+def get_codec(name: str) -> Codec:
+    """The codec of a name, raising ValueError when it is unknown or not installed."""
+    codec = CODECS.get(name)
+    if codec is None:
+        if name == "zstd":
+            raise ValueError("The zstd storage codec needs the zstandard package")
+        raise ValueError(f"Unknown storage codec: {name}")
+    return codec
+
+
+def compress(src: BinaryIO, dst: BinaryIO, name: str, level: int = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Compress a file object into another one, returning the compressed size."""
+    codec = get_codec(name)
+    compressor = codec.compressobj(codec.default_level if level is None else level)
+    written = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        data = compressor.compress(chunk)
+        dst.write(data)
+        written += len(data)
+    data = compressor.flush()
+    dst.write(data)
+    return written + len(data)
+
+
+def decompress_chunks(chunks: Iterable[bytes], name: str) -> Iterator[bytes]:
+    """Yield the original bytes of a compressed stream given as chunks."""
+    decompressor = get_codec(name).decompressobj()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def slice_chunks(chunks: Iterable[bytes], start: int, length: int) -> Iterator[bytes]:
+    """Yield ``length`` bytes of a stream given as chunks, starting at ``start``.
+
+    The bytes before ``start`` are read and dropped.
+    """
+    position = 0
+    remaining = length
+    for data in chunks:
+        if remaining <= 0:
+            break
+        end = position + len(data)
+        if end > start:
+            data = data[max(0, start - position):][:remaining]
+            remaining -= len(data)
+            yield data
+        position = end
+
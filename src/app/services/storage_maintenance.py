@@ -0,0 +1,337 @@
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, func, or_, select, text, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import ContentPage, Document, DocumentStats, FileContent, IntegrityFinding, UploadSession
+from . import document_stats, near_duplicates, processing, text_index
+from .blob_store import blob_store
+from .rendition_cache import rendition_cache
+from .single_flight import single_flight
+from .upload_sessions import SESSION_DIR, session_path
+
+BATCH_SIZE = 500
+
+
+def _iter_file_contents(db: Session) -> Iterator[Tuple[str, str]]:
+    """Yield (sha256, file_path) of every FileContent in hash order, one batch at a time."""
+    last_sha256 = ""
+    while True:
+        rows = db.execute(
+            select(FileContent.sha256, FileContent.file_path)
+            .where(FileContent.sha256 > last_sha256)
+            .order_by(FileContent.sha256)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        yield from rows
+        last_sha256 = rows[-1].sha256
+
+
+def migrate_legacy_layout(db: Session) -> Dict[str, int]:
+    """Move originals stored as ``UPLOAD_DIR/<uuid>/original`` into the blob store."""
+    stats = {"migrated": 0, "missing": 0}
+    for sha256, file_path in list(_iter_file_contents(db)):
+        if not os.path.isabs(file_path):
+            continue
+        if not os.path.exists(file_path):
+            stats["missing"] += 1
+            continue
+
+        key = blob_store.key_for(sha256)
+        if blob_store.exists(key):
+            os.remove(file_path)
+        else:
+            try:
+                blob_store.put_file(file_path, key)
+            except OSError:
+                # The blob store is on another filesystem, copy then rename
+                fd, tmp_path = blob_store.spool_file()
+                os.close(fd)
+                shutil.copyfile(file_path, tmp_path)
+                blob_store.put_file(tmp_path, key)
+                os.remove(file_path)
+
+        db.execute(update(FileContent).where(FileContent.sha256 == sha256).values(file_path=key))
+        db.commit()
+        try:
+            os.rmdir(os.path.dirname(file_path))
+        except OSError:
+            pass
+        stats["migrated"] += 1
+    return stats
+
+
+def collect_garbage(
+    db: Session, grace_seconds: int = None, dry_run: bool = False
+) -> Dict[str, int]:
+    """Remove unreferenced content, orphaned blobs, stale temporary files and expired uploads.
+
+    Blobs and temporary files modified within the grace period are kept, as
+    they may belong to uploads that are not committed yet.
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.GC_GRACE_SECONDS
+    cutoff = time.time() - grace_seconds
+    stats = {"unreferenced": 0, "orphaned": 0, "spooled": 0, "expired_uploads": 0}
+
+    # Content whose reference count dropped to zero
+    unreferenced = db.execute(
+        select(FileContent.sha256, FileContent.file_path).where(FileContent.reference_count <= 0)
+    ).all()
+    for sha256, key in unreferenced:
+        if not dry_run:
+            # Uploads of the same content hold this lock while they reference it
+            with single_flight.hold_blocking(sha256):
+                unused = (
+                    FileContent.sha256 == sha256,
+                    FileContent.reference_count <= 0,
+                    ~exists().where(Document.sha256 == sha256),
+                )
+                db.rollback()
+                if db.execute(select(FileContent.sha256).where(*unused)).first() is None:
+                    continue
+                # The rows referencing the content go first, for databases enforcing foreign keys
+                db.execute(delete(ContentPage).where(ContentPage.sha256 == sha256))
+                db.execute(delete(IntegrityFinding).where(IntegrityFinding.sha256 == sha256))
+                for statement in near_duplicates.delete_statements(sha256):
+                    db.execute(statement)
+                if not db.execute(delete(FileContent).where(*unused)).rowcount:
+                    db.rollback()
+                    continue
+                db.commit()
+                blob_store.delete(key)
+            rendition_cache.discard(sha256)
+        stats["unreferenced"] += 1
+
+    # Blobs without a FileContent row
+    batch: List[Tuple[str, float]] = []
+    for key, mtime in blob_store.iter_keys():
+        if mtime < cutoff:
+            batch.append((key, mtime))
+        if len(batch) >= BATCH_SIZE:
+            stats["orphaned"] += _delete_orphans(db, batch, dry_run)
+            batch = []
+    if batch:
+        stats["orphaned"] += _delete_orphans(db, batch, dry_run)
+
+    # Temporary files left behind by interrupted uploads
+    for path, mtime in blob_store.iter_spooled():
+        if mtime < cutoff:
+            if not dry_run:
+                blob_store.delete(path)
+            stats["spooled"] += 1
+
+    # Resumable uploads abandoned, or finalized, past their expiry
+    now = datetime.now()
+    expired = db.execute(select(UploadSession.id).where(UploadSession.expires_at < now)).scalars().all()
+    for upload_id in expired:
+        if not dry_run:
+            # A chunk received since the query postponed the expiry
+            deleted = db.execute(
+                delete(UploadSession).where(UploadSession.id == upload_id, UploadSession.expires_at < now)
+            ).rowcount
+            db.commit()
+            if not deleted:
+                continue
+            blob_store.delete(session_path(upload_id))
+        stats["expired_uploads"] += 1
+    # Files of sessions whose creation was interrupted
+    if os.path.isdir(SESSION_DIR):
+        for entry in os.scandir(SESSION_DIR):
+            upload_id = entry.name[:-len(".part")]
+            if entry.stat().st_mtime < cutoff and db.get(UploadSession, upload_id) is None:
+                if not dry_run:
+                    blob_store.delete(entry.path)
+                stats["expired_uploads"] += 1
+    return stats
+
+
+def _iter_unprocessed(db: Session, processed_at, stats: Dict[str, int]) -> Iterator[Tuple[str, str, Optional[str], str]]:
+    """Yield (sha256, key, codec, filename) of the content whose ``processed_at`` column is not set.
+
+    The filename only tells PDFs from images apart. Content whose blob is
+    missing is counted in ``stats`` and skipped.
+    """
+    last_sha256 = ""
+    while True:
+        rows = db.execute(
+            select(FileContent.sha256, FileContent.file_path, FileContent.codec, FileContent.mime_type)
+            .where(processed_at.is_(None), FileContent.sha256 > last_sha256)
+            .order_by(FileContent.sha256)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        last_sha256 = rows[-1].sha256
+        for sha256, key, codec, mime_type in rows:
+            if not blob_store.exists(key):
+                stats["missing"] += 1
+                continue
+            if mime_type:
+                filename = "content.jpg" if mime_type.startswith("image/") else "content.pdf"
+            else:
+                filename = db.execute(
+                    select(Document.filename).where(Document.sha256 == sha256).limit(1)
+                ).scalar() or "content.pdf"
+            yield sha256, key, codec, filename
+
+
+def index_missing_text(db: Session) -> Dict[str, int]:
+    """Extract the text layer of content stored before it was indexed."""
+    stats = {"indexed": 0, "missing": 0, "failed": 0}
+    for sha256, key, codec, filename in _iter_unprocessed(db, FileContent.text_indexed_at, stats):
+        try:
+            with blob_store.original_path(key, codec) as path:
+                pages = processing.extract_text(path, filename)
+        except Exception:
+            stats["failed"] += 1
+            continue
+        with single_flight.hold_blocking(sha256):
+            for statement, parameters in text_index.replace_pages_statements(sha256, pages):
+                db.execute(statement, parameters)
+            db.commit()
+        stats["indexed"] += 1
+    return stats
+
+
+def index_missing_page_hashes(db: Session) -> Dict[str, int]:
+    """Hash the pages of content stored before near-duplicates were detected."""
+    stats = {"hashed": 0, "near_duplicates": 0, "missing": 0, "failed": 0}
+    for sha256, key, codec, filename in _iter_unprocessed(db, FileContent.page_hashes_at, stats):
+        try:
+            with blob_store.original_path(key, codec) as path:
+                hashes = processing.page_hashes(path, filename)
+        except Exception:
+            stats["failed"] += 1
+            continue
+        candidates = []
+        for statement in near_duplicates.candidate_statements(sha256, hashes):
+            candidates.extend(db.execute(statement).all())
+        page_counts = dict(db.execute(
+            near_duplicates.page_count_statement({candidate_sha256 for candidate_sha256, _ in candidates})
+        ).all())
+        similar = near_duplicates.similarities(hashes, candidates, page_counts)
+        # The rows of a pair are written holding the locks of both contents
+        keys = {sha256, *similar}
+        while True:
+            with single_flight.hold_blocking(*keys):
+                db.rollback()
+                partners = set(db.scalars(near_duplicates.partners_statement(sha256)))
+                if partners <= keys:
+                    existing = set(db.scalars(select(FileContent.sha256).where(FileContent.sha256.in_(list(keys)))))
+                    if sha256 in existing:
+                        similar = {other: value for other, value in similar.items() if other in existing}
+                        for statement, parameters in near_duplicates.replace_statements(sha256, hashes, similar):
+                            db.execute(statement, parameters)
+                        db.commit()
+                    break
+            keys |= partners
+        if sha256 not in existing:
+            continue
+        stats["hashed"] += 1
+        stats["near_duplicates"] += len(similar)
+    return stats
+
+
+def compress_stored_content(db: Session, codec: Optional[str] = None) -> Dict[str, int]:
+    """Store existing content with a codec (the configured one by default), like new uploads.
+
+    Blobs that would not shrink enough are left as they are. The blobs
+    replaced by their compressed copy are removed by the next garbage
+    collection, so downloads already under way are not cut short.
+    """
+    codec = codec or blob_store.codec
+    if not codec:
+        raise ValueError("No storage codec is configured")
+    stats = {"compressed": 0, "skipped": 0, "missing": 0, "saved_bytes": 0}
+    last_sha256 = ""
+    while True:
+        rows = db.execute(
+            select(FileContent.sha256, FileContent.file_path, FileContent.codec)
+            .where(
+                FileContent.sha256 > last_sha256,
+                or_(FileContent.codec.is_(None), FileContent.codec != codec)
+            )
+            .order_by(FileContent.sha256)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return stats
+        last_sha256 = rows[-1].sha256
+        for sha256, key, current_codec in rows:
+            # Originals of the former layout are moved by migrate-storage first
+            if os.path.isabs(key) or not blob_store.exists(key):
+                stats["missing"] += 1
+                continue
+            stored_size = blob_store.size(key)
+            with blob_store.original_path(key, current_codec) as path:
+                size = os.path.getsize(path)
+                compressed_path = blob_store.compressed_copy(path, size, codec)
+            if compressed_path is None:
+                stats["skipped"] += 1
+                continue
+            new_key = blob_store.key_for(sha256, codec)
+            with single_flight.hold_blocking(sha256):
+                # The content may have been collected since the batch was read
+                db.rollback()
+                file_content = db.get(FileContent, sha256)
+                if file_content is None or file_content.file_path != key:
+                    os.remove(compressed_path)
+                    continue
+                stats["saved_bytes"] += stored_size - os.path.getsize(compressed_path)
+                blob_store.put_file(compressed_path, new_key)
+                file_content.file_path = new_key
+                file_content.codec = codec
+                if file_content.size is None:
+                    file_content.size = size
+                db.commit()
+            stats["compressed"] += 1
+
+
+def rebuild_document_stats(db: Session) -> Dict[str, int]:
+    """Recompute the document statistics from the documents, in one transaction.
+
+    Writes updating the statistics wait for the rebuild, and the ones
+    committed before it are counted by it.
+    """
+    if db.bind.dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE document_stats, document_stats_contents IN EXCLUSIVE MODE"))
+    for statement in document_stats.rebuild_statements():
+        db.execute(statement)
+    db.commit()
+    rows = db.execute(
+        select(DocumentStats.dimension, func.count()).group_by(DocumentStats.dimension)
+    ).all()
+    return {"groups": sum(count for _, count in rows), **{dimension: count for dimension, count in rows}}
+
+
+def _delete_orphans(db: Session, batch: List[Tuple[str, float]], dry_run: bool) -> int:
+    """Delete the blobs no FileContent points to.
+
+    Besides blobs of unknown content, this includes blobs whose content was
+    stored again with another codec.
+    """
+    keys = {key: blob_store.hash_of(key) for key, _ in batch}
+    known = dict(db.execute(
+        select(FileContent.sha256, FileContent.file_path).where(FileContent.sha256.in_(set(keys.values())))
+    ).all())
+    orphans = [(sha256, key) for key, sha256 in keys.items() if known.get(sha256) != key]
+    if dry_run:
+        return len(orphans)
+
+    deleted = 0
+    for sha256, key in orphans:
+        with single_flight.hold_blocking(sha256):
+            # An upload may have committed the content since the batch was read
+            db.rollback()
+            file_content = db.get(FileContent, sha256)
+            if (file_content is None or file_content.file_path != key) and blob_store.delete(key):
+                deleted += 1
+    return deleted
@@ -0,0 +1,211 @@
+"""Full-text index over the ``content_pages`` table.
+
+SQLite indexes the pages with an FTS5 table kept in sync by triggers,
+PostgreSQL with a generated ``tsvector`` column and a GIN index. Both rank
+the newest ``TEXT_SEARCH_SCAN_LIMIT`` matching pages (of the filtered
+documents, if any), keep the best ``TEXT_SEARCH_CANDIDATES`` and join them
+to the documents sharing their content, so a term found on most pages
+costs a bounded amount of ranking.
+"""
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import TextClause, delete, insert, text, update
+from sqlalchemy.engine import Engine
+
+from ..config import settings
+from ..models import ContentPage, FileContent
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# HS codes, invoice and reference numbers are kept as single tokens; the
+# prefix indexes serve short prefix searches such as "84*"
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS content_pages_fts USING fts5(
+        body, content='content_pages', content_rowid='id', prefix='2 3',
+        tokenize = "unicode61 remove_diacritics 2 tokenchars '.-/'"
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS content_pages_ai AFTER INSERT ON content_pages BEGIN
+        INSERT INTO content_pages_fts (rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS content_pages_ad AFTER DELETE ON content_pages BEGIN
+        INSERT INTO content_pages_fts (content_pages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS content_pages_au AFTER UPDATE ON content_pages BEGIN
+        INSERT INTO content_pages_fts (content_pages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO content_pages_fts (rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+
+POSTGRESQL_DDL = [
+    """ALTER TABLE content_pages ADD COLUMN IF NOT EXISTS tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_content_pages_tsv ON content_pages USING GIN (tsv)",
+]
+
+_TERM_RE = re.compile(r'[^\s"]+')
+
+
+def create_text_index(bind: Engine) -> None:
+    """Create the full-text index of ``content_pages`` if it does not exist."""
+    statements = {"sqlite": SQLITE_DDL, "postgresql": POSTGRESQL_DDL}.get(bind.dialect.name, [])
+    with bind.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+
+def fts5_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching every term.
+
+    Terms are quoted so punctuation is not read as query syntax; a trailing
+    ``*`` keeps its meaning of a prefix search.
+    """
+    terms = []
+    for term in _TERM_RE.findall(query):
+        prefix = term.endswith("*") and len(term) > 1
+        term = term.rstrip("*")
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search_statement(dialect_name: str, bsc_number: Optional[str], category: Optional[str]) -> TextClause:
+    """Ranked pages matching ``:query``, joined to their documents, best first.
+
+    With a BSC number or category, only pages of content with a matching
+    document are scanned and ranked, so the bounds apply to the filtered pages.
+    """
+    filters = ""
+    if bsc_number:
+        filters += " AND d.bsc_number = :bsc_number"
+    if category:
+        filters += " AND d.category = :category"
+    # Restricts the pages of the bounded scan and ranking (given their id and content hash)
+    fts_filter = pages_filter = ""
+    if filters:
+        fts_filter = f"""
+                  AND EXISTS (
+                      SELECT 1 FROM content_pages p JOIN documents d ON d.sha256 = p.sha256
+                      WHERE p.id = content_pages_fts.rowid{filters}
+                  )"""
+        pages_filter = f"""
+              AND EXISTS (SELECT 1 FROM documents d WHERE d.sha256 = p.sha256{filters})"""
+
+    if dialect_name == "sqlite":
+        # Snippets are only built for the returned page of results
+        return text(f"""
+            WITH hits AS (
+                SELECT rowid AS id, rank
+                FROM content_pages_fts
+                WHERE content_pages_fts MATCH :query{fts_filter}
+                  AND rowid >= coalesce((
+                      SELECT min(rowid) FROM (
+                          SELECT rowid FROM content_pages_fts
+                          WHERE content_pages_fts MATCH :query{fts_filter}
+                          ORDER BY rowid DESC
+                          LIMIT :scan
+                      )
+                  ), 0)
+                ORDER BY rank
+                LIMIT :candidates
+            ),
+            results AS (
+                SELECT d.uuid, d.bsc_number, d.category, d.filename, p.page, hits.id, hits.rank
+                FROM hits
+                JOIN content_pages p ON p.id = hits.id
+                JOIN documents d ON d.sha256 = p.sha256
+                WHERE 1 = 1{filters}
+                ORDER BY hits.rank, d.uuid, p.page
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT r.uuid, r.bsc_number, r.category, r.filename, r.page,
+                   snippet(content_pages_fts, 0, :start, :end, '…', :snippet_words) AS snippet,
+                   -r.rank AS score
+            FROM results r
+            JOIN content_pages_fts ON content_pages_fts.rowid = r.id
+            WHERE content_pages_fts MATCH :query
+            ORDER BY r.rank, r.uuid, r.page
+        """)
+    return text(f"""
+        WITH q AS (SELECT websearch_to_tsquery('simple', :query) AS query),
+        recent AS (
+            SELECT p.id
+            FROM content_pages p, q
+            WHERE p.tsv @@ q.query{pages_filter}
+            ORDER BY p.id DESC
+            LIMIT :scan
+        ),
+        hits AS (
+            SELECT p.id, ts_rank_cd(p.tsv, q.query) AS score
+            FROM recent
+            JOIN content_pages p ON p.id = recent.id
+            CROSS JOIN q
+            ORDER BY score DESC
+            LIMIT :candidates
+        ),
+        results AS (
+            SELECT d.uuid, d.bsc_number, d.category, d.filename, p.page, p.id, hits.score
+            FROM hits
+            JOIN content_pages p ON p.id = hits.id
+            JOIN documents d ON d.sha256 = p.sha256
+            WHERE 1 = 1{filters}
+            ORDER BY hits.score DESC, d.uuid, p.page
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT r.uuid, r.bsc_number, r.category, r.filename, r.page,
+               ts_headline('simple', p.body, q.query, :headline_options) AS snippet,
+               r.score
+        FROM results r
+        JOIN content_pages p ON p.id = r.id
+        CROSS JOIN q
+        ORDER BY r.score DESC, r.uuid, r.page
+    """)
+
+
+def search_parameters(
+    dialect_name: str, query: str, bsc_number: Optional[str], category: Optional[str], limit: int, offset: int
+) -> Dict[str, object]:
+    """Bound parameters of ``search_statement``."""
+    if dialect_name == "sqlite":
+        query = fts5_query(query)
+    if not query.strip():
+        raise HTTPException(status_code=400, detail="Empty query")
+    return {
+        "query": query,
+        "bsc_number": bsc_number,
+        "category": category,
+        "limit": limit,
+        "offset": offset,
+        "candidates": settings.TEXT_SEARCH_CANDIDATES,
+        "scan": settings.TEXT_SEARCH_SCAN_LIMIT,
+        "start": HIGHLIGHT_START,
+        "end": HIGHLIGHT_END,
+        "snippet_words": settings.TEXT_SEARCH_SNIPPET_WORDS,
+        "headline_options": (
+            f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_END}", '
+            f"MaxWords={settings.TEXT_SEARCH_SNIPPET_WORDS}, MinWords=5, MaxFragments=1"
+        ),
+    }
+
+
+def replace_pages_statements(sha256: str, pages: List[str]) -> list:
+    """Statements (with their parameters) replacing the indexed pages of a content.
+
+    Blank pages are not indexed, and the content is marked as indexed even
+    when it has no text so it is not extracted again.
+    """
+    statements = [(delete(ContentPage).where(ContentPage.sha256 == sha256), None)]
+    rows = [
+        {"sha256": sha256, "page": number, "body": body}
+        for number, body in enumerate(pages, start=1) if body.strip()
+    ]
+    if rows:
+        statements.append((insert(ContentPage), rows))
+    statements.append((
+        update(FileContent).where(FileContent.sha256 == sha256).values(text_indexed_at=datetime.now()),
+        None
+    ))
+    return statements
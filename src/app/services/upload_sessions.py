@@ -0,0 +1,447 @@
+"""Resumable uploads, in the style of the tus protocol.
+
+A session is created with the size of the file; chunks are then sent in
+any order or in parallel, each with the offset it starts at, and written in
+place in a file next to the blobs. The bytes received are recorded with the
+session, so a client can ask for its progress after losing its connection
+and send only what is missing. Finalizing the session creates the document
+through ``DocumentService`` like a single-shot upload.
+
+Chunks are hashed as they arrive while they extend the received bytes from
+the start of the file. A chunk cannot start in, or run into, bytes already
+recorded; chunks written at the same time that overlap each other are found
+when their ranges are recorded, and the file is then hashed again when it is
+finalized. Requests writing chunks hold a shared ``flock`` on the file and
+finalizing takes it exclusively, so no chunk is written once it is hashed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from ..config import settings
+from ..metrics import record_stage, stage
+from ..models import Document, UploadSession
+from ..schemas import DocumentResponse, UploadSessionStatus
+from .blob_store import blob_store
+from .document_service import DocumentService, SpooledUpload
+
+# Next to the blobs so a finalized file is renamed into the store
+SESSION_DIR = os.path.join(blob_store.root, "sessions")
+
+Ranges = List[List[int]]
+
+
+class RunningHash:
+    """Hash of the first ``offset`` bytes of an upload."""
+
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        self.updated_at = time.monotonic()
+
+
+# Running hash of each upload whose start was received by this process, so
+# uploads sent in order are not read again on finalize
+_running_hashes: Dict[str, RunningHash] = {}
+
+
+def _keep_running_hash(upload_id: str, running: RunningHash) -> None:
+    """Keep the running hash of an upload, dropping the ones of uploads abandoned past their expiry."""
+    now = time.monotonic()
+    running.updated_at = now
+    _running_hashes[upload_id] = running
+    for other in [key for key, value in _running_hashes.items()
+                  if now - value.updated_at > settings.UPLOAD_SESSION_TTL_SECONDS]:
+        del _running_hashes[other]
+
+
+def session_path(upload_id: str) -> str:
+    """Path of the file assembling the chunks of an upload."""
+    return os.path.join(SESSION_DIR, f"{upload_id}.part")
+
+
+def merge_range(ranges: Ranges, start: int, end: int) -> Ranges:
+    """Add the [start, end) range to sorted, disjoint ranges, merging the ones it touches."""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def contiguous_offset(ranges: Ranges) -> int:
+    """Number of bytes received from the start of the file without a gap."""
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+
+def overlaps(ranges: Ranges, start: int, end: int) -> bool:
+    """Whether the [start, end) range shares bytes with one of the ranges."""
+    return any(range_start < end and start < range_end for range_start, range_end in ranges)
+
+
+def write_limit(ranges: Ranges, offset: int, length: int) -> Optional[int]:
+    """End of the gap of the received bytes starting at ``offset``, or None when the offset was received."""
+    limit = length
+    for range_start, range_end in ranges:
+        if range_start <= offset < range_end:
+            return None
+        if offset < range_start:
+            limit = min(limit, range_start)
+    return limit
+
+
+def _write_at(f: BinaryIO, offset: int, chunk: bytes, running: Optional[RunningHash]) -> Tuple[float, float]:
+    """Write a chunk at an offset, then add it to the running hash when it extends it.
+
+    Returns the time spent hashing and writing.
+    """
+    started = time.perf_counter()
+    f.seek(offset)
+    f.write(chunk)
+    written = time.perf_counter()
+    if running is not None and running.offset == offset:
+        running.hasher.update(chunk)
+        running.offset += len(chunk)
+    return time.perf_counter() - written, written - started
+
+
+def _lock_file(f: BinaryIO, exclusive: bool) -> bool:
+    """Lock the file of an upload without waiting, telling whether the lock was free.
+
+    Requests writing chunks share the lock, finalizing takes it exclusively.
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _sync(f: BinaryIO) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _finish_hash(path: str, running: RunningHash, length: int) -> str:
+    """Add the bytes of a file past the running hash to it."""
+    with open(path, "rb") as f:
+        f.seek(running.offset)
+        while running.offset < length:
+            chunk = f.read(min(settings.UPLOAD_CHUNK_SIZE, length - running.offset))
+            if not chunk:
+                break
+            running.hasher.update(chunk)
+            running.offset += len(chunk)
+    return running.hasher.hexdigest()
+
+
+def _spool_link(path: str) -> str:
+    """Another name of the file of an upload among the spooled files, for the document service to consume.
+
+    The file of the upload is kept, so finalizing can be retried when the
+    document could not be created.
+    """
+    os.makedirs(blob_store.spool_dir, exist_ok=True)
+    link = os.path.join(blob_store.spool_dir, f"upload-{uuid.uuid4().hex}.part")
+    try:
+        os.link(path, link)
+    except OSError:
+        shutil.copyfile(path, link)
+    return link
+
+
+class UploadSessionService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    def status(self, session: UploadSession) -> UploadSessionStatus:
+        received = json.loads(session.received)
+        return UploadSessionStatus(
+            id=session.id,
+            bsc_number=session.bsc_number,
+            category=session.category,
+            filename=session.filename,
+            length=session.length,
+            offset=contiguous_offset(received),
+            received=received,
+            status=session.status,
+            expires_at=session.expires_at,
+            document_uuid=session.document_uuid
+        )
+
+    async def create_session(
+        self, bsc_number: str, category: str, filename: str, length: int
+    ) -> UploadSessionStatus:
+        """Start a resumable upload of a file of ``length`` bytes."""
+        DocumentService(self.db).validate_filename(filename)
+        if length > settings.UPLOAD_SESSION_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="File too large")
+
+        upload_id = uuid.uuid4().hex
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        # A sparse file of the final size, so chunks can be written in any order
+        with open(session_path(upload_id), "wb") as f:
+            f.truncate(length)
+        session = UploadSession(
+            id=upload_id,
+            bsc_number=bsc_number,
+            category=category,
+            filename=filename,
+            length=length,
+            received="[]",
+            status="open",
+            created_at=datetime.now(),
+            expires_at=datetime.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+        )
+        self.db.add(session)
+        try:
+            await self.db.commit()
+        except BaseException:
+            os.remove(session_path(upload_id))
+            raise
+        return self.status(session)
+
+    async def get_session(self, upload_id: str) -> UploadSession:
+        """Get an upload session that has not expired."""
+        session = await self.db.get(UploadSession, upload_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if session.expires_at < datetime.now():
+            raise HTTPException(status_code=410, detail="Upload expired")
+        return session
+
+    async def write_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> UploadSessionStatus:
+        """Write the bytes of a request body at an offset of the upload.
+
+        The bytes written before the connection dropped are kept and recorded,
+        so the client can resume from the offset reported by the session. A
+        chunk starting in received bytes, running into them, or sent while the
+        upload is finalized is rejected with 409. Chunks starting where the
+        running hash of this process stops extend it.
+        """
+        session = await self.get_session(upload_id)
+        if session.status != "open":
+            raise HTTPException(status_code=409, detail="Upload already finalized")
+        if not 0 <= offset <= session.length:
+            raise HTTPException(status_code=400, detail="Invalid offset")
+        length = session.length
+
+        try:
+            f = await run_in_threadpool(open, session_path(upload_id), "r+b")
+        except FileNotFoundError:
+            # Finalized in the meantime
+            raise HTTPException(status_code=409, detail="Upload already finalized")
+        try:
+            if not _lock_file(f, exclusive=False):
+                raise HTTPException(status_code=409, detail="Upload is being finalized")
+            # Read again now that the upload cannot be finalized until this request ends
+            session = await self.db.get(UploadSession, upload_id, populate_existing=True)
+            if session is None:
+                raise HTTPException(status_code=404, detail="Upload not found")
+            if session.status != "open":
+                raise HTTPException(status_code=409, detail="Upload already finalized")
+            received = json.loads(session.received)
+            limit = write_limit(received, offset, length)
+            if limit is None:
+                raise HTTPException(
+                    status_code=409, detail="Upload-Offset was already received",
+                    headers={"Upload-Offset": str(contiguous_offset(received))}
+                )
+            await self.db.rollback()
+        except BaseException:
+            f.close()
+            raise
+
+        running = _running_hashes.pop(upload_id, None)
+        if running is None and offset == 0:
+            running = RunningHash()
+
+        written = 0
+        hash_seconds = write_seconds = 0.0
+        buffer = bytearray()
+
+        async def flush_buffer():
+            nonlocal written, hash_seconds, write_seconds
+            hashed, wrote = await run_in_threadpool(_write_at, f, offset + written, bytes(buffer), running)
+            hash_seconds += hashed
+            write_seconds += wrote
+            written += len(buffer)
+            buffer.clear()
+
+        try:
+            try:
+                async for chunk in chunks:
+                    end = offset + written + len(buffer) + len(chunk)
+                    if end > length:
+                        raise HTTPException(status_code=400, detail="Chunk exceeds the upload length")
+                    if end > limit:
+                        raise HTTPException(status_code=409, detail="Chunk overlaps bytes already received")
+                    buffer += chunk
+                    if len(buffer) >= settings.UPLOAD_CHUNK_SIZE:
+                        await flush_buffer()
+            finally:
+                # Bytes received before an error are kept too
+                if buffer:
+                    await flush_buffer()
+                started = time.perf_counter()
+                await run_in_threadpool(_sync, f)
+                write_seconds += time.perf_counter() - started
+        finally:
+            record_stage("hash", hash_seconds)
+            record_stage("spool_write", write_seconds)
+            try:
+                if written:
+                    await self._record_range(upload_id, offset, offset + written)
+                # Kept only once its bytes are recorded, as unrecorded ones are sent again
+                if running is not None:
+                    _keep_running_hash(upload_id, running)
+            finally:
+                # Closing the file releases its lock, once the bytes are recorded
+                f.close()
+        return self.status(await self.get_session(upload_id))
+
+    async def _record_range(self, upload_id: str, start: int, end: int) -> None:
+        """Add a range to the bytes received by an upload.
+
+        Ranges recorded by concurrent requests are merged without losing one,
+        and a range overlapping one already recorded marks the upload to be
+        hashed again when it is finalized.
+        """
+        while True:
+            session = await self.db.get(UploadSession, upload_id, populate_existing=True)
+            if session is None:
+                return
+            received = json.loads(session.received)
+            values = {
+                "received": json.dumps(merge_range(received, start, end)),
+                "expires_at": datetime.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS),
+            }
+            if overlaps(received, start, end):
+                values["overlapped"] = True
+            with stage("commit"):
+                updated = (await self.db.execute(
+                    update(UploadSession)
+                    .where(UploadSession.id == upload_id, UploadSession.received == session.received)
+                    .values(**values)
+                )).rowcount
+                await self.db.commit()
+            if updated:
+                return
+
+    async def finalize(self, upload_id: str, background_tasks: Optional[BackgroundTasks] = None) -> DocumentResponse:
+        """Create the document of a complete upload.
+
+        Finalizing again returns the same document, so a client that lost the
+        response can retry. The session ends when the file is rejected, such
+        as when it is unreadable; after another error, the file is kept and
+        finalizing can be retried.
+        """
+        session = await self.get_session(upload_id)
+        if session.status == "completed":
+            return await self._completed_response(session)
+        if session.status == "failed":
+            raise HTTPException(status_code=409, detail="Upload failed")
+        if session.status != "open":
+            raise HTTPException(status_code=409, detail="Upload is being finalized")
+        if contiguous_offset(json.loads(session.received)) < session.length:
+            raise HTTPException(status_code=409, detail="Upload incomplete")
+
+        path = session_path(upload_id)
+        f = await run_in_threadpool(open, path, "rb")
+        try:
+            # Requests writing chunks hold the lock until their bytes are recorded
+            if not _lock_file(f, exclusive=True):
+                raise HTTPException(status_code=409, detail="Upload is being written by another request")
+            # Only one request finalizes the session, and no chunk is written afterwards
+            claimed = (await self.db.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload_id, UploadSession.status == "open")
+                .values(status="finalizing")
+            )).rowcount
+            await self.db.commit()
+        finally:
+            f.close()
+        if not claimed:
+            raise HTTPException(status_code=409, detail="Upload is being finalized")
+        session = await self.db.get(UploadSession, upload_id, populate_existing=True)
+
+        running = _running_hashes.pop(upload_id, None)
+        if running is None or session.overlapped:
+            running = RunningHash()
+        started = time.perf_counter()
+        sha256 = await run_in_threadpool(_finish_hash, path, running, session.length)
+        record_stage("hash", time.perf_counter() - started)
+
+        doc_uuid = str(uuid.uuid4())
+        upload = SpooledUpload(session.filename, await run_in_threadpool(_spool_link, path), sha256, session.length)
+        session.status = "completed"
+        session.document_uuid = doc_uuid
+        session.expires_at = datetime.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+        try:
+            response = await DocumentService(self.db).create_document(
+                session.bsc_number, session.category, upload, background_tasks, doc_uuid
+            )
+        except HTTPException as exc:
+            if exc.status_code >= 500:
+                await self._reopen(upload_id, upload, running)
+                raise
+            await self.db.execute(update(UploadSession).where(UploadSession.id == upload_id).values(status="failed"))
+            await self.db.commit()
+            DocumentService(self.db).discard_file(upload.tmp_path)
+            DocumentService(self.db).discard_file(path)
+            raise
+        except BaseException:
+            await self._reopen(upload_id, upload, running)
+            raise
+        DocumentService(self.db).discard_file(path)
+        return response
+
+    async def _reopen(self, upload_id: str, upload: SpooledUpload, running: RunningHash) -> None:
+        """Let finalizing be retried after the document could not be created."""
+        DocumentService(self.db).discard_file(upload.tmp_path)
+        await self.db.execute(update(UploadSession).where(UploadSession.id == upload_id).values(status="open"))
+        await self.db.commit()
+        _keep_running_hash(upload_id, running)
+
+    async def _completed_response(self, session: UploadSession) -> DocumentResponse:
+        document = await self.db.get(Document, session.document_uuid)
+        if document is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        return DocumentResponse(
+            uuid=document.uuid,
+            bsc_number=document.bsc_number,
+            category=document.category,
+            filesize=DocumentService(self.db).format_filesize(document.filesize),
+            message="Document uploaded successfully"
+        )
+
+    async def abort(self, upload_id: str) -> None:
+        """Cancel an upload and remove its chunks."""
+        session = await self.db.get(UploadSession, upload_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if session.status in ("finalizing", "completed"):
+            raise HTTPException(status_code=409, detail="Upload already finalized")
+        await self.db.delete(session)
+        await self.db.commit()
+        _running_hashes.pop(upload_id, None)
+        DocumentService(self.db).discard_file(session_path(upload_id))
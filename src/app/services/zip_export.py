@@ -0,0 +1,167 @@
+"""ZIP archives of documents, built while they are streamed.
+
+Entries are stored without compression (PDFs and JPEGs are compressed
+already) and written through ``zipfile`` into a sink that is drained after
+every chunk, so memory stays at about one chunk whatever the size of the
+archive. The output is not seekable, so each entry is followed by a data
+descriptor, and ZIP64 records are used past 4 GiB.
+"""
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+ZIP_MIN_DATE = datetime(1980, 1, 1)
+# Chunk size of the copies read back from a temporary file
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ExportEntry(NamedTuple):
+    name: str
+    sha256: str
+    upload_datetime: datetime
+    # Size of the original content, or None when it is missing, looked up
+    # when the entry is written
+    size: Callable[[], Optional[int]]
+    # Reader of (start, length) byte ranges of the original content
+    read_range: Callable[[int, int], Iterator[bytes]]
+    # Number of entries of the same content in the whole archive
+    copies: int = 1
+
+
+class _Sink:
+    """Write-only file object holding what zipfile wrote since it was last drained."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class _Copy:
+    """Content read for the first of its entries, kept for the others.
+
+    It is kept in memory or, when it does not fit in the memory left, in a
+    temporary file.
+    """
+
+    def __init__(self, size: int, remaining: int, in_memory: bool):
+        self.size = size
+        self.remaining = remaining
+        self.chunks: Optional[List[bytes]] = [] if in_memory else None
+        self.file = None if in_memory else tempfile.TemporaryFile()
+        self.complete = False
+
+    @property
+    def buffered(self) -> int:
+        return self.size if self.chunks is not None else 0
+
+    def tee(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Yield the chunks read from storage, keeping them."""
+        for chunk in chunks:
+            if self.chunks is not None:
+                self.chunks.append(chunk)
+            else:
+                self.file.write(chunk)
+            yield chunk
+        self.complete = True
+
+    def read(self) -> Iterator[bytes]:
+        if self.chunks is not None:
+            return iter(self.chunks)
+        self.file.seek(0)
+        return iter(partial(self.file.read, COPY_CHUNK_SIZE), b"")
+
+    def close(self) -> None:
+        self.chunks = None
+        if self.file is not None:
+            self.file.close()
+
+
+def unique_name(filename: str, fallback: str, used: Dict[str, int]) -> str:
+    """A safe archive name for a file, numbered when the name is already taken."""
+    name = os.path.basename(filename.replace("\\", "/")).strip() or fallback
+    stem, extension = os.path.splitext(name)
+    count = used.get(name.lower(), 0)
+    used[name.lower()] = count + 1
+    if count:
+        return unique_name(f"{stem} ({count + 1}){extension}", fallback, used)
+    return name
+
+
+def iter_zip(pages: Iterable[List[ExportEntry]], buffer_bytes: int) -> Iterator[bytes]:
+    """Yield a ZIP archive of entries given in pages.
+
+    Entries of the same content within a page are written one after another.
+    The size of a content is looked up once and its content read from
+    storage once per archive: it is kept for the other entries (``copies``)
+    in memory up to ``buffer_bytes`` in total and in temporary files
+    beyond, until the last of them is written. Entries whose content is
+    missing are left out, as the archive is already streaming.
+    """
+    return (data for data in _iter_archive(pages, buffer_bytes) if data)
+
+
+def _iter_archive(pages: Iterable[List[ExportEntry]], buffer_bytes: int) -> Iterator[bytes]:
+    sink = _Sink()
+    # Copies kept for entries of later pages
+    kept: Dict[str, _Copy] = {}
+    buffered = 0
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for entries in pages:
+                groups: Dict[str, List[ExportEntry]] = {}
+                for entry in entries:
+                    groups.setdefault(entry.sha256, []).append(entry)
+
+                for sha256, group in groups.items():
+                    copy = kept.pop(sha256, None)
+                    if copy is None:
+                        size = group[0].size()
+                        if size is None:
+                            continue
+                        copies = max(group[0].copies, len(group))
+                        if copies > 1:
+                            copy = _Copy(size, copies, size <= buffer_bytes - buffered)
+                            buffered += copy.buffered
+                    else:
+                        size = copy.size
+                    for entry in group:
+                        info = zipfile.ZipInfo(entry.name, max(entry.upload_datetime, ZIP_MIN_DATE).timetuple()[:6])
+                        info.compress_type = zipfile.ZIP_STORED
+                        info.file_size = size
+                        info.external_attr = 0o644 << 16
+                        if copy is None:
+                            chunks = entry.read_range(0, size)
+                        elif copy.complete:
+                            chunks = copy.read()
+                        else:
+                            chunks = copy.tee(entry.read_range(0, size))
+                        with archive.open(info, "w") as f:
+                            for chunk in chunks:
+                                f.write(chunk)
+                                yield sink.drain()
+                        yield sink.drain()
+                    if copy is not None:
+                        copy.remaining -= len(group)
+                        if copy.remaining > 0:
+                            kept[sha256] = copy
+                        else:
+                            buffered -= copy.buffered
+                            copy.close()
+        yield sink.drain()
+    finally:
+        for copy in kept.values():
+            copy.close()
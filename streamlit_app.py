@@ -2,11 +2,49 @@ import streamlit as st
 import requests
 import os
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 
 # ============================
 # 📦 API Configuration
 # ============================
-API_BASE_URL = "http://localhost:8000/api"
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000/api")
+# URL of the API as seen by the browser, which downloads documents from it directly
+API_PUBLIC_URL = os.getenv("API_PUBLIC_URL", API_BASE_URL)
+# (connect, read) timeouts in seconds
+REQUEST_TIMEOUT = (5, 60)
+PAGE_SIZES = [25, 50, 100, 250]
+# Pages of documents are cached for this long, and cleared on upload
+CACHE_TTL_SECONDS = 30
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+CATEGORIES = ["INV", "PCK", "BIL", "DED", "DOM", "DAU", "OTH"]
+
+# ============================
+# 🌐 Shared HTTP Session
+# ============================
+@st.cache_resource
+def http_session():
+    """A keep-alive session shared by every rerun and user of the app."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_documents_page(endpoint, bsc_number, category, limit, cursor):
+    """Fetch one page of documents and the cursor of the next page (None on the last one)."""
+    params = {"limit": limit}
+    if bsc_number:
+        params["bsc_number"] = bsc_number
+    if category:
+        params["category"] = category
+    if cursor:
+        params["cursor"] = cursor
+
+    response = http_session().get(f"{API_BASE_URL}/documents/{endpoint}", params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json(), response.headers.get("X-Next-Cursor")
 
 # ============================
 # 📄 Streamlit App Entry Point
@@ -40,10 +78,7 @@ def upload_document():
 
     with st.form("upload_form"):
         bsc_number = st.text_input("BSC Number")
-        category = st.selectbox(
-            "Document Category",
-            ["INV", "PCK", "BIL", "DED", "DOM", "DAU", "OTH"]
-        )
+        category = st.selectbox("Document Category", CATEGORIES)
         uploaded_file = st.file_uploader("Choose a file", type=["pdf", "jpg", "jpeg"])
 
         submitted = st.form_submit_button("📤 Upload Document")
@@ -55,12 +90,16 @@ def upload_document():
 
             try:
                 files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-                response = requests.post(
-                    f"{API_BASE_URL}/documents/upload?bsc_number={bsc_number}&category={category}",
-                    files=files
+                response = http_session().post(
+                    f"{API_BASE_URL}/documents/upload",
+                    params={"bsc_number": bsc_number, "category": category},
+                    files=files,
+                    timeout=REQUEST_TIMEOUT
                 )
 
                 if response.status_code == 200:
+                    # The new document shows up on the next page view
+                    fetch_documents_page.clear()
                     st.success("✅ Document uploaded successfully!")
                 else:
                     st.error(f"❌ Error uploading document: {response.text}")
@@ -72,24 +111,7 @@ def upload_document():
 # ============================
 def view_documents():
     st.header("📑 View All Documents")
-
-    try:
-        response = requests.get(f"{API_BASE_URL}/documents/list")
-
-        if response.status_code == 200:
-            documents = response.json()
-
-            if not documents:
-                st.info("📂 No documents found.")
-                return
-
-            st.success(f"📊 {len(documents)} documents found.")
-            for doc in documents:
-                display_document_card(doc)
-        else:
-            st.error(f"❌ Error fetching documents: {response.text}")
-    except Exception as e:
-        st.error(f"⚠️ An error occurred: {str(e)}")
+    display_documents_table("view", "list", None, None)
 
 # ============================
 # 🔍 Search Documents Page
@@ -99,93 +121,140 @@ def search_documents():
 
     with st.form("search_form"):
         bsc_number = st.text_input("BSC Number")
-        category = st.selectbox(
-            "Document Category",
-            ["All", "INV", "PCK", "BIL", "DED", "DOM", "DAU", "OTH"]
-        )
+        category = st.selectbox("Document Category", ["All"] + CATEGORIES)
 
         submitted = st.form_submit_button("🔍 Search")
 
-        if submitted:
-            try:
-                params = {}
-                if bsc_number:
-                    params["bsc_number"] = bsc_number
-                if category != "All":
-                    params["category"] = category
-
-                response = requests.get(f"{API_BASE_URL}/documents/search", params=params)
-
-                if response.status_code == 200:
-                    documents = response.json()
-
-                    if not documents:
-                        st.info("📂 No documents match your search criteria.")
-                        return
+    # Kept across reruns so paging and downloads do not lose the results
+    if submitted:
+        st.session_state["search_filters"] = (bsc_number or None, None if category == "All" else category)
 
-                    st.success(f"🔍 {len(documents)} documents found.")
-                    for doc in documents:
-                        display_document_card(doc)
-                else:
-                    st.error(f"❌ Error during search: {response.text}")
-            except Exception as e:
-                st.error(f"⚠️ An error occurred: {str(e)}")
+    filters = st.session_state.get("search_filters")
+    if filters is not None:
+        display_documents_table("search", "search", *filters)
 
 # ============================
-# 📑 Document Card Display Helper
+# 📑 Paginated Documents Table
 # ============================
-def display_document_card(doc):
-    """Display a document's metadata and actions inside an expander."""
-    bsc_number  = doc.get('bsc_number', 'N/A')
-    category    = doc.get('category', 'N/A')
-    upload_date = doc.get('upload_datetime', 'N/A')
-    filesize    = doc.get('filesize', 'N/A')
-    page_number = doc.get('page_number', 'N/A')
-    doc_uuid    = doc.get('uuid')
-    filename    = doc.get('filename', f"Document_{doc_uuid}")
+def display_documents_table(key, endpoint, bsc_number, category):
+    """Display one page of documents in a table, with cursor-based paging and downloads.
 
-    with st.expander(f"📄 Document | 🔖 BSC: {bsc_number} | 📂 Type: {category}"):
-        col1, col2 = st.columns(2)
+    The cursors of the pages visited are kept in the session state, so going
+    back a page reuses the cached request of that page.
+    """
+    limit = st.selectbox("Documents per page", PAGE_SIZES, index=2, key=f"{key}_limit")
 
-        with col1:
-            st.markdown("### 📑 Document Info")
-            st.markdown(f"**🔖 BSC Number:** `{bsc_number}`")
-            st.markdown(f"**📂 Category:** `{category}`")
-            st.markdown(f"**🗓️ Upload Date:** `{upload_date}`")
+    # Paging restarts when the query changes
+    query = (endpoint, bsc_number, category, limit)
+    if st.session_state.get(f"{key}_query") != query:
+        st.session_state[f"{key}_query"] = query
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
 
-        with col2:
-            st.markdown("### ⚙️ File Details")
-            st.markdown(f"**📦 File Size:** `{filesize}`")
-            st.markdown(f"**📄 Pages:** `{page_number}`")
+    try:
+        documents, next_cursor = fetch_documents_page(endpoint, bsc_number, category, limit, cursors[-1])
+    except requests.HTTPError as e:
+        st.error(f"❌ Error fetching documents: {e.response.text}")
+        return
+    except Exception as e:
+        st.error(f"⚠️ An error occurred: {str(e)}")
+        return
+
+    if not documents and len(cursors) == 1:
+        st.info("📂 No documents found.")
+        return
+
+    first = (len(cursors) - 1) * limit + 1
+    if documents:
+        st.success(f"📊 Documents {first} to {first + len(documents) - 1}" + ("" if next_cursor else " (last page)"))
+    else:
+        st.info("📂 No more documents.")
+
+    # The table is virtualized, so a page of any size renders smoothly
+    st.dataframe(
+        [
+            {
+                "BSC Number": doc.get("bsc_number", "N/A"),
+                "Category": doc.get("category", "N/A"),
+                "Upload Date": format_datetime(doc.get("upload_datetime")),
+                "File Size": doc.get("filesize", "N/A"),
+                "Pages": doc.get("page_number"),
+                "Download": f"{API_PUBLIC_URL}/documents/download/{doc.get('uuid')}",
+            }
+            for doc in documents
+        ],
+        column_config={"Download": st.column_config.LinkColumn("Download", display_text="📥 Download")},
+        hide_index=True,
+        use_container_width=True
+    )
 
-        st.markdown("---")
+    col1, col2, _ = st.columns([1, 1, 6])
+    with col1:
+        if st.button("⬅️ Previous", key=f"{key}_previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if st.button("Next ➡️", key=f"{key}_next", disabled=not next_cursor):
+            cursors.append(next_cursor)
+            st.rerun()
 
-        if st.button("📥 Download Document", key=f"download_{doc_uuid}"):
-            download_document(doc_uuid)
+    if not documents:
+        return
+
+    st.markdown("---")
+    options = {
+        f"🔖 {doc.get('bsc_number', 'N/A')} | 📂 {doc.get('category', 'N/A')} | 🗓️ {format_datetime(doc.get('upload_datetime'))} | {doc.get('uuid')}": doc.get("uuid")
+        for doc in documents
+    }
+    selected = st.selectbox("Save a document to the downloads folder", list(options), key=f"{key}_selected")
+    if st.button("📥 Save Document", key=f"{key}_save"):
+        download_document(options[selected])
+
+def format_datetime(value):
+    if not value:
+        return "N/A"
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M")
+    except ValueError:
+        return value
 
 # ============================
 # 📥 Document Download Handler
 # ============================
 def download_document(doc_uuid):
-    """Download a document by its UUID."""
+    """Download a document by its UUID into the downloads folder.
+
+    The response is written in chunks as it arrives, so large documents are
+    never held in memory.
+    """
     try:
-        print(doc_uuid)
-        response = requests.get(f"{API_BASE_URL}/documents/download/{doc_uuid}")
+        with http_session().get(
+            f"{API_BASE_URL}/documents/download/{doc_uuid}", stream=True, timeout=REQUEST_TIMEOUT
+        ) as response:
+            if response.status_code != 200:
+                st.error(f"❌ Error downloading document: {response.text}")
+                return
 
-        if response.status_code == 200:
-            filename = response.headers.get('content-disposition', '').split('filename=')[-1]
+            filename = response.headers.get('content-disposition', '').split('filename=')[-1].strip('"')
             if not filename:
                 filename = f"document_{doc_uuid}.pdf"
 
             os.makedirs("downloads", exist_ok=True)
-            file_path = os.path.join("downloads", filename)
-
-            with open(file_path, "wb") as f:
-                f.write(response.content)
+            file_path = os.path.join("downloads", os.path.basename(filename))
 
-            st.success(f"✅ Document downloaded successfully to `{file_path}`")
-        else:
-            st.error(f"❌ Error downloading document: {response.text}")
+            # Written next to its final name so a failed download leaves no partial file behind
+            part_path = f"{file_path}.part"
+            try:
+                with open(part_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(part_path, file_path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+        st.success(f"✅ Document downloaded successfully to `{file_path}`")
     except Exception as e:
         st.error(f"⚠️ An error occurred while downloading: {str(e)}")
 
@@ -0,0 +1,53 @@
+"""Settings of the test run, applied before the app is imported.
+
+The app keeps its blobs in a bucket of an in-process S3 server (moto), and
+its database and local files in a temporary directory.
+"""
+import os
+import socket
+import tempfile
+
+import pytest
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+S3_PORT = _free_port()
+S3_BUCKET = "documents"
+TEST_DIR = tempfile.mkdtemp(prefix="docapi-tests-")
+
+os.environ.update(
+    UPLOAD_DIR=os.path.join(TEST_DIR, "uploads"),
+    DATABASE_URL=f"sqlite:///{os.path.join(TEST_DIR, 'documents.db')}",
+    STORAGE_BACKEND="s3",
+    S3_BUCKET=S3_BUCKET,
+    S3_PREFIX="blobs",
+    S3_ENDPOINT_URL=f"http://127.0.0.1:{S3_PORT}",
+    S3_REGION="us-east-1",
+    S3_ACCESS_KEY_ID="testing",
+    S3_SECRET_ACCESS_KEY="testing",
+    PROCESS_POOL_SIZE="0",
+    RENDITION_WARMUP_PAGES="0",
+    TEXT_INDEX_ENABLED="false",
+    NEAR_DUPLICATE_ENABLED="false",
+)
+
+
+@pytest.fixture(scope="session")
+def s3_server():
+    """An S3 server in a thread of the test process, with an empty bucket."""
+    server_module = pytest.importorskip("moto.server")
+    boto3 = pytest.importorskip("boto3")
+    server = server_module.ThreadedMotoServer(ip_address="127.0.0.1", port=S3_PORT)
+    server.start()
+    client = boto3.client(
+        "s3", endpoint_url=os.environ["S3_ENDPOINT_URL"], region_name="us-east-1",
+        aws_access_key_id="testing", aws_secret_access_key="testing"
+    )
+    client.create_bucket(Bucket=S3_BUCKET)
+    yield client
+    server.stop()
@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+
+from src.app.services.document_pool import DocumentPool
+
+
+def make_pdf(pages: int) -> bytes:
+    document = fitz.open()
+    for _ in range(pages):
+        document.new_page()
+    return document.tobytes()
+
+
+def page_count(document: fitz.Document) -> int:
+    return document.page_count
+
+
+def test_hits_are_not_blocked_by_a_slow_read():
+    pool = DocumentPool(max_documents=4, max_bytes=1024 * 1024)
+    assert pool.use("hot", lambda: (make_pdf(1), 1), page_count) == 1
+
+    reading = threading.Event()
+    release = threading.Event()
+
+    def slow_reader():
+        reading.set()
+        assert release.wait(10)
+        return make_pdf(2), 1
+
+    with ThreadPoolExecutor(2) as executor:
+        slow = executor.submit(pool.use, "cold", slow_reader, page_count)
+        assert reading.wait(10)
+        # The hot document is used while the cold one is still being read
+        assert executor.submit(pool.use, "hot", None, page_count).result(timeout=10) == 1
+        release.set()
+        assert slow.result(timeout=10) == 2
+    pool.clear()
+
+
+def test_concurrent_misses_read_once():
+    pool = DocumentPool(max_documents=4, max_bytes=1024 * 1024)
+    reads = []
+    release = threading.Event()
+
+    def reader():
+        reads.append(1)
+        assert release.wait(10)
+        return make_pdf(3), 1
+
+    with ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(pool.use, "same", reader, page_count) for _ in range(4)]
+        release.set()
+        assert [future.result(timeout=10) for future in futures] == [3] * 4
+    assert len(reads) == 1
+    pool.clear()
+
+
+def test_eviction_closes_documents():
+    pool = DocumentPool(max_documents=1, max_bytes=1024 * 1024)
+    documents = []
+    pool.use("first", lambda: (make_pdf(1), 1), documents.append)
+    pool.use("second", lambda: (make_pdf(1), 1), documents.append)
+    assert documents[0].is_closed and not documents[1].is_closed
+    pool.clear()
+    assert documents[1].is_closed
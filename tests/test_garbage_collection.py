@@ -0,0 +1,71 @@
+import hashlib
+from typing import Tuple
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from src.app.database import Base, create_db_engine
+from src.app.models import (
+    ContentPage, Document, FileContent, IntegrityFinding, PageHash, SimilarContent
+)
+from src.app.services import storage_maintenance
+from src.app.services.blob_store import blob_store
+from src.app.services.text_index import create_text_index
+
+
+def enforce_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+@pytest.fixture
+def db(tmp_path, s3_server):
+    """A session on a database enforcing its foreign keys, like PostgreSQL does."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'foreign-keys.db'}")
+    event.listen(engine, "connect", enforce_foreign_keys)
+    Base.metadata.create_all(bind=engine)
+    create_text_index(engine)
+    with blob_store.blocking_portal(), Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def store_content(db: Session, tmp_path, data: bytes, reference_count: int) -> Tuple[str, str]:
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = tmp_path / sha256
+    path.write_bytes(data)
+    key = blob_store.key_for(sha256)
+    blob_store.put_file(str(path), key)
+    db.add(FileContent(sha256=sha256, file_path=key, reference_count=reference_count, size=len(data)))
+    db.flush()
+    return sha256, key
+
+
+def test_collect_garbage_with_foreign_keys(db, tmp_path):
+    unused, unused_key = store_content(db, tmp_path, b"unused content", 0)
+    kept, kept_key = store_content(db, tmp_path, b"kept content", 1)
+    db.add(Document(
+        uuid="kept", bsc_number="GC", category="DED", page_number=1, filename="kept.pdf",
+        filesize=0.1, sha256=kept
+    ))
+    db.add_all([
+        ContentPage(sha256=unused, page=1, body="unused page"),
+        ContentPage(sha256=kept, page=1, body="kept page"),
+        PageHash(sha256=unused, page=1, phash=1, band0=0, band1=0, band2=0, band3=1),
+        SimilarContent(sha256=unused, similar_sha256=kept, similarity=1.0),
+        SimilarContent(sha256=kept, similar_sha256=unused, similarity=1.0),
+        IntegrityFinding(sha256=unused, file_path=unused_key, problem="missing"),
+    ])
+    db.commit()
+
+    stats = storage_maintenance.collect_garbage(db)
+
+    assert stats["unreferenced"] == 1
+    assert db.scalars(select(FileContent.sha256)).all() == [kept]
+    assert db.scalars(select(ContentPage.sha256)).all() == [kept]
+    assert db.scalars(select(PageHash.sha256)).all() == []
+    assert db.scalars(select(SimilarContent.sha256)).all() == []
+    assert db.scalars(select(IntegrityFinding.sha256)).all() == []
+    assert not blob_store.exists(unused_key)
+    assert blob_store.exists(kept_key)
+    blob_store.delete(kept_key)
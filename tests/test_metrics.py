@@ -0,0 +1,29 @@
+import json
+import os
+
+from src.app import metrics
+from src.app.config import settings
+
+
+def test_exited_workers_are_folded(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_DIR", str(tmp_path))
+    # A pid no process can have
+    exited = {metrics.UPLOADS.name: [[["stored"], 3]], metrics.REQUESTS_IN_FLIGHT.name: [[[], 2]]}
+    (tmp_path / "4194305.json").write_text(json.dumps(exited))
+    (tmp_path / metrics.RETIRED_METRICS).write_text(json.dumps({metrics.UPLOADS.name: [[["stored"], 4]]}))
+
+    metrics.retire_exited_workers()
+
+    assert sorted(os.listdir(tmp_path)) == [".lock", metrics.RETIRED_METRICS]
+    state = {metric.name: metric.empty().state() for metric in metrics.REGISTRY}
+    by_name = {metric.name: metric for metric in metrics.collect_metrics(state)}
+    assert by_name[metrics.UPLOADS.name].value("stored") == 7
+    assert by_name[metrics.REQUESTS_IN_FLIGHT.name].value() == 0
+
+
+def test_render_does_not_change_the_registry():
+    before = metrics.DEDUP_HIT_RATIO.state()
+    state = metrics.metrics_state()
+    state[metrics.UPLOADS.name] = [[["deduplicated"], 1], [["stored"], 1]]
+    assert "docapi_dedup_hit_ratio 0.5" in metrics.render_metrics(state)
+    assert metrics.DEDUP_HIT_RATIO.state() == before
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.services import processing
+from src.app.services.blob_store import blob_store
+
+
+def spooled_files():
+    if not os.path.isdir(blob_store.spool_dir):
+        return []
+    return os.listdir(blob_store.spool_dir)
+
+
+def test_unreadable_document_is_rejected(s3_server):
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/documents/upload", params={"bsc_number": "PROBE", "category": "DED"},
+            files={"file": ("broken.pdf", b"not a pdf", "application/pdf")}
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Unreadable document"
+
+        response = client.post(
+            "/api/documents/upload/batch", params={"bsc_number": "PROBE", "category": "DED"},
+            files=[("files", ("broken.jpg", b"not a jpeg", "image/jpeg"))]
+        )
+        assert response.status_code == 200
+        assert response.json()["documents"][0]["message"] == "Unreadable document"
+    assert spooled_files() == []
+
+
+def test_probe_failure_is_not_a_client_error(s3_server, monkeypatch):
+    def probe_file(file_path, filename):
+        raise MemoryError
+
+    monkeypatch.setattr(processing, "probe_file", probe_file)
+    with TestClient(app) as client:
+        with pytest.raises(MemoryError):
+            client.post(
+                "/api/documents/upload", params={"bsc_number": "PROBE", "category": "DED"},
+                files={"file": ("probe.pdf", b"%PDF-1.4 probe", "application/pdf")}
+            )
+    assert spooled_files() == []
@@ -0,0 +1,168 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("aiobotocore")
+
+from fastapi.testclient import TestClient
+
+from src.app.config import settings
+from src.app.database import SessionLocal
+from src.app.main import app
+from src.app.services import storage_maintenance
+from src.app.services.blob_store import blob_store
+from src.app.services.storage_backends import S3Storage
+
+import fitz
+
+
+def make_pdf(pages: int, tag: str) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f"{tag} page {number + 1}")
+    return document.tobytes()
+
+
+@pytest.fixture
+def storage(s3_server):
+    # Files from 10 MiB are uploaded in parts of 5 MiB, the smallest S3 accepts
+    return S3Storage(
+        settings.S3_BUCKET, "backend-tests", settings.S3_ENDPOINT_URL, settings.S3_REGION,
+        settings.S3_ACCESS_KEY_ID, settings.S3_SECRET_ACCESS_KEY,
+        multipart_threshold=10 * 1024 * 1024, multipart_chunk_size=5 * 1024 * 1024
+    )
+
+
+def write_file(tmp_path, data: bytes) -> str:
+    path = tmp_path / "blob"
+    path.write_bytes(data)
+    return str(path)
+
+
+def run(storage: S3Storage, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await storage.close()
+    return asyncio.run(main())
+
+
+async def read(storage: S3Storage, key: str, start: int = 0, length=None) -> bytes:
+    return b"".join([chunk async for chunk in storage.get_stream(key, start, length)])
+
+
+def test_put_get_and_range(storage, tmp_path):
+    data = os.urandom(100_000)
+
+    async def scenario():
+        await storage.put(write_file(tmp_path, data), "ab/cd/abcd")
+        return (
+            await read(storage, "ab/cd/abcd"),
+            await read(storage, "ab/cd/abcd", 1000, 500),
+            await read(storage, "ab/cd/abcd", 99_000),
+            await storage.stat("ab/cd/abcd"),
+        )
+
+    full, middle, tail, stat = run(storage, scenario())
+    assert full == data
+    assert middle == data[1000:1500]
+    assert tail == data[99_000:]
+    assert stat.size == len(data)
+    # The source file is consumed
+    assert not os.path.exists(tmp_path / "blob")
+
+
+def test_missing_object(storage):
+    async def scenario():
+        assert await storage.stat("no/ne/none") is None
+        assert not await storage.exists("no/ne/none")
+        assert not await storage.delete("no/ne/none")
+        with pytest.raises(FileNotFoundError):
+            await read(storage, "no/ne/none")
+
+    run(storage, scenario())
+
+
+def test_delete_and_list(storage, tmp_path):
+    async def scenario():
+        await storage.put(write_file(tmp_path, b"first"), "11/11/1111")
+        await storage.put(write_file(tmp_path, b"second"), "22/22/2222")
+        listed = sorted([key async for key, _ in storage.list()])
+        deleted = await storage.delete("11/11/1111")
+        remaining = sorted([key async for key, _ in storage.list()])
+        return listed, deleted, remaining
+
+    listed, deleted, remaining = run(storage, scenario())
+    assert {"11/11/1111", "22/22/2222"} <= set(listed)
+    assert deleted
+    assert "11/11/1111" not in remaining and "22/22/2222" in remaining
+
+
+def test_multipart_upload(storage, tmp_path, s3_server):
+    data = os.urandom(12 * 1024 * 1024)
+
+    async def scenario():
+        await storage.put(write_file(tmp_path, data), "mu/lt/multipart")
+        return await read(storage, "mu/lt/multipart"), await read(storage, "mu/lt/multipart", 6 * 1024 * 1024, 10)
+
+    full, part = run(storage, scenario())
+    assert full == data
+    assert part == data[6 * 1024 * 1024:6 * 1024 * 1024 + 10]
+    # Three parts: two of 5 MiB and the rest
+    head = s3_server.head_object(Bucket=settings.S3_BUCKET, Key="backend-tests/mu/lt/multipart")
+    assert head["ETag"].strip('"').endswith("-3")
+
+
+def test_client_per_event_loop(storage, tmp_path):
+    async def put(key: str):
+        await storage.put(write_file(tmp_path, b"data"), key)
+        return len(storage._clients)
+
+    # The client of a loop closed without closing it is dropped
+    assert asyncio.run(put("lo/op/first")) == 1
+    assert run(storage, put("lo/op/second")) == 1
+    assert not storage._clients and not storage._exit_stacks
+
+
+def test_upload_and_download(s3_server):
+    data = make_pdf(3, "S3")
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/documents/upload", params={"bsc_number": "S3", "category": "DED"},
+            files={"file": ("s3.pdf", data, "application/pdf")}
+        )
+        assert response.status_code == 200
+        doc_uuid = response.json()["uuid"]
+
+        objects = s3_server.list_objects_v2(Bucket=settings.S3_BUCKET, Prefix="blobs/")["Contents"]
+        assert len(objects) == 1 and objects[0]["Size"] == len(data)
+        # Only temporary files would stay on the local disk
+        local = [name for _, _, names in os.walk(os.path.join(settings.UPLOAD_DIR, "blobs")) for name in names
+                 if not name.endswith(".lock")]
+        assert local == []
+
+        response = client.get(f"/api/documents/download/{doc_uuid}")
+        assert response.status_code == 200
+        assert response.content == data
+
+        response = client.get(f"/api/documents/download/{doc_uuid}", headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == data[100:200]
+
+        # A second upload of the same content reuses the object
+        response = client.post(
+            "/api/documents/upload", params={"bsc_number": "S3", "category": "DED"},
+            files={"file": ("copy.pdf", data, "application/pdf")}
+        )
+        assert response.json()["message"] == "Document uploaded successfully (deduplicated)"
+        copy_uuid = response.json()["uuid"]
+
+        assert client.delete(f"/api/documents/{doc_uuid}").status_code == 200
+        assert client.delete(f"/api/documents/{copy_uuid}").status_code == 200
+
+    with blob_store.blocking_portal(), SessionLocal() as db:
+        stats = storage_maintenance.collect_garbage(db, grace_seconds=0)
+    assert stats["unreferenced"] == 1
+    assert s3_server.list_objects_v2(Bucket=settings.S3_BUCKET, Prefix="blobs/").get("Contents", []) == []
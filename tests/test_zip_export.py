@@ -0,0 +1,44 @@
+import io
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from src.app.services.zip_export import ExportEntry, iter_zip
+
+
+def make_entries(contents, reads, copies):
+    def entry(name, sha256):
+        data = contents[sha256]
+
+        def read_range(start, length):
+            reads.append(sha256)
+            for offset in range(start, start + length, 4):
+                yield data[offset:min(offset + 4, start + length)]
+
+        return ExportEntry(
+            name=name, sha256=sha256, upload_datetime=datetime(2024, 1, 1),
+            size=lambda: len(data), read_range=read_range, copies=copies.get(sha256, 1)
+        )
+    return entry
+
+
+@pytest.mark.parametrize("buffer_bytes", [0, 1024])
+def test_shared_content_is_read_once_per_archive(buffer_bytes):
+    contents = {"a": b"first content", "b": b"second content", "c": b"third"}
+    reads = []
+    entry = make_entries(contents, reads, {"a": 3, "b": 2})
+    pages = [
+        [entry("a1.pdf", "a"), entry("b1.pdf", "b")],
+        [entry("c.pdf", "c"), entry("a2.pdf", "a")],
+        [entry("b2.pdf", "b"), entry("a3.pdf", "a")],
+    ]
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(pages, buffer_bytes))))
+
+    assert archive.testzip() is None
+    assert {name: archive.read(name) for name in archive.namelist()} == {
+        "a1.pdf": contents["a"], "b1.pdf": contents["b"], "c.pdf": contents["c"],
+        "a2.pdf": contents["a"], "b2.pdf": contents["b"], "a3.pdf": contents["a"],
+    }
+    assert sorted(reads) == ["a", "b", "c"]